@@ -1,6 +1,8 @@
 from accounts.models import UserProfile
+from accounts.services import UserService
 from django.contrib.auth.models import User, Group
 from rest_framework import serializers, exceptions
+from utils.serializers import PrefetchListSerializer
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -14,13 +16,19 @@ class UserSerializerWithProfile(UserSerializer):
     avatar_url=serializers.SerializerMethodField()
 
     def get_avatar_url(self, obj):
-        if obj.profile.avatar:
-            return obj.pro.avatar.url
+        profile = obj.profile
+        if profile.avatar:
+            return profile.avatar.url
         return None
 
     class Meta:
         model = User
         fields = ('id', 'username', 'nickname', 'avatar_url')
+        list_serializer_class = PrefetchListSerializer
+
+    def prefetch(self, users):
+        # the serializers embedding a user call it with the users of a page
+        UserService.hydrate_profiles(users)
 
 
 class UserSerializerForTweet(UserSerializerWithProfile):
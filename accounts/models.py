@@ -26,7 +26,7 @@ def get_profile(user):
     profile = UserService.get_profile_through_cache(user.id)
     # use the attribute of user object to cache
     # to avoid multiple times of querying the same user profile (duplicate db query)
-    setattr(user, 'cached_user_profile', profile)
+    setattr(user, '_cached_user_profile', profile)
     return profile
 
 
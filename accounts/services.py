@@ -26,8 +26,51 @@ class UserService:
 
         # cache miss, read from db
         profile, _ = UserProfile.objects.get_or_create(user_id=user_id)
+        # using default expire time
+        cache.set(key, profile)
         return profile
 
+    @classmethod
+    def get_profiles(cls, user_ids):
+        """
+        {user_id: profile} with one get_many, the misses are read with a
+        single query and written back with one set_many. a user without a
+        profile yet gets one, as in get_profile_through_cache.
+        """
+        user_ids = list(dict.fromkeys(user_ids))
+        keys = {USER_PROFILE_PATTERN.format(user_id=user_id): user_id for user_id in user_ids}
+        profiles = {
+            keys[key]: profile
+            for key, profile in cache.get_many(list(keys)).items()
+            if profile is not None
+        }
+
+        missing_ids = [user_id for user_id in user_ids if user_id not in profiles]
+        if missing_ids:
+            loaded_profiles = {
+                profile.user_id: profile
+                for profile in UserProfile.objects.filter(user_id__in=missing_ids)
+            }
+            for user_id in missing_ids:
+                if user_id not in loaded_profiles:
+                    loaded_profiles[user_id], _ = UserProfile.objects.get_or_create(user_id=user_id)
+            cache.set_many({
+                USER_PROFILE_PATTERN.format(user_id=user_id): profile
+                for user_id, profile in loaded_profiles.items()
+            })
+            profiles.update(loaded_profiles)
+        return profiles
+
+    @classmethod
+    def hydrate_profiles(cls, users):
+        # user.profile of all the users, fetched together with get_profiles
+        users = [user for user in users if not hasattr(user, '_cached_user_profile')]
+        if not users:
+            return
+        profiles = cls.get_profiles([user.id for user in users])
+        for user in users:
+            setattr(user, '_cached_user_profile', profiles[user.id])
+
     @classmethod
     def invalidate_profile(cls, user_id):
         key = USER_PROFILE_PATTERN.format(user_id=user_id)
@@ -1,4 +1,5 @@
 from accounts.models import UserProfile
+from accounts.services import UserService
 from testing.testcases import TestCase
 
 
@@ -12,4 +13,37 @@ class UserProfileTests(TestCase):
         p = bob.profile
         self.assertEqual(isinstance(p, UserProfile), True)
         self.assertEqual(UserProfile.objects.count(), 1)
+        # memoized on the user
+        with self.assertNumQueries(0):
+            self.assertEqual(bob.profile, p)
 
+    def test_profile_cache(self):
+        users = [self.create_user('user{}'.format(i)) for i in range(3)]
+        users[0].profile
+
+        # the profile is cached after a cache miss
+        with self.assertNumQueries(0):
+            self.assertEqual(UserService.get_profile_through_cache(users[0].id).user_id, users[0].id)
+
+        # missing profiles are created, then read from the cache together
+        profiles = UserService.get_profiles([user.id for user in users])
+        self.assertEqual({user_id: profile.user_id for user_id, profile in profiles.items()}, {
+            user.id: user.id for user in users
+        })
+        self.assertEqual(UserProfile.objects.count(), 3)
+        with self.assertNumQueries(0):
+            profiles = UserService.get_profiles([user.id for user in users])
+        self.assertEqual(len(profiles), 3)
+
+        # changing a profile invalidates it
+        profile = profiles[users[1].id]
+        profile.nickname = 'nick'
+        profile.save()
+        self.assertEqual(UserService.get_profiles([users[1].id])[users[1].id].nickname, 'nick')
+
+        # a page of users reads its profiles in one step
+        self.clear_cache()
+        users = [self.create_user('other{}'.format(i)) for i in range(3)]
+        UserService.hydrate_profiles(users)
+        with self.assertNumQueries(0):
+            self.assertEqual([user.profile.user_id for user in users], [user.id for user in users])
@@ -1,13 +1,16 @@
 from accounts.api.serializers import UserSerializerForComment
 from comments.models import Comment
+from django.contrib.auth.models import User
 from likes.services import LikeService
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
 from tweets.models import Tweet
+from utils.memcached_helper import MemcachedHelper
+from utils.serializers import PrefetchListSerializer
 
 
 class CommentSerializer(serializers.ModelSerializer):
-    user = UserSerializerForComment()
+    user = UserSerializerForComment(source='cached_user')
     has_liked = serializers.SerializerMethodField()
     likes_count = serializers.SerializerMethodField()
 
@@ -22,6 +25,12 @@ class CommentSerializer(serializers.ModelSerializer):
             'has_liked',
             'likes_count',
         )
+        list_serializer_class = PrefetchListSerializer
+
+    def prefetch(self, comments):
+        MemcachedHelper.hydrate_objects(comments, User, 'user_id', 'hydrated_user')
+        users = [comment.hydrated_user for comment in comments if comment.hydrated_user is not None]
+        self.fields['user'].prefetch(users)
 
     def get_likes_count(self, obj):
         return obj.like_set.count()
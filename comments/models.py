@@ -35,7 +35,7 @@ class Comment(models.Model):
 
     @property
     def cached_user(self):
-        return MemcachedHelper.get_object_through_cache(User, self.user_id)
+        return MemcachedHelper.get_hydrated_object(self, 'hydrated_user', User, self.user_id)
 
 
 pre_delete.connect(decr_comments_count, sender=Comment)
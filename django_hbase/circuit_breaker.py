@@ -0,0 +1,103 @@
+import random
+import threading
+import time
+
+
+class HBaseUnavailable(RuntimeError):
+    """
+    hbase could not be reached (timeout, dropped socket, exhausted pool) even
+    after the retries, callers can catch it to fall back to another path
+    """
+    pass
+
+
+class CircuitOpenError(HBaseUnavailable):
+    pass
+
+
+class CircuitBreaker:
+    """
+    a process local circuit breaker:
+
+    - closed: calls go through, failure_threshold consecutive failures open it
+    - open: calls fail fast with CircuitOpenError for reset_timeout seconds
+      instead of queueing up behind a stalled thrift server
+    - half open: then a single probe call goes through, its success closes
+      the circuit and its failure opens it again
+
+    stats() is meant for monitoring, trips counts how many times it opened.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=30, clock=time.monotonic):
+        if failure_threshold < 1:
+            raise ValueError('failure_threshold should be at least 1')
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.lock = threading.Lock()
+        self._state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.is_probing = False
+        self.trips = 0
+        self.rejected_calls = 0
+        self.failures = 0
+
+    @property
+    def state(self):
+        with self.lock:
+            return self._get_state()
+
+    def _get_state(self):
+        if self._state == self.OPEN and self.clock() - self.opened_at >= self.reset_timeout:
+            self._state = self.HALF_OPEN
+        return self._state
+
+    def before_call(self):
+        with self.lock:
+            state = self._get_state()
+            if state == self.CLOSED:
+                return
+            if state == self.HALF_OPEN and not self.is_probing:
+                self.is_probing = True
+                return
+            self.rejected_calls += 1
+        raise CircuitOpenError('HBase circuit breaker is open, failing fast')
+
+    def record_success(self):
+        with self.lock:
+            self._state = self.CLOSED
+            self.consecutive_failures = 0
+            self.opened_at = None
+            self.is_probing = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.consecutive_failures += 1
+            if self._get_state() == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                if self._state != self.OPEN:
+                    self.trips += 1
+                self._state = self.OPEN
+                self.opened_at = self.clock()
+            self.is_probing = False
+
+    def stats(self):
+        with self.lock:
+            return {
+                'state': self._get_state(),
+                'consecutive_failures': self.consecutive_failures,
+                'failures': self.failures,
+                'trips': self.trips,
+                'rejected_calls': self.rejected_calls,
+            }
+
+
+def get_retry_delay(attempt, backoff, max_backoff):
+    # exponential backoff with full jitter, so the retries of many request
+    # threads do not hit a recovering server at the same instant
+    return random.uniform(0, min(max_backoff, backoff * 2 ** attempt))
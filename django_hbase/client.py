@@ -1,14 +1,261 @@
+from contextlib import contextmanager
 from django.conf import settings
+from django.utils.module_loading import import_string
+from django_hbase.circuit_breaker import CircuitBreaker, HBaseUnavailable, get_retry_delay
+from thriftpy2.thrift import TException
+from thriftpy2.transport import TTransportException
 
 import happybase
+import queue
+import socket
+import threading
+import time
+
+
+class NoConnectionsAvailable(RuntimeError):
+    pass
+
+
+# the errors that mean hbase did not answer, as opposed to an error it sent back
+UNAVAILABLE_ERRORS = (TTransportException, socket.error, NoConnectionsAvailable)
+
+
+class HBaseConnectionPool:
+    """
+    a bounded, thread-safe pool of happybase connections
+
+    connections are created lazily, checked before being handed out and
+    replaced by a fresh one whenever the thrift layer raised while in use,
+    so a dropped socket only costs the request that hit it. a socket that
+    was half closed while idle still looks open, so a connection idle for
+    more than idle_check seconds is pinged with a cheap round trip first.
+    """
+
+    def __init__(
+        self,
+        size,
+        timeout=None,
+        connection_class=happybase.Connection,
+        connection_timeout=None,
+        idle_check=None,
+        **connection_kwargs
+    ):
+        if size <= 0:
+            raise ValueError('HBase connection pool size must be greater than zero')
+        self.size = size
+        # seconds to wait for a free connection
+        self.timeout = timeout
+        self.connection_class = connection_class
+        # milliseconds every thrift call on a connection may take
+        if connection_timeout is not None:
+            connection_kwargs['timeout'] = connection_timeout
+        self.connection_kwargs = connection_kwargs
+        # None never pings, 0 pings at every checkout
+        self.idle_check = idle_check
+        self._queue = queue.LifoQueue(maxsize=size)
+        self._thread_local = threading.local()
+        # the pool holds (connection, checked in at) pairs, None is a free
+        # slot whose connection has not been created yet
+        for _ in range(size):
+            self._queue.put(None)
+
+    def _create_connection(self):
+        return self.connection_class(autoconnect=False, **self.connection_kwargs)
+
+    def _is_idle(self, checked_in_at):
+        return self.idle_check is not None and time.monotonic() - checked_in_at >= self.idle_check
+
+    def _ensure_healthy(self, conn, checked_in_at=None):
+        if conn is None:
+            conn = self._create_connection()
+        elif conn.transport.is_open() and self._is_idle(checked_in_at):
+            try:
+                # getTableNames, answered by the thrift gateway itself
+                conn.tables()
+            except (TException, socket.error):
+                conn.close()
+                conn = self._create_connection()
+        if not conn.transport.is_open():
+            try:
+                conn.open()
+            except (TException, socket.error):
+                # the old socket is unusable, build a brand new thrift client
+                conn = self._create_connection()
+                conn.open()
+        return conn
+
+    def _checkout(self, timeout):
+        try:
+            entry = self._queue.get(True, timeout)
+        except queue.Empty:
+            raise NoConnectionsAvailable(
+                'No HBase connection available within {} seconds'.format(timeout)
+            )
+        conn, checked_in_at = entry or (None, None)
+        try:
+            return self._ensure_healthy(conn, checked_in_at)
+        except Exception:
+            # give the slot back, otherwise the pool shrinks on every failure
+            self._queue.put(None)
+            raise
+
+    def _checkin(self, conn):
+        self._queue.put(None if conn is None else (conn, time.monotonic()))
+
+    @contextmanager
+    def connection(self, timeout=None):
+        # nested checkouts from the same thread share the outer connection,
+        # so a pool of size 1 can not deadlock on itself. they are counted:
+        # a scan generator may outlive the checkout it was nested in, the
+        # connection goes back to the pool when the last of them exits
+        local = self._thread_local
+        if getattr(local, 'conn', None) is None:
+            local.conn = self._checkout(self.timeout if timeout is None else timeout)
+            local.users = 0
+            local.broken = False
+        local.users += 1
+        conn = local.conn
+        try:
+            yield conn
+        except (TException, socket.error):
+            # we don't know in which state the socket is, drop it and
+            # let the next checkout reconnect transparently
+            local.broken = True
+            raise
+        finally:
+            local.users -= 1
+            if local.users == 0:
+                local.conn = None
+                if local.broken:
+                    conn.close()
+                    conn = None
+                self._checkin(conn)
+
+    def close(self):
+        while True:
+            try:
+                entry = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if entry is not None:
+                entry[0].close()
+        for _ in range(self.size):
+            self._queue.put(None)
 
 
 class HBaseClient:
-    conn = None
+    pool = None
+    breaker = None
+    lock = threading.Lock()
+
+    @classmethod
+    def get_pool(cls):
+        if cls.pool:
+            return cls.pool
+        with cls.lock:
+            if cls.pool is None:
+                cls.pool = HBaseConnectionPool(
+                    size=settings.HBASE_POOL_SIZE,
+                    timeout=settings.HBASE_POOL_TIMEOUT,
+                    connection_class=import_string(settings.HBASE_CONNECTION_CLASS),
+                    connection_timeout=settings.HBASE_TIMEOUT,
+                    idle_check=settings.HBASE_POOL_IDLE_CHECK,
+                    host=settings.HBASE_HOST,
+                )
+        return cls.pool
+
+    @classmethod
+    def get_breaker(cls):
+        if cls.breaker:
+            return cls.breaker
+        with cls.lock:
+            if cls.breaker is None:
+                cls.breaker = CircuitBreaker(
+                    failure_threshold=settings.HBASE_CIRCUIT_BREAKER_THRESHOLD,
+                    reset_timeout=settings.HBASE_CIRCUIT_BREAKER_RESET_TIMEOUT,
+                )
+        return cls.breaker
+
+    @classmethod
+    def is_available(cls):
+        # False while the circuit is open, callers can skip hbase up front
+        return cls.get_breaker().state != CircuitBreaker.OPEN
+
+    @classmethod
+    def connection(cls, timeout=None):
+        """
+        usage:
+            with HBaseClient.connection() as conn:
+                conn.table(...)
+        """
+        return cls.get_pool().connection(timeout=timeout)
+
+    @classmethod
+    def get_attempts(cls, idempotent):
+        return settings.HBASE_READ_RETRIES + 1 if idempotent else 1
+
+    @classmethod
+    def wait_before_retry(cls, attempt):
+        time.sleep(get_retry_delay(
+            attempt,
+            settings.HBASE_RETRY_BACKOFF,
+            settings.HBASE_RETRY_MAX_BACKOFF,
+        ))
+
+    @classmethod
+    def execute(cls, operation, idempotent=False):
+        """
+        run operation(conn) on a pooled connection behind the circuit breaker:
+            HBaseClient.execute(lambda conn: conn.table(name).row(row_key), idempotent=True)
+        idempotent operations (reads) are retried with a jittered backoff,
+        HBaseUnavailable is raised once hbase did not answer for all attempts
+        or right away when the circuit is open.
+        """
+        breaker = cls.get_breaker()
+        attempts = cls.get_attempts(idempotent)
+        for attempt in range(attempts):
+            breaker.before_call()
+            try:
+                with cls.connection() as conn:
+                    result = operation(conn)
+            except UNAVAILABLE_ERRORS as e:
+                breaker.record_failure()
+                if attempt + 1 == attempts:
+                    raise HBaseUnavailable(str(e)) from e
+                cls.wait_before_retry(attempt)
+                continue
+            except BaseException:
+                # hbase answered, with an error that is not ours to handle
+                breaker.record_success()
+                raise
+            breaker.record_success()
+            return result
 
     @classmethod
-    def get_connection(cls):
-        if cls.conn:
-            return cls.conn
-        cls.conn = happybase.Connection(settings.HBASE_HOST)
-        return cls.conn
+    def execute_scan(cls, operation):
+        """
+        like execute for operation(conn) returning an iterator of rows (a
+        scan), the scan is retried as long as no row was yielded yet
+        """
+        breaker = cls.get_breaker()
+        attempts = cls.get_attempts(idempotent=True)
+        for attempt in range(attempts):
+            breaker.before_call()
+            has_rows = False
+            try:
+                with cls.connection() as conn:
+                    for row in operation(conn):
+                        has_rows = True
+                        yield row
+            except UNAVAILABLE_ERRORS as e:
+                breaker.record_failure()
+                if has_rows or attempt + 1 == attempts:
+                    raise HBaseUnavailable(str(e)) from e
+                cls.wait_before_retry(attempt)
+                continue
+            except BaseException:
+                # including GeneratorExit when the caller stops early
+                breaker.record_success()
+                raise
+            breaker.record_success()
+            return
@@ -0,0 +1,636 @@
+"""
+an in-process, in-memory stand-in for an HBase thrift server
+
+happybase.Connection talks to HBase through a thrift client, the emulator
+replaces that client with HBaseEmulator, which implements the thrift calls
+happybase makes on top of a sorted map per table. happybase's own Table and
+Batch code runs unchanged on top of it, so arguments are validated and
+translated exactly like they are against a real cluster.
+
+select it with
+    HBASE_CONNECTION_CLASS = 'django_hbase.emulator.Connection'
+
+supported:
+ - tables: create, delete, enable, disable, list, column families, regions
+ - put, delete (rows, families, columns), batch, row, rows, counters
+ - scan with start / stop / prefix / limit / reverse / columns / timestamp
+ - filters: SingleColumnValueFilter, PrefixFilter, KeyOnlyFilter,
+   FirstKeyOnlyFilter combined with AND / OR and parentheses,
+   binary: and binaryprefix: comparators
+ - time_to_live of the column families
+only the latest version of a cell is kept.
+"""
+from thriftpy2.transport import TTransportException
+
+import bisect
+import happybase
+import itertools
+import re
+import threading
+import time
+
+# the thrift types are loaded by happybase, it has to be imported first
+from Hbase_thrift import (  # noqa: E402
+    AlreadyExists,
+    ColumnDescriptor,
+    IllegalArgument,
+    IOError,
+    TCell,
+    TColumn,
+    TRegionInfo,
+    TRowResult,
+)
+
+
+# what hbase reports as the time to live of a column family without ttl
+FOREVER = 2147483647
+
+
+def to_bytes(value, name='value'):
+    if isinstance(value, bytes):
+        return value
+    if isinstance(value, str):
+        return value.encode('utf-8')
+    raise TypeError('{} should be bytes or str, got {}'.format(name, type(value).__name__))
+
+
+def now_in_millis():
+    return int(time.time() * 1000)
+
+
+class FilterSyntaxError(ValueError):
+    pass
+
+
+class EmulatedFilter:
+    """
+    row level filters decide if a row is returned, cell level filters
+    (KeyOnlyFilter, FirstKeyOnlyFilter) transform the returned cells
+    """
+
+    def matches(self, row_key, cells):
+        return True
+
+    def transform(self, cells):
+        return cells
+
+
+class SingleColumnValueFilter(EmulatedFilter):
+
+    def __init__(self, family, qualifier, operator, comparator, filter_if_missing=False, latest_version_only=True):
+        self.column = family + b':' + qualifier
+        self.operator = COMPARE_OPERATORS[operator]
+        self.comparator = comparator
+        self.filter_if_missing = filter_if_missing
+
+    def matches(self, row_key, cells):
+        cell = cells.get(self.column)
+        if cell is None:
+            return not self.filter_if_missing
+        return self.operator(self.comparator.prepare(cell.value), self.comparator.value)
+
+
+class PrefixFilter(EmulatedFilter):
+
+    def __init__(self, prefix):
+        self.prefix = prefix
+
+    def matches(self, row_key, cells):
+        return row_key.startswith(self.prefix)
+
+
+class KeyOnlyFilter(EmulatedFilter):
+
+    def transform(self, cells):
+        return {
+            column: TCell(value=b'', timestamp=cell.timestamp)
+            for column, cell in cells.items()
+        }
+
+
+class FirstKeyOnlyFilter(EmulatedFilter):
+
+    def transform(self, cells):
+        column = min(cells)
+        return {column: cells[column]}
+
+
+class AndFilter(EmulatedFilter):
+
+    def __init__(self, filters):
+        self.filters = filters
+
+    def matches(self, row_key, cells):
+        return all(f.matches(row_key, cells) for f in self.filters)
+
+    def transform(self, cells):
+        for f in self.filters:
+            cells = f.transform(cells)
+        return cells
+
+
+class OrFilter(AndFilter):
+
+    def matches(self, row_key, cells):
+        return any(f.matches(row_key, cells) for f in self.filters)
+
+
+class BinaryComparator:
+
+    def __init__(self, value):
+        self.value = value
+
+    def prepare(self, value):
+        return value
+
+
+class BinaryPrefixComparator(BinaryComparator):
+
+    def prepare(self, value):
+        return value[:len(self.value)]
+
+
+COMPARE_OPERATORS = {
+    b'=': lambda a, b: a == b,
+    b'!=': lambda a, b: a != b,
+    b'<': lambda a, b: a < b,
+    b'<=': lambda a, b: a <= b,
+    b'>': lambda a, b: a > b,
+    b'>=': lambda a, b: a >= b,
+}
+
+COMPARATORS = {
+    b'binary': BinaryComparator,
+    b'binaryprefix': BinaryPrefixComparator,
+}
+
+FILTERS = {
+    b'SingleColumnValueFilter': SingleColumnValueFilter,
+    b'PrefixFilter': PrefixFilter,
+    b'KeyOnlyFilter': KeyOnlyFilter,
+    b'FirstKeyOnlyFilter': FirstKeyOnlyFilter,
+}
+
+FILTER_TOKEN = re.compile(rb"""
+    \s*(?:
+        (?P<string>'(?:[^']|'')*')
+      | (?P<operator>!=|<=|>=|=|<|>)
+      | (?P<punctuation>[(),])
+      | (?P<word>[A-Za-z_][A-Za-z0-9_]*)
+      | (?P<number>-?[0-9]+)
+    )
+""", re.VERBOSE)
+
+
+class FilterParser:
+    """
+    recursive descent parser of the hbase filter language, AND binds
+    tighter than OR like it does in hbase
+        expression := term (OR term)*
+        term := factor (AND factor)*
+        factor := '(' expression ')' | name '(' arguments ')'
+    """
+
+    def __init__(self, filter_string):
+        self.tokens = self.tokenize(to_bytes(filter_string, 'filter'))
+        self.position = 0
+
+    def tokenize(self, filter_string):
+        tokens, position = [], 0
+        filter_string = filter_string.rstrip()
+        while position < len(filter_string):
+            match = FILTER_TOKEN.match(filter_string, position)
+            if match is None:
+                raise FilterSyntaxError('Unexpected filter syntax at {}'.format(filter_string[position:]))
+            tokens.append((match.lastgroup, match.group(match.lastgroup)))
+            position = match.end()
+        return tokens
+
+    def peek(self):
+        if self.position < len(self.tokens):
+            return self.tokens[self.position]
+        return None, None
+
+    def take(self, kind=None, value=None):
+        token_kind, token_value = self.peek()
+        if token_kind is None or (kind and token_kind != kind) or (value and token_value != value):
+            raise FilterSyntaxError('Expected {} but got {}'.format(value or kind, token_value))
+        self.position += 1
+        return token_value
+
+    def parse(self):
+        expression = self.parse_expression()
+        if self.position != len(self.tokens):
+            raise FilterSyntaxError('Unexpected {}'.format(self.peek()[1]))
+        return expression
+
+    def parse_expression(self):
+        terms = [self.parse_term()]
+        while self.peek() == ('word', b'OR'):
+            self.take()
+            terms.append(self.parse_term())
+        return terms[0] if len(terms) == 1 else OrFilter(terms)
+
+    def parse_term(self):
+        factors = [self.parse_factor()]
+        while self.peek() == ('word', b'AND'):
+            self.take()
+            factors.append(self.parse_factor())
+        return factors[0] if len(factors) == 1 else AndFilter(factors)
+
+    def parse_factor(self):
+        if self.peek() == ('punctuation', b'('):
+            self.take()
+            expression = self.parse_expression()
+            self.take('punctuation', b')')
+            return expression
+        name = self.take('word')
+        if name not in FILTERS:
+            raise FilterSyntaxError('{} is not supported by the emulator'.format(name.decode('utf-8')))
+        self.take('punctuation', b'(')
+        arguments = []
+        while self.peek() != ('punctuation', b')'):
+            if arguments:
+                self.take('punctuation', b',')
+            arguments.append(self.parse_argument())
+        self.take('punctuation', b')')
+        if name == b'SingleColumnValueFilter' and len(arguments) >= 4:
+            arguments[3] = self.parse_comparator(arguments[3])
+        return FILTERS[name](*arguments)
+
+    def parse_argument(self):
+        kind, value = self.peek()
+        self.take()
+        if kind == 'string':
+            return value[1:-1].replace(b"''", b"'")
+        if kind == 'number':
+            return int(value)
+        if kind == 'word' and value.lower() in (b'true', b'false'):
+            return value.lower() == b'true'
+        if kind == 'operator':
+            return value
+        raise FilterSyntaxError('Unexpected {}'.format(value))
+
+    def parse_comparator(self, comparator):
+        name, _, value = comparator.partition(b':')
+        if name not in COMPARATORS:
+            raise FilterSyntaxError('{} comparator is not supported by the emulator'.format(name.decode('utf-8')))
+        return COMPARATORS[name](value)
+
+
+def compile_filter(filter_string):
+    if not filter_string:
+        return None
+    return FilterParser(filter_string).parse()
+
+
+class EmulatedTable:
+
+    def __init__(self, name, column_descriptors):
+        self.name = name
+        self.column_descriptors = column_descriptors
+        self.enabled = True
+        # sorted row keys, for the scans, and the cells of every row
+        self.row_keys = []
+        self.rows = {}
+
+    def get_time_to_live(self, column):
+        family = column.split(b':', 1)[0] + b':'
+        return self.column_descriptors[family].timeToLive
+
+    def is_expired(self, column, cell, now):
+        time_to_live = self.get_time_to_live(column)
+        if time_to_live in (-1, FOREVER):
+            return False
+        return cell.timestamp < now - time_to_live * 1000
+
+    def get_cells(self, row_key, columns=None, timestamp=None):
+        cells = self.rows.get(row_key)
+        if not cells:
+            return {}
+        now = now_in_millis()
+        return {
+            column: cell
+            for column, cell in cells.items()
+            if (not columns or match_columns(column, columns))
+            and (timestamp is None or cell.timestamp < timestamp)
+            and not self.is_expired(column, cell, now)
+        }
+
+    def check_column(self, column):
+        family = column.split(b':', 1)[0] + b':'
+        if family not in self.column_descriptors:
+            raise IOError(message='NoSuchColumnFamilyException: {} in table {}'.format(
+                family.decode('utf-8'),
+                self.name.decode('utf-8'),
+            ))
+
+    def put(self, row_key, column, value, timestamp):
+        self.check_column(column)
+        cells = self.rows.get(row_key)
+        if cells is None:
+            cells = self.rows[row_key] = {}
+            bisect.insort(self.row_keys, row_key)
+        cell = cells.get(column)
+        # the newest version wins, like hbase without max_versions
+        if cell is None or cell.timestamp <= timestamp:
+            cells[column] = TCell(value=value, timestamp=timestamp)
+
+    def delete(self, row_key, column, timestamp=None):
+        self.check_column(column)
+        cells = self.rows.get(row_key)
+        if not cells:
+            return
+        for key in [key for key in cells if match_columns(key, [column])]:
+            if timestamp is None or cells[key].timestamp <= timestamp:
+                del cells[key]
+        if not cells:
+            del self.rows[row_key]
+            del self.row_keys[bisect.bisect_left(self.row_keys, row_key)]
+
+
+def match_columns(column, columns):
+    for requested in columns:
+        # b'cf' and b'cf:' select a whole column family
+        if b':' not in requested or requested.endswith(b':'):
+            if column.split(b':', 1)[0] == requested.rstrip(b':'):
+                return True
+        elif column == requested:
+            return True
+    return False
+
+
+class EmulatedScanner:
+
+    def __init__(self, table, row_keys, columns, timestamp, filter, sort_columns):
+        self.table = table
+        self.row_keys = row_keys
+        self.columns = columns
+        self.timestamp = timestamp
+        self.filter = filter
+        self.sort_columns = sort_columns
+        self.position = 0
+
+
+class HBaseEmulator:
+    """
+    implements the thrift calls (Hbase.Iface) used by happybase, all the
+    connections sharing an emulator see the same tables
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.tables = {}
+        self.scanners = {}
+        self.scanner_ids = itertools.count(1)
+
+    def reset(self):
+        with self.lock:
+            self.tables.clear()
+            self.scanners.clear()
+
+    def get_table(self, name, enabled=True):
+        table = self.tables.get(to_bytes(name, 'table name'))
+        if table is None:
+            raise IOError(message='TableNotFoundException: {}'.format(name))
+        if enabled and not table.enabled:
+            raise IOError(message='TableNotEnabledException: {}'.format(name))
+        return table
+
+    def make_row_result(self, row_key, cells, sort_columns=False):
+        return TRowResult(
+            row=row_key,
+            columns=None if sort_columns else cells,
+            sortedColumns=[
+                TColumn(columnName=column, cell=cells[column])
+                for column in sorted(cells)
+            ] if sort_columns else None,
+        )
+
+    # tables
+
+    def getTableNames(self):
+        with self.lock:
+            return sorted(self.tables)
+
+    def createTable(self, tableName, columnFamilies):
+        name = to_bytes(tableName, 'table name')
+        if not columnFamilies:
+            raise IllegalArgument(message='a table needs at least one column family')
+        column_descriptors = {}
+        for descriptor in columnFamilies:
+            family = to_bytes(descriptor.name, 'column family')
+            if not family.endswith(b':'):
+                family += b':'
+            # what a real server returns once the table is created
+            column_descriptors[family] = ColumnDescriptor(
+                name=family,
+                maxVersions=descriptor.maxVersions,
+                compression=to_bytes(descriptor.compression).upper(),
+                inMemory=descriptor.inMemory,
+                bloomFilterType=to_bytes(descriptor.bloomFilterType).upper(),
+                bloomFilterVectorSize=descriptor.bloomFilterVectorSize,
+                bloomFilterNbHashes=descriptor.bloomFilterNbHashes,
+                blockCacheEnabled=descriptor.blockCacheEnabled,
+                timeToLive=FOREVER if descriptor.timeToLive == -1 else descriptor.timeToLive,
+            )
+        with self.lock:
+            if name in self.tables:
+                raise AlreadyExists(message='table {} already exists'.format(name.decode('utf-8')))
+            self.tables[name] = EmulatedTable(name, column_descriptors)
+
+    def deleteTable(self, tableName):
+        with self.lock:
+            table = self.get_table(tableName, enabled=False)
+            if table.enabled:
+                raise IOError(message='TableNotDisabledException: {}'.format(tableName))
+            del self.tables[table.name]
+
+    def enableTable(self, tableName):
+        with self.lock:
+            self.get_table(tableName, enabled=False).enabled = True
+
+    def disableTable(self, tableName):
+        with self.lock:
+            self.get_table(tableName, enabled=False).enabled = False
+
+    def isTableEnabled(self, tableName):
+        with self.lock:
+            return self.get_table(tableName, enabled=False).enabled
+
+    def getColumnDescriptors(self, tableName):
+        with self.lock:
+            return dict(self.get_table(tableName, enabled=False).column_descriptors)
+
+    def getTableRegions(self, tableName):
+        with self.lock:
+            table = self.get_table(tableName, enabled=False)
+        # a single region covering the whole table
+        return [TRegionInfo(startKey=b'', endKey=b'', id=1, name=table.name + b',,1', version=1)]
+
+    def compact(self, tableNameOrRegionName):
+        pass
+
+    def majorCompact(self, tableNameOrRegionName):
+        pass
+
+    # rows
+
+    def getRowWithColumns(self, tableName, row, columns, attributes):
+        return self.getRowsWithColumnsTs(tableName, [row], columns, None, attributes)
+
+    def getRowWithColumnsTs(self, tableName, row, columns, timestamp, attributes):
+        return self.getRowsWithColumnsTs(tableName, [row], columns, timestamp, attributes)
+
+    def getRowsWithColumns(self, tableName, rows, columns, attributes):
+        return self.getRowsWithColumnsTs(tableName, rows, columns, None, attributes)
+
+    def getRowsWithColumnsTs(self, tableName, rows, columns, timestamp, attributes):
+        columns = [to_bytes(column, 'column') for column in columns or ()]
+        results = []
+        with self.lock:
+            table = self.get_table(tableName)
+            for row in rows:
+                row_key = to_bytes(row, 'row key')
+                cells = table.get_cells(row_key, columns, timestamp)
+                if cells:
+                    results.append(self.make_row_result(row_key, cells))
+        return results
+
+    def mutateRows(self, tableName, rowBatches, attributes):
+        self.mutateRowsTs(tableName, rowBatches, None, attributes)
+
+    def mutateRowsTs(self, tableName, rowBatches, timestamp, attributes):
+        with self.lock:
+            table = self.get_table(tableName)
+            put_timestamp = now_in_millis() if timestamp is None else timestamp
+            for batch in rowBatches:
+                row_key = to_bytes(batch.row, 'row key')
+                for mutation in batch.mutations:
+                    column = to_bytes(mutation.column, 'column')
+                    if mutation.isDelete:
+                        table.delete(row_key, column, timestamp)
+                    else:
+                        table.put(row_key, column, to_bytes(mutation.value), put_timestamp)
+
+    def atomicIncrement(self, tableName, row, column, value):
+        row_key, column = to_bytes(row, 'row key'), to_bytes(column, 'column')
+        with self.lock:
+            table = self.get_table(tableName)
+            table.check_column(column)
+            cell = table.get_cells(row_key, [column]).get(column)
+            current = 0
+            if cell is not None:
+                if len(cell.value) != 8:
+                    raise IOError(message="Attempted to increment field that isn't 64 bits wide")
+                current = int.from_bytes(cell.value, 'big', signed=True)
+            current += value
+            table.put(row_key, column, current.to_bytes(8, 'big', signed=True), now_in_millis())
+            return current
+
+    # scanners
+
+    def scannerOpenWithScan(self, tableName, tscan, attributes):
+        start = to_bytes(tscan.startRow or b'', 'start row')
+        stop = to_bytes(tscan.stopRow, 'stop row') if tscan.stopRow else None
+        with self.lock:
+            table = self.get_table(tableName)
+            row_keys = table.row_keys
+            # like hbase, the start row is included and the stop row is not,
+            # a reversed scan goes from start down to stop
+            if tscan.reversed:
+                upper = bisect.bisect_right(row_keys, start) if start else len(row_keys)
+                lower = bisect.bisect_right(row_keys, stop) if stop else 0
+                row_keys = row_keys[lower:upper][::-1]
+            else:
+                lower = bisect.bisect_left(row_keys, start)
+                upper = bisect.bisect_left(row_keys, stop) if stop else len(row_keys)
+                row_keys = row_keys[lower:upper]
+            scanner_id = next(self.scanner_ids)
+            self.scanners[scanner_id] = EmulatedScanner(
+                table,
+                row_keys,
+                [to_bytes(column, 'column') for column in tscan.columns or ()],
+                tscan.timestamp,
+                compile_filter(tscan.filterString),
+                tscan.sortColumns,
+            )
+        return scanner_id
+
+    def scannerGetList(self, id, nbRows):
+        results = []
+        with self.lock:
+            scanner = self.scanners.get(id)
+            if scanner is None:
+                raise IllegalArgument(message='scanner {} does not exist'.format(id))
+            while len(results) < nbRows and scanner.position < len(scanner.row_keys):
+                row_key = scanner.row_keys[scanner.position]
+                scanner.position += 1
+                # rows deleted since the scanner was opened are skipped
+                cells = scanner.table.get_cells(row_key, scanner.columns, scanner.timestamp)
+                if not cells:
+                    continue
+                if scanner.filter is not None:
+                    if not scanner.filter.matches(row_key, cells):
+                        continue
+                    cells = scanner.filter.transform(cells)
+                results.append(self.make_row_result(row_key, cells, scanner.sort_columns))
+        return results
+
+    def scannerClose(self, id):
+        with self.lock:
+            self.scanners.pop(id, None)
+
+
+# the tables of every emulated connection of the process
+default_emulator = HBaseEmulator()
+
+
+class EmulatorTransport:
+
+    def __init__(self):
+        self.opened = False
+
+    def is_open(self):
+        return self.opened
+
+    def open(self):
+        self.opened = True
+
+    def close(self):
+        self.opened = False
+
+
+class EmulatorClient:
+    """
+    forwards the thrift calls to the emulator, and fails like a thrift
+    client does when the transport is closed
+    """
+
+    def __init__(self, emulator, transport):
+        self.emulator = emulator
+        self.transport = transport
+
+    def __getattr__(self, name):
+        method = getattr(self.emulator, name)
+
+        def call(*args):
+            if not self.transport.is_open():
+                raise TTransportException(TTransportException.NOT_OPEN, 'Transport is not open')
+            return method(*args)
+        return call
+
+
+class Connection(happybase.Connection):
+    """
+    a drop-in replacement of happybase.Connection backed by an in-memory
+    HBaseEmulator, host and port are accepted and ignored
+    """
+
+    def __init__(self, *args, emulator=None, **kwargs):
+        self.emulator = emulator or default_emulator
+        super(Connection, self).__init__(*args, **kwargs)
+
+    def _refresh_thrift_client(self):
+        self.transport = EmulatorTransport()
+        self.client = EmulatorClient(self.emulator, self.transport)
@@ -0,0 +1,80 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.module_loading import import_string
+import gc
+import time
+import tracemalloc
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure the memory held by decoded HBaseModel instances, the slotted '
+        'record instances the models create against the same fields stored in '
+        'a per instance __dict__. Rows are encoded and decoded in process, no '
+        'HBase server is needed.\n'
+        'e.g. manage.py hbase_benchmark_memory newsfeeds.models.HBaseNewsFeed --rows 1000000'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'model',
+            nargs='?',
+            default='newsfeeds.models.HBaseNewsFeed',
+            help='dotted path of an HBaseModel class whose fields are all integers',
+        )
+        parser.add_argument('--rows', type=int, default=1000000)
+
+    def handle(self, *args, **options):
+        try:
+            model_class = import_string(options['model'])
+        except ImportError as e:
+            raise CommandError(str(e))
+        rows_count = options['rows']
+        schema = model_class._schema
+        # the models declare __slots__, a throwaway class without them stands
+        # for the layout instances had before the record classes
+        dict_class = type(model_class.__name__ + 'Dict', (), {})
+
+        def init_slotted(row_key, row_data):
+            return model_class.init_from_row(row_key, row_data)
+
+        def init_with_dict(row_key, row_data):
+            instance = object.__new__(dict_class)
+            instance.__dict__.update(schema.decode_row(row_key, row_data))
+            return instance
+
+        results = {}
+        for name, init in (('__dict__', init_with_dict), ('__slots__', init_slotted)):
+            results[name] = self.measure(model_class, init, rows_count)
+            self.stdout.write('{}: {:.1f} MB, {:.0f} bytes per instance, encoded and decoded in {:.2f}s'.format(
+                name,
+                results[name][0] / 1024 / 1024,
+                results[name][0] / rows_count,
+                results[name][1],
+            ))
+
+        self.stdout.write(self.style.SUCCESS('{} rows of {}: {:.0f}% less memory with __slots__'.format(
+            rows_count,
+            model_class.__name__,
+            100 * (1 - results['__slots__'][0] / results['__dict__'][0]),
+        )))
+
+    def iter_rows(self, model_class, rows_count):
+        schema = model_class._schema
+        for i in range(rows_count):
+            # distinct values large enough not to be cached small ints
+            data = {key: 1000000 + i for key in schema.fields}
+            yield schema.encode_row_key(data), schema.encode_row_data(data)
+
+    def measure(self, model_class, init, rows_count):
+        gc.collect()
+        tracemalloc.start()
+        try:
+            before, _ = tracemalloc.get_traced_memory()
+            start = time.perf_counter()
+            instances = [init(row_key, row_data) for row_key, row_data in self.iter_rows(model_class, rows_count)]
+            elapsed = time.perf_counter() - start
+            after, _ = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        del instances
+        return after - before, elapsed
@@ -0,0 +1,68 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.module_loading import import_string
+from django_hbase.client import HBaseClient
+from django_hbase.management.commands.hbase_sync_tables import format_shell_bytes
+from django_hbase.models import HBaseUnitOfWork
+
+
+class Command(BaseCommand):
+    help = (
+        'Backfill the secondary index tables of an HBaseModel from its primary table.\n'
+        'e.g. manage.py hbase_build_index friendships.models.HBaseFollowing'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('model', help='dotted path of the HBaseModel class')
+        parser.add_argument('--index', help='only build this index, defaults to all of them')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        try:
+            model_class = import_string(options['model'])
+        except ImportError as e:
+            raise CommandError(str(e))
+        indexes = model_class._schema.indexes
+        if options['index']:
+            if options['index'] not in indexes:
+                raise CommandError('{} has no index {}'.format(model_class.__name__, options['index']))
+            indexes = {options['index']: indexes[options['index']]}
+        if not indexes:
+            raise CommandError(f'{model_class.__name__} has no index')
+
+        batch_size = options['batch_size']
+        table_specs = model_class.get_table_specs()
+        with HBaseClient.connection() as conn:
+            tables = [table.decode('utf-8') for table in conn.tables()]
+            for name in indexes:
+                table_name = model_class.get_index_table_name(name)
+                if table_name in tables:
+                    continue
+                # the index rows expire with the options of the primary table
+                column_families, split_keys = table_specs[table_name]
+                conn.create_table(table_name, column_families)
+                if split_keys:
+                    self.stdout.write(f'{table_name} created, split it in the hbase shell with:')
+                for split_key in split_keys:
+                    self.stdout.write("split '{}', {}".format(table_name, format_shell_bytes(split_key)))
+
+        count = 0
+        with HBaseUnitOfWork(batch_size=batch_size) as unit_of_work:
+            for instances in model_class.chunks(batch_size):
+                for instance in instances:
+                    data = instance.to_dict()
+                    for name, index in indexes.items():
+                        if not index.has_values(data):
+                            continue
+                        unit_of_work.put(
+                            model_class.get_index_table_name(name),
+                            index.encode_row_key(data),
+                            index.encode_row_data(data),
+                        )
+                count += len(instances)
+                if count % (batch_size * 100) == 0:
+                    self.stdout.write(f'{count} rows indexed')
+
+        self.stdout.write(self.style.SUCCESS('{} rows indexed into {}'.format(
+            count,
+            ', '.join(indexes),
+        )))
@@ -0,0 +1,110 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.module_loading import import_string
+from django_hbase.client import HBaseClient
+from django_hbase.management.commands.hbase_sync_tables import format_shell_bytes
+from django_hbase.models import BadRowKeyError, RowKeySalt, get_row_key_codec_class, get_split_keys
+import copy
+
+
+class Command(BaseCommand):
+    help = (
+        'Copy an HBase table into another table, re-encoding every row key '
+        'from one row key codec to another. Column data is copied as is.\n'
+        'e.g. manage.py hbase_rewrite_table newsfeeds.models.HBaseNewsFeed '
+        '--to-codec binary --target-table twitter_newsfeeds_binary\n'
+        'use --salt-buckets and --salt-field to write a salted copy of an '
+        'unsalted table, the model Meta should then declare the same values.\n'
+        'use --from-ascending when the source table was written before the '
+        'timestamp fields of the model became descending=True.\n'
+        'a missing target table is created with the column family options of '
+        'the model, its Meta.pre_split_regions splits are printed as hbase '
+        'shell statements since the thrift gateway can not split a region.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('model', help='dotted path of the HBaseModel class')
+        parser.add_argument('--target-table', required=True)
+        parser.add_argument('--source-table', help='defaults to the table of the model')
+        parser.add_argument('--from-codec', default='text')
+        parser.add_argument('--to-codec', default='binary')
+        parser.add_argument(
+            '--from-ascending',
+            action='store_true',
+            help='decode descending timestamp fields of the source table as ascending ones',
+        )
+        parser.add_argument('--salt-buckets', type=int)
+        parser.add_argument('--salt-field', help='row key field the salt is computed from')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def get_ascending_field(self, field):
+        if not field.descending:
+            return field
+        field = copy.copy(field)
+        field.descending = False
+        return field
+
+    def get_target_split_keys(self, schema, target_codec, salt):
+        # the splits of the target row key layout, which may not be the one of the model yet
+        if salt is not None:
+            return get_split_keys(b''.join(salt.salts), schema.pre_split_regions)
+        return get_split_keys(target_codec.leading_bytes, schema.pre_split_regions)
+
+    def handle(self, *args, **options):
+        try:
+            model_class = import_string(options['model'])
+        except ImportError as e:
+            raise CommandError(str(e))
+        schema = model_class._schema
+        source_row_key_fields = schema.row_key_fields
+        if options['from_ascending']:
+            source_row_key_fields = tuple(
+                (key, self.get_ascending_field(field))
+                for key, field in source_row_key_fields
+            )
+        source_codec = get_row_key_codec_class(options['from_codec'])(source_row_key_fields)
+        target_codec = get_row_key_codec_class(options['to_codec'])(schema.row_key_fields)
+        salt = None
+        if options['salt_buckets']:
+            salt_key = options['salt_field']
+            if salt_key not in model_class.Meta.row_key[1:]:
+                raise CommandError('--salt-field should be a row key field but the first one')
+            try:
+                salt = RowKeySalt(options['salt_buckets'], salt_key, schema.fields[salt_key])
+            except BadRowKeyError as e:
+                raise CommandError(str(e))
+        source_table_name = options['source_table'] or model_class.get_table_name()
+        target_table_name = options['target_table']
+        if source_table_name == target_table_name:
+            raise CommandError('Rewriting a table in place is not supported, use another target table')
+        batch_size = options['batch_size']
+
+        count = 0
+        with HBaseClient.connection() as conn:
+            tables = [table.decode('utf-8') for table in conn.tables()]
+            if source_table_name not in tables:
+                raise CommandError(f'Table {source_table_name} does not exist')
+            if target_table_name not in tables:
+                column_families, _ = model_class.get_table_specs()[model_class.get_table_name()]
+                conn.create_table(target_table_name, column_families)
+                split_keys = self.get_target_split_keys(schema, target_codec, salt)
+                if split_keys:
+                    self.stdout.write(f'{target_table_name} created, split it in the hbase shell with:')
+                for split_key in split_keys:
+                    self.stdout.write("split '{}', {}".format(target_table_name, format_shell_bytes(split_key)))
+            source_table = conn.table(source_table_name)
+            target_table = conn.table(target_table_name)
+            # the batch sends itself every batch_size puts and once more on exit
+            with target_table.batch(batch_size=batch_size) as batch:
+                for row_key, row_data in source_table.scan(batch_size=batch_size):
+                    data = source_codec.decode(row_key)
+                    target_row_key = target_codec.encode(data)
+                    if salt is not None:
+                        target_row_key = salt.add(target_row_key, data)
+                    batch.put(target_row_key, row_data)
+                    count += 1
+                    if count % (batch_size * 100) == 0:
+                        self.stdout.write(f'{count} rows rewritten')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'{count} rows rewritten from {source_table_name} to {target_table_name}'
+        ))
@@ -0,0 +1,157 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.module_loading import import_string
+from django_hbase.client import HBaseClient
+from django_hbase.models import HBaseModel
+
+
+# column family option => hbase shell attribute
+SHELL_OPTIONS = {
+    'max_versions': 'VERSIONS',
+    'time_to_live': 'TTL',
+    'bloom_filter_type': 'BLOOMFILTER',
+    'compression': 'COMPRESSION',
+    'block_cache_enabled': 'BLOCKCACHE',
+    'in_memory': 'IN_MEMORY',
+}
+
+
+def get_model_classes(klass=HBaseModel):
+    for subclass in klass.__subclasses__():
+        # skip the slotted record classes generated for every model
+        if '_model_class' in subclass.__dict__:
+            continue
+        yield subclass
+        yield from get_model_classes(subclass)
+
+
+def normalize_option(value):
+    if isinstance(value, bytes):
+        value = value.decode('utf-8')
+    if isinstance(value, str):
+        return value.upper()
+    return value
+
+
+def format_shell_value(value):
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, str):
+        return "'{}'".format(value)
+    return str(value)
+
+
+def format_shell_bytes(value):
+    # jruby double quoted string, '#' is escaped to avoid #{} interpolation
+    return '"{}"'.format(''.join(
+        chr(byte) if 32 <= byte < 127 and chr(byte) not in '"\\#' else '\\x{:02x}'.format(byte)
+        for byte in value
+    ))
+
+
+class Command(BaseCommand):
+    help = (
+        'Create the HBase tables of the models that do not exist yet, with the '
+        'column family options declared in Meta.column_family_options.\n'
+        'The thrift gateway can neither alter a column family nor split a '
+        'region, so the differences with existing tables and the missing '
+        'Meta.pre_split_regions splits are printed as hbase shell statements:\n'
+        '  manage.py hbase_sync_tables --shell-only | hbase shell -n\n'
+        'Tables and column families are never dropped, running it twice is safe.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('models', nargs='*', help='dotted paths of HBaseModel classes, defaults to all of them')
+        parser.add_argument('--dry-run', action='store_true', help='do not create any table')
+        parser.add_argument(
+            '--shell-only',
+            action='store_true',
+            help='only print the hbase shell statements, implies --dry-run',
+        )
+
+    def handle(self, *args, **options):
+        try:
+            model_classes = [import_string(path) for path in options['models']]
+        except ImportError as e:
+            raise CommandError(str(e))
+        model_classes = model_classes or [
+            model_class
+            for model_class in get_model_classes()
+            if model_class.Meta.table_name
+        ]
+        self.verbose = not options['shell_only']
+        # the missing tables are created by the printed statements instead
+        dry_run = options['dry_run'] or options['shell_only']
+
+        statements = []
+        with HBaseClient.connection() as conn:
+            tables = [table.decode('utf-8') for table in conn.tables()]
+            for model_class in model_classes:
+                for table_name, (column_families, split_keys) in model_class.get_table_specs().items():
+                    if table_name not in tables:
+                        self.log(f'create {table_name}')
+                        if dry_run:
+                            # the create statement includes the splits
+                            statements.append(self.get_create_statement(table_name, column_families, split_keys))
+                            continue
+                        conn.create_table(table_name, column_families)
+                        tables.append(table_name)
+                    table = conn.table(table_name)
+                    statements.extend(self.get_alter_statements(table_name, table.families(), column_families))
+                    statements.extend(self.get_split_statements(table_name, table.regions(), split_keys))
+
+        for statement in statements:
+            self.stdout.write(statement)
+        self.log(self.style.SUCCESS('{} tables checked, {} hbase shell statements to run'.format(
+            sum(len(model_class.get_table_specs()) for model_class in model_classes),
+            len(statements),
+        )))
+
+    def log(self, message):
+        if self.verbose:
+            self.stderr.write(message)
+
+    def get_family_statement(self, column_family, options):
+        attributes = ["NAME => '{}'".format(column_family)] + [
+            '{} => {}'.format(SHELL_OPTIONS[option], format_shell_value(value))
+            for option, value in sorted(options.items())
+        ]
+        return '{' + ', '.join(attributes) + '}'
+
+    def get_create_statement(self, table_name, column_families, split_keys):
+        statement = "create '{}', {}".format(table_name, ', '.join(
+            self.get_family_statement(column_family, options)
+            for column_family, options in column_families.items()
+        ))
+        if split_keys:
+            statement += ', SPLITS => [{}]'.format(', '.join(map(format_shell_bytes, split_keys)))
+        return statement
+
+    def get_alter_statements(self, table_name, actual_families, column_families):
+        actual_families = {
+            (name.decode('utf-8') if isinstance(name, bytes) else name).rstrip(':'): descriptor
+            for name, descriptor in actual_families.items()
+        }
+        statements = []
+        for column_family, options in column_families.items():
+            descriptor = actual_families.get(column_family)
+            if descriptor is not None and all(
+                normalize_option(descriptor.get(option)) == normalize_option(value)
+                for option, value in options.items()
+            ):
+                continue
+            self.log(f'alter {table_name} {column_family}')
+            statements.append("alter '{}', {}".format(
+                table_name,
+                self.get_family_statement(column_family, options),
+            ))
+        return statements
+
+    def get_split_statements(self, table_name, regions, split_keys):
+        boundaries = {region['start_key'] for region in regions}
+        statements = []
+        for split_key in split_keys:
+            if split_key in boundaries:
+                continue
+            self.log(f'split {table_name} at {split_key}')
+            statements.append("split '{}', {}".format(table_name, format_shell_bytes(split_key)))
+        return statements
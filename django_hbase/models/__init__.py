@@ -1,3 +1,10 @@
 from .exceptions import *
 from .fields import *
+from .filters import *
+from .indexes import *
+from .query import *
+from .row_key_codecs import *
+from .salting import *
+from .schema import *
+from .unit_of_work import *
 from .hbase_models import *
@@ -1,10 +1,28 @@
+from utils.time_constants import MAX_TIMESTAMP
+
+
 class HBaseField:
     field_type = None
+    # only TimestampField can be stored in descending order
+    descending = False
 
     def __init__(self, reverse=False, column_family=None):
         self.reverse = reverse
         self.column_family = column_family
 
+    def serialize(self, value):
+        value = str(value)
+        if self.reverse:
+            value = value[::-1]
+        return value
+
+    def deserialize(self, value):
+        # value is str when it comes from a row key and bytes when it
+        # comes from a column, both can be reversed and parsed the same way
+        if self.reverse:
+            value = value[::-1]
+        return value
+
 
 class IntegerField(HBaseField):
     field_type = 'int'
@@ -12,9 +30,61 @@ class IntegerField(HBaseField):
     def __init__(self, *args, **kwargs):
         super(IntegerField, self).__init__(*args, **kwargs)
 
+    def serialize(self, value):
+        # 因为排序规则是按照字典序排序，那么就可能出现 1 10 2 这样的排序
+        # 解决的办法是固定 int 的位数为 16 位（8的倍数更容易利用空间），不足位补 0
+        value = str(value).rjust(16, '0')
+        if self.reverse:
+            value = value[::-1]
+        return value
+
+    def deserialize(self, value):
+        return int(super(IntegerField, self).deserialize(value))
+
 
 class TimestampField(HBaseField):
+    """
+    descending=True stores MAX_TIMESTAMP - timestamp, the newest rows of a
+    prefix then come first and "latest N" is a forward scan instead of a
+    (much slower) reverse scan
+    """
     field_type = 'timestamp'
 
+    def __init__(self, *args, descending=False, **kwargs):
+        super(TimestampField, self).__init__(*args, **kwargs)
+        self.descending = descending
+
+    def to_sort_value(self, value):
+        # MAX_TIMESTAMP - (MAX_TIMESTAMP - x) == x, so it also decodes
+        if self.descending:
+            return MAX_TIMESTAMP - int(value)
+        return int(value)
+
+    def serialize(self, value):
+        if self.descending:
+            # keep the width fixed so that the order does not depend on the length
+            value = str(self.to_sort_value(value)).rjust(16, '0')
+        return super(TimestampField, self).serialize(value)
+
+    def deserialize(self, value):
+        return self.to_sort_value(super(TimestampField, self).deserialize(value))
+
+
+class CounterField(HBaseField):
+    """
+    a 64 bits signed counter cell, it is only changed through
+    HBaseModel.increase_counter (hbase atomic increment) so that concurrent
+    writers never overwrite each other, save() leaves it untouched
+    """
+    field_type = 'counter'
+
     def __init__(self, *args, **kwargs):
-        super(TimestampField, self).__init__(*args, **kwargs)
\ No newline at end of file
+        super(CounterField, self).__init__(*args, **kwargs)
+        if not self.column_family:
+            raise ValueError('CounterField needs a column_family')
+
+    def serialize(self, value):
+        return int(value).to_bytes(8, 'big', signed=True)
+
+    def deserialize(self, value):
+        return int.from_bytes(value, 'big', signed=True)
@@ -0,0 +1,80 @@
+"""
+helpers that compile to HBase filter language strings, the format accepted
+by the `filter` argument of happybase's Table.scan:
+https://hbase.apache.org/book.html#thrift.filter_language
+the strings are bytes, the values compared with can be binary (CounterField)
+"""
+from django_hbase.models.exceptions import BadFilterError
+
+
+COMPARE_OPERATORS = {
+    'exact': b'=',
+    'ne': b'!=',
+    'lt': b'<',
+    'lte': b'<=',
+    'gt': b'>',
+    'gte': b'>=',
+}
+
+
+def to_filter_bytes(value):
+    if isinstance(value, bytes):
+        return value
+    return str(value).encode('utf-8')
+
+
+def quote(value):
+    # a single quote inside a filter string is escaped by doubling it, the
+    # other bytes are taken as they are
+    return b"'" + to_filter_bytes(value).replace(b"'", b"''") + b"'"
+
+
+def single_column_value_filter(column_family, qualifier, operator, value):
+    # the last two arguments are filterIfColumnMissing and latestVersionOnly,
+    # rows without the column are dropped instead of being returned as matches
+    return b'SingleColumnValueFilter(%s, %s, %s, %s, true, true)' % (
+        quote(column_family),
+        quote(qualifier),
+        operator,
+        quote(b'binary:' + to_filter_bytes(value)),
+    )
+
+
+def key_only_filter():
+    # return the cells without their values
+    return b'KeyOnlyFilter()'
+
+
+def first_key_only_filter():
+    # return only the first cell of every row
+    return b'FirstKeyOnlyFilter()'
+
+
+def and_filters(*filters):
+    return b' AND '.join(f for f in filters if f)
+
+
+def compile_where(schema, where):
+    """
+    {'to_user_id': 1, 'created_at__gte': 10} => SingleColumnValueFilter(...) AND ...
+    only column fields can be used, row key fields should use start/stop/prefix
+    """
+    filters = []
+    for lookup, value in where.items():
+        key, _, operator = lookup.partition('__')
+        operator = operator or 'exact'
+        field = schema.fields.get(key)
+        if field is None or not field.column_family:
+            raise BadFilterError(f'{key} is not a column field')
+        if operator not in COMPARE_OPERATORS:
+            raise BadFilterError(f'Unsupported lookup {operator} on {key}')
+        if field.reverse and operator not in ('exact', 'ne'):
+            # reversed values are not ordered, only equality makes sense
+            raise BadFilterError(f'{key} is reversed, only exact and ne lookups are supported')
+        filters.append(single_column_value_filter(
+            field.column_family,
+            key,
+            COMPARE_OPERATORS[operator],
+            field.serialize(value),
+        ))
+    return and_filters(*filters)
@@ -1,49 +1,115 @@
-from django_hbase.models import HBaseField, IntegerField, TimestampField
+from contextlib import contextmanager
+from itertools import islice
 from django_hbase.client import HBaseClient
 from django.conf import settings
-from django_hbase.models.exceptions import BadRowKeyError, EmptyColumnError
+from django_hbase.models.exceptions import EmptyColumnError
+from django_hbase.models.fields import CounterField
+from django_hbase.models.filters import (
+    and_filters,
+    compile_where,
+    first_key_only_filter,
+    key_only_filter,
+)
+from django_hbase.models.query import HBaseQuery
+from django_hbase.models.salting import SaltedScan
+from django_hbase.models.schema import HBaseSchema, get_split_keys
+from django_hbase.models.unit_of_work import HBaseUnitOfWork
+from happybase.util import bytes_increment
 
 
 class HBaseModel:
+    # every model declares __slots__ as well, () or the attributes its
+    # instances cache (e.g. hydrated_tweet), see __init_subclass__
+    __slots__ = ()
+    _schema = None
 
     class Meta:
         table_name = None
         row_key = ()
+        # 'text' (default) or 'binary', see django_hbase.models.row_key_codecs
+        row_key_codec = 'text'
+        # secondary indexes, see django_hbase.models.indexes.HBaseIndex
+        indexes = ()
+        # optional salted layout, see django_hbase.models.salting.RowKeySalt
+        salt_buckets = None
+        salt_field = None
+        # {'cf': {'time_to_live': ..., 'bloom_filter_type': 'ROW'}}, see COLUMN_FAMILY_OPTIONS
+        column_family_options = {}
+        # number of regions the table is created with, see HBaseSchema.get_split_keys
+        pre_split_regions = None
 
     @classmethod
+    @contextmanager
     def get_table(cls):
-        conn = HBaseClient.get_connection()
-        return conn.table(cls.get_table_name())
+        """
+        the table is bound to a pooled connection, so it is only usable
+        inside the with block:
+            with cls.get_table() as table:
+                table.put(...)
+        """
+        with HBaseClient.connection() as conn:
+            yield conn.table(cls.get_table_name())
+
+    @classmethod
+    def execute(cls, operation, idempotent=False):
+        """
+        operation(table) behind the retries and the circuit breaker of
+        HBaseClient.execute, reads pass idempotent=True:
+            cls.execute(lambda table: table.row(row_key), idempotent=True)
+        """
+        table_name = cls.get_table_name()
+        return HBaseClient.execute(lambda conn: operation(conn.table(table_name)), idempotent=idempotent)
 
     @property
     def row_key(self):
-        return self.serialize_row_key(self.__dict__)
+        return self.serialize_row_key(self.to_dict())
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if '_model_class' in cls.__dict__:
+            # the record class generated below shares the schema of its model
+            return
+        if '__slots__' not in cls.__dict__:
+            # a model without __slots__ would give every instance a __dict__ again
+            raise TypeError('{} should declare __slots__, () if its instances cache nothing'.format(cls.__name__))
+        # compile fields, row key codec and column keys once per model class
+        cls._schema = HBaseSchema(cls)
+        # instances are created from a generated subclass that stores the
+        # fields in __slots__. as long as the model classes declare __slots__
+        # too, no per instance __dict__ is allocated. it has the same name
+        # and still is an instance of the model class
+        cls._record_class = type(cls.__name__, (cls,), {
+            '__slots__': tuple(cls._schema.fields),
+            '__module__': cls.__module__,
+            '__qualname__': cls.__qualname__,
+            '__doc__': cls.__doc__,
+            '_model_class': cls,
+        })
+
+    def __new__(cls, *args, **kwargs):
+        return object.__new__(cls._record_class)
+
+    def __reduce__(self):
+        # pickle can not look the record class up by its name, it rebuilds
+        # the instance from the model class and the slot values instead
+        return self._model_class, (), (None, self.to_dict())
 
     @classmethod
     def get_field_hash(cls):
-        field_hash = {}
-        for field in cls.__dict__:
-            field_obj = getattr(cls, field)
-            if isinstance(field_obj, HBaseField):
-                field_hash[field] = field_obj
-        return field_hash
+        return cls._schema.fields
 
     def __init__(self, **kwargs):
-        for key, field in self.get_field_hash().items():
-            value = kwargs.get(key)
-            setattr(self, key, value)
+        for key in self._schema.fields:
+            setattr(self, key, kwargs.get(key))
+
+    def to_dict(self):
+        return {key: getattr(self, key) for key in self._schema.fields}
 
     @classmethod
     def init_from_row(cls, row_key, row_data):
         if not row_data:
             return None
-        data = cls.deserialize_row_key(row_key)
-        for column_key, column_value in row_data.items():
-            # remove column family
-            column_key = column_key.decode('utf-8')
-            key = column_key[column_key.find(':') + 1:]
-            data[key] = cls.deserialize_field(key, column_value)
-        return cls(**data)
+        return cls(**cls._schema.decode_row(row_key, row_data))
 
     @classmethod
     def serialize_row_key(cls, data, is_prefix=False):
@@ -53,112 +119,151 @@ class HBaseModel:
         {key1: val1, key2: val2} => b"val1:val2"
         {key1: val1, key2: val2, key3: val3} => b"val1:val2:val3"
         """
-        field_hash = cls.get_field_hash()
-        values = []
-        for key, field in field_hash.items():
-            if field.column_family:
-                continue
-            value = data.get(key)
-            if value is None:
-                if not is_prefix:
-                    raise BadRowKeyError(f"{key} is missing in row key")
-                break
-            value = cls.serialize_field(field, value)
-            if ':' in value:
-                raise BadRowKeyError(f"{key} should not contain ':' in value: {value}")
-            values.append(value)
-        return bytes(':'.join(values), encoding='utf-8')
+        return cls._schema.encode_row_key(data, is_prefix=is_prefix)
 
     @classmethod
     def deserialize_row_key(cls, row_key):
         """
-        "val1" => {'key1': val1, 'key2': None, 'key3': None}
-        "val1:val2" => {'key1': val1, 'key2': val2, 'key3': None}
+        "val1" => {'key1': val1}
+        "val1:val2" => {'key1': val1, 'key2': val2}
         "val1:val2:val3" => {'key1': val1, 'key2': val2, 'key3': val3}
         """
-        data = {}
-        if isinstance(row_key, bytes):
-            row_key = row_key.decode('utf-8')
-
-        # val1:val2 => val1:val2: 方便每次 find(':') 都能找到一个 val
-        row_key = row_key + ':'
-        for key in cls.Meta.row_key:
-            index = row_key.find(':')
-            if index == -1:
-                break
-            data[key] = cls.deserialize_field(key, row_key[:index])
-            row_key = row_key[index + 1:]
-        return data
+        return cls._schema.decode_row_key(row_key)
 
     @classmethod
     def serialize_field(cls, field, value):
-        value = str(value)
-        if isinstance(field, IntegerField):
-            # 因为排序规则是按照字典序排序，那么就可能出现 1 10 2 这样的排序
-            # 解决的办法是固定 int 的位数为 16 位（8的倍数更容易利用空间），不足位补 0
-            value = str(value)
-            while len(value) < 16:
-                value = '0' + value
-        if field.reverse:
-            value = value[::-1]
-        return value
+        return field.serialize(value)
 
     @classmethod
     def deserialize_field(cls, key, value):
-        field = cls.get_field_hash()[key]
-        if field.reverse:
-            value = value[::-1]
-        if field.field_type in [IntegerField.field_type, TimestampField.field_type]:
-            return int(value)
-        return value
+        return cls._schema.fields[key].deserialize(value)
 
     @classmethod
     def serialize_row_data(cls, data):
-        row_data = {}
-        field_hash = cls.get_field_hash()
-        for key, field in field_hash.items():
-            if not field.column_family:
-                continue
-            column_key = '{}:{}'.format(field.column_family, key)
-            column_value = data.get(key)
-            if column_value is None:
-                continue
-            row_data[column_key] = cls.serialize_field(field, column_value)
-        return row_data
+        return cls._schema.encode_row_data(data)
 
-    def save(self, batch=None):
-        row_data = self.serialize_row_data(self.__dict__)
+    def save(self, unit_of_work=None):
+        data = self.to_dict()
+        row_data = self.serialize_row_data(data)
         # 如果 row_data 为空，即没有任何 column key values 需要存储 hbase 会直接不存储
         # 这个 row_key, 因此我们可以 raise 一个 exception 提醒调用者，避免存储空值
         if len(row_data) == 0:
             raise EmptyColumnError()
-        if batch:
-            batch.put(self.row_key, row_data)
-        else:
-            table = self.get_table()
-            table.put(self.row_key, row_data)
+        if unit_of_work is None:
+            # one batch per table: the row and its index rows
+            with HBaseUnitOfWork() as unit_of_work:
+                self.save(unit_of_work=unit_of_work)
+            return
+        # the primary row is queued first, an index row can only be missing,
+        # never point to a row that was not written
+        unit_of_work.put(self.get_table_name(), self.serialize_row_key(data), row_data)
+        for name, index in self._schema.indexes.items():
+            if not index.has_values(data):
+                continue
+            unit_of_work.put(
+                self.get_index_table_name(name),
+                index.encode_row_key(data),
+                index.encode_row_data(data),
+            )
+
+    @classmethod
+    def get_index_table_name(cls, index_name):
+        return cls._schema.indexes[index_name].get_table_name(cls.get_table_name())
+
+    @classmethod
+    def get_by_index(cls, index_name, **kwargs):
+        """
+        point lookup through a secondary index declared in Meta.indexes
+            HBaseFollowing.get_by_index('from_user_id_to_user_id', from_user_id=1, to_user_id=2)
+        returns None if there is no matching row
+        """
+        index = cls._schema.indexes[index_name]
+        index_row_key = index.encode_row_key(kwargs)
+        index_table_name = cls.get_index_table_name(index_name)
+        index_row = HBaseClient.execute(
+            lambda conn: conn.table(index_table_name).row(index_row_key),
+            idempotent=True,
+        )
+        if not index_row:
+            return None
+        data = index.decode_row_data(index_row)
+        data.update(kwargs)
+        instance = cls.get(**data)
+        # the primary row may have been deleted or changed after the index
+        # row was written, a stale index row is treated as a miss
+        if instance is None or index.encode_row_key(instance.to_dict()) != index_row_key:
+            return None
+        return instance
 
     @classmethod
     def get(cls, **kwargs):
         row_key = cls.serialize_row_key(kwargs)
-        table = cls.get_table()
-        row = table.row(row_key)
+        row = cls.execute(lambda table: table.row(row_key), idempotent=True)
         return cls.init_from_row(row_key, row)
 
     @classmethod
-    def create(cls, batch=None, **kwargs):
+    def get_many(cls, keys, chunk_size=1000):
+        """
+        fetch many rows in one table.rows() round trip per chunk_size keys
+            HBaseFollowing.get_many([
+                {'from_user_id': 1, 'created_at': ts1},
+                {'from_user_id': 2, 'created_at': ts2},
+            ])
+        => [instance1, None] in the same order as keys, None if the row is missing
+        """
+        row_keys = [cls.serialize_row_key(key) for key in keys]
+        rows = {}
+        for index in range(0, len(row_keys), chunk_size):
+            chunk = row_keys[index: index + chunk_size]
+            rows.update(cls.execute(lambda table: table.rows(chunk), idempotent=True))
+        return [
+            cls.init_from_row(row_key, rows.get(row_key))
+            for row_key in row_keys
+        ]
+
+    @classmethod
+    def get_counter_column_key(cls, key):
+        field = cls._schema.fields.get(key)
+        if field is None or field.field_type != CounterField.field_type:
+            raise TypeError(f'{key} is not a CounterField of {cls.__name__}')
+        return cls._schema.column_keys[key]
+
+    @classmethod
+    def increase_counter(cls, key, value=1, **kwargs):
+        """
+        atomically add value (can be negative) to a CounterField, returns the new value
+            HBaseFriendshipCount.increase_counter('followers_count', user_id=1)
+        """
+        row_key = cls.serialize_row_key(kwargs)
+        column_key = cls.get_counter_column_key(key)
+        # not idempotent, an increment that timed out may have been applied
+        return cls.execute(lambda table: table.counter_inc(row_key, column_key, value))
+
+    @classmethod
+    def get_counter(cls, key, **kwargs):
+        # a single cell read, 0 if the counter was never increased
+        row_key = cls.serialize_row_key(kwargs)
+        column_key = cls.get_counter_column_key(key)
+        return cls.execute(lambda table: table.counter_get(row_key, column_key), idempotent=True)
+
+    @classmethod
+    def set_counter(cls, key, value, **kwargs):
+        row_key = cls.serialize_row_key(kwargs)
+        column_key = cls.get_counter_column_key(key)
+        cls.execute(lambda table: table.counter_set(row_key, column_key, value))
+
+    @classmethod
+    def create(cls, unit_of_work=None, **kwargs):
         instance = cls(**kwargs)
-        instance.save(batch=batch)
+        instance.save(unit_of_work=unit_of_work)
         return instance
 
     @classmethod
-    def batch_create(cls, batch_data):
-        table = cls.get_table()
-        batch = table.batch()
+    def batch_create(cls, batch_data, batch_size=1000):
         results = []
-        for data in batch_data:
-            results.append(cls.create(batch=batch, **data))
-        batch.send()
+        with HBaseUnitOfWork(batch_size=batch_size) as unit_of_work:
+            for data in batch_data:
+                results.append(cls.create(unit_of_work=unit_of_work, **data))
         return results
 
     @classmethod
@@ -173,23 +278,45 @@ class HBaseModel:
     def drop_table(cls):
         if not settings.TESTING:
             raise Exception('You can not drop table outside of unit tests')
-        conn = HBaseClient.get_connection()
-        conn.delete_table(cls.get_table_name(), True)
+        with HBaseClient.connection() as conn:
+            conn.delete_table(cls.get_table_name(), True)
+            for name in cls._schema.indexes:
+                conn.delete_table(cls.get_index_table_name(name), True)
+
+    @classmethod
+    def get_table_specs(cls):
+        """
+        {table_name: (column_families, split_keys)} of the primary table and
+        the index tables, index rows expire with the same column family options
+        """
+        schema = cls._schema
+        specs = {
+            cls.get_table_name(): (
+                {
+                    column_family: dict(options)
+                    for column_family, options in schema.column_family_options.items()
+                },
+                schema.get_split_keys(),
+            ),
+        }
+        for name, index in schema.indexes.items():
+            options = schema.column_family_options.get(index.column_family, {})
+            specs[cls.get_index_table_name(name)] = (
+                {index.column_family: dict(options)},
+                get_split_keys(index.row_key_codec.leading_bytes, schema.pre_split_regions),
+            )
+        return specs
 
     @classmethod
     def create_table(cls):
+        # outside of unit tests, use manage.py hbase_sync_tables
         if not settings.TESTING:
             raise Exception('You can not create table outside of unit tests')
-        conn = HBaseClient.get_connection()
-        tables = [table.decode('utf-8') for table in conn.tables()]
-        if cls.get_table_name() in tables:
-            return
-        column_families = {
-            field.column_family: dict()
-            for key, field in cls.get_field_hash().items()
-            if field.column_family is not None
-        }
-        conn.create_table(cls.get_table_name(), column_families)
+        with HBaseClient.connection() as conn:
+            tables = [table.decode('utf-8') for table in conn.tables()]
+            for table_name, (column_families, _) in cls.get_table_specs().items():
+                if table_name not in tables:
+                    conn.create_table(table_name, column_families)
 
     @classmethod
     def serialize_row_key_from_tuple(cls, row_key_tuple):
@@ -202,26 +329,215 @@ class HBaseModel:
         return cls.serialize_row_key(data, is_prefix=True)
 
     @classmethod
-    def filter(cls, start=None, stop=None, prefix=None, limit=None, reverse=False):
+    def serialize_scan_bound(cls, row_key_tuple, is_upper_bound):
+        row_key = cls.serialize_row_key_from_tuple(row_key_tuple)
+        if row_key is None or not is_upper_bound:
+            return row_key
+        values = row_key_tuple[:len(cls.Meta.row_key)]
+        if len(values) == len(cls.Meta.row_key) and None not in values:
+            return row_key
+        # the first key after every key starting with the prefix,
+        # None (no upper bound) if there is none
+        return bytes_increment(row_key)
+
+    @classmethod
+    def get_scan_options(cls, where=None, columns=None, keys_only=False):
+        """
+        compile the declarative options of filter into happybase scan arguments
+        - where: column predicates evaluated on the region servers,
+          e.g. {'to_user_id': 1} or {'tweet_id__gt': 100}
+        - columns: only fetch these column fields
+        - keys_only: only fetch the row keys, the cheapest way to count or test existence
+        """
+        scan_filter = compile_where(cls._schema, where) if where else None
+        scan_columns = None
+        if columns is not None:
+            # the predicate columns have to be read, otherwise
+            # SingleColumnValueFilter treats every row as missing the column
+            keys = list(columns) + [
+                lookup.partition('__')[0]
+                for lookup in (where or {})
+            ]
+            scan_columns = sorted(set(cls._schema.column_keys[key] for key in keys))
+        if keys_only:
+            # FirstKeyOnlyFilter would hide the column a predicate needs
+            # to see, so it is only used when there is no predicate
+            scan_filter = and_filters(
+                scan_filter,
+                None if where else first_key_only_filter(),
+                key_only_filter(),
+            )
+        return scan_filter, scan_columns
+
+    @classmethod
+    def iter_filter(
+        cls,
+        start=None,
+        stop=None,
+        prefix=None,
+        limit=None,
+        reverse=False,
+        batch_size=1000,
+        where=None,
+        columns=None,
+        keys_only=False,
+    ):
+        """
+        lazy version of filter, rows are fetched from the region servers
+        batch_size rows at a time (scanner caching) and decoded one by one,
+        so scanning millions of rows runs in constant memory.
+        the pooled connection is held until the generator is exhausted or closed.
+        with keys_only=True only the row key fields of the instances are set.
+        salted models scan every bucket (in parallel) and merge the results.
+        start and stop follow the row key order, for a descending timestamp
+        start is the newest one. a partial tuple like (user_id, None) used as
+        the upper bound covers all the rows of that prefix.
+        """
         # serialize tuple to str
-        row_start = cls.serialize_row_key_from_tuple(start)
-        row_stop = cls.serialize_row_key_from_tuple(stop)
+        row_start = cls.serialize_scan_bound(start, is_upper_bound=reverse)
+        row_stop = cls.serialize_scan_bound(stop, is_upper_bound=not reverse)
         row_prefix = cls.serialize_row_key_from_tuple(prefix)
+        scan_filter, scan_columns = cls.get_scan_options(where, columns, keys_only)
 
-        # scan table
-        table = cls.get_table()
-        rows = table.scan(row_start, row_stop, row_prefix, limit=limit, reverse=reverse)
+        rows = cls.scan_rows(
+            row_start,
+            row_stop,
+            row_prefix,
+            limit=limit,
+            reverse=reverse,
+            batch_size=batch_size,
+            scan_filter=scan_filter,
+            scan_columns=scan_columns,
+            salts=cls.get_scan_salts(prefix) if cls._schema.salt is not None else None,
+        )
+        yield from cls.init_from_rows(rows, keys_only)
 
-        # deserialize to instance list
-        results = []
+    @classmethod
+    def scan_rows(
+        cls,
+        row_start=None,
+        row_stop=None,
+        row_prefix=None,
+        limit=None,
+        reverse=False,
+        batch_size=1000,
+        scan_filter=None,
+        scan_columns=None,
+        salts=None,
+    ):
+        """
+        yield the raw (row_key, row_data) of a scan on serialized bounds,
+        salted models scan every bucket in salts and merge the results
+        """
+        if cls._schema.salt is not None:
+            yield from SaltedScan(
+                cls,
+                salts or cls._schema.salt.get_salts(None),
+                row_start=row_start,
+                row_stop=row_stop,
+                row_prefix=row_prefix,
+                limit=limit,
+                reverse=reverse,
+                batch_size=batch_size,
+                scan_filter=scan_filter,
+                scan_columns=scan_columns,
+                max_workers=max(1, HBaseClient.get_pool().size - 1),
+            )
+            return
+
+        table_name = cls.get_table_name()
+        yield from HBaseClient.execute_scan(lambda conn: conn.table(table_name).scan(
+            row_start,
+            row_stop,
+            row_prefix,
+            columns=scan_columns,
+            filter=scan_filter,
+            limit=limit,
+            reverse=reverse,
+            batch_size=batch_size,
+        ))
+
+    @classmethod
+    def init_from_rows(cls, rows, keys_only=False):
         for row_key, row_data in rows:
-            instance = cls.init_from_row(row_key, row_data)
-            results.append(instance)
-        return results
+            if keys_only:
+                yield cls(**cls.deserialize_row_key(row_key))
+            else:
+                yield cls.init_from_row(row_key, row_data)
 
     @classmethod
-    def delete(cls, **kwargs):
-        row_key = cls.serialize_row_key(kwargs)
-        table = cls.get_table()
-        return table.delete(row_key)
+    def get_scan_salts(cls, prefix):
+        # a prefix that includes the salt field lives in a single bucket
+        data = None
+        if prefix is not None:
+            data = {
+                key: value
+                for key, value in zip(cls.Meta.row_key, prefix)
+            }
+        return cls._schema.salt.get_salts(data)
+
+    @classmethod
+    def filter(
+        cls,
+        start=None,
+        stop=None,
+        prefix=None,
+        limit=None,
+        reverse=False,
+        where=None,
+        columns=None,
+        keys_only=False,
+    ):
+        return list(cls.iter_filter(
+            start=start,
+            stop=stop,
+            prefix=prefix,
+            limit=limit,
+            reverse=reverse,
+            where=where,
+            columns=columns,
+            keys_only=keys_only,
+        ))
+
+    @classmethod
+    def scan(cls):
+        """
+        a lazy HBaseQuery over the table, see django_hbase.models.query
+            HBaseFollower.scan().prefix(user_id).newest_first().limit(10)
+        """
+        return HBaseQuery(cls)
+
+    @classmethod
+    def chunks(cls, chunk_size, **kwargs):
+        """
+        yield lists of at most chunk_size instances, kwargs are the ones of iter_filter
+            for followers in HBaseFollower.chunks(1000, prefix=(user_id, None)):
+                ...
+        """
+        kwargs.setdefault('batch_size', chunk_size)
+        instances = cls.iter_filter(**kwargs)
+        while True:
+            chunk = list(islice(instances, chunk_size))
+            if not chunk:
+                return
+            yield chunk
 
+    @classmethod
+    def delete(cls, unit_of_work=None, **kwargs):
+        """
+        kwargs must contain the row key fields, pass the indexed fields as
+        well to save the read that is otherwise needed to clean up indexes
+        """
+        row_key = cls.serialize_row_key(kwargs)
+        if any(not index.has_values(kwargs) for index in cls._schema.indexes.values()):
+            instance = cls.get(**kwargs)
+            if instance is not None:
+                kwargs = instance.to_dict()
+        if unit_of_work is None:
+            with HBaseUnitOfWork() as unit_of_work:
+                cls.delete(unit_of_work=unit_of_work, **kwargs)
+            return
+        unit_of_work.delete(cls.get_table_name(), row_key)
+        for name, index in cls._schema.indexes.items():
+            if index.has_values(kwargs):
+                unit_of_work.delete(cls.get_index_table_name(name), index.encode_row_key(kwargs))
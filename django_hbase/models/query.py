@@ -0,0 +1,219 @@
+from happybase.util import bytes_increment
+from itertools import islice
+import copy
+
+
+class HBaseQuery:
+    """
+    a lazy, chainable scan returned by HBaseModel.scan(), nothing is read
+    until a terminal operation (iteration, first, exists, count, ids):
+
+        HBaseNewsFeed.scan().prefix(user_id).before(created_at).newest_first().limit(20)
+
+    - prefix(*values): the leading row key fields
+    - after(value) / before(value): strict bounds on the row key field that
+      follows the prefix, the "range field" (usually created_at)
+    - newest_first(): order by the range field from the largest value, it is
+      a forward scan when the field is stored descending. without it rows
+      come in row key order
+    - limit(n), only(*fields) restrict the rows and the columns fetched
+
+    every chained call returns a new query, so a query can be reused.
+    """
+
+    batch_size = 1000
+
+    def __init__(self, model_class):
+        self.model_class = model_class
+        self.prefix_values = ()
+        self.after_value = None
+        self.before_value = None
+        self.is_newest_first = False
+        self.limit_value = None
+        self.columns = None
+
+    def clone(self, **attributes):
+        query = copy.copy(self)
+        for key, value in attributes.items():
+            setattr(query, key, value)
+        return query
+
+    def get_range_field(self):
+        row_key = self.model_class.Meta.row_key
+        if len(self.prefix_values) >= len(row_key):
+            raise ValueError('the prefix already covers the whole row key, there is no range field')
+        return self.model_class.get_field_hash()[row_key[len(self.prefix_values)]]
+
+    # chaining
+
+    def prefix(self, *values):
+        if len(values) > len(self.model_class.Meta.row_key):
+            raise ValueError('{} has only {} row key fields'.format(
+                self.model_class.__name__,
+                len(self.model_class.Meta.row_key),
+            ))
+        return self.clone(prefix_values=values)
+
+    def after(self, value):
+        return self.clone(after_value=value)
+
+    def before(self, value):
+        return self.clone(before_value=value)
+
+    def newest_first(self):
+        return self.clone(is_newest_first=True)
+
+    def limit(self, limit):
+        if limit is not None and limit < 1:
+            raise ValueError('limit should be at least 1')
+        return self.clone(limit_value=limit)
+
+    def only(self, *fields):
+        row_key = self.model_class.Meta.row_key
+        return self.clone(columns=tuple(key for key in fields if key not in row_key))
+
+    # scan
+
+    def serialize_prefix(self, values):
+        return self.model_class.serialize_row_key_from_tuple(values) or b''
+
+    def get_bounds(self):
+        """
+        (lower, upper) row keys, lower is included and upper excluded,
+        None means unbounded. with fixed width fields the rows whose range
+        field equals v are exactly the rows starting with prefix + (v,)
+        """
+        lower = self.serialize_prefix(self.prefix_values)
+        upper = bytes_increment(lower) if lower else None
+        if self.after_value is None and self.before_value is None:
+            return lower, upper
+
+        descending = self.get_range_field().descending
+        # in row key order the values smaller than v come before the rows of
+        # v and the larger ones after them, the other way around when the
+        # field is stored descending
+        bounds = (
+            (self.after_value, descending),
+            (self.before_value, not descending),
+        )
+        for value, is_before_value in bounds:
+            if value is None:
+                continue
+            key = self.serialize_prefix((*self.prefix_values, value))
+            if is_before_value:
+                upper = key if upper is None else min(upper, key)
+            else:
+                key = bytes_increment(key)
+                lower = max(lower, key) if key is not None else lower
+        return lower, upper
+
+    def get_reverse(self):
+        if not self.is_newest_first:
+            return False
+        return not self.get_range_field().descending
+
+    def iter_rows(self, limit=None, keys_only=False, columns=None):
+        model_class = self.model_class
+        lower, upper = self.get_bounds()
+        if upper is not None and lower >= upper:
+            return
+        reverse = self.get_reverse()
+        scan_filter, scan_columns = model_class.get_scan_options(columns=columns, keys_only=keys_only)
+        salt = model_class._schema.salt
+        unsalt = salt.strip if salt is not None else (lambda row_key: row_key)
+        batch_size = min(limit, self.batch_size) if limit else self.batch_size
+
+        if not reverse:
+            rows = model_class.scan_rows(
+                lower,
+                upper,
+                limit=limit,
+                batch_size=batch_size,
+                scan_filter=scan_filter,
+                scan_columns=scan_columns,
+                salts=self.get_salts(),
+            )
+            yield from rows
+            return
+
+        # a reversed scan includes its start row and excludes its stop row,
+        # the other way around of (lower, upper), so the scan goes one key
+        # further on both ends and the extra rows are dropped here
+        stop = decrement(lower)
+        rows = model_class.scan_rows(
+            upper,
+            stop,
+            limit=limit + 2 if limit else None,
+            reverse=True,
+            batch_size=batch_size + 2,
+            scan_filter=scan_filter,
+            scan_columns=scan_columns,
+            salts=self.get_salts(),
+        )
+        count = 0
+        for row_key, row_data in rows:
+            key = unsalt(row_key)
+            if upper is not None and key >= upper:
+                continue
+            if key < lower:
+                return
+            yield row_key, row_data
+            count += 1
+            if limit and count >= limit:
+                return
+
+    def get_salts(self):
+        if self.model_class._schema.salt is None:
+            return None
+        return self.model_class.get_scan_salts(self.prefix_values)
+
+    # terminal operations
+
+    def __iter__(self):
+        rows = self.iter_rows(limit=self.limit_value, columns=self.columns)
+        return iter(self.model_class.init_from_rows(rows))
+
+    def first(self):
+        rows = self.iter_rows(limit=1, columns=self.columns)
+        return next(iter(self.model_class.init_from_rows(rows)), None)
+
+    def exists(self):
+        return next(self.iter_rows(limit=1, keys_only=True), None) is not None
+
+    def count(self):
+        # only the first cell of every row, without its value, is sent back
+        return sum(1 for _ in self.iter_rows(limit=self.limit_value, keys_only=True))
+
+    def ids(self, key):
+        """
+        the values of one field, read from the row keys only when it is a
+        row key field, otherwise from that single column
+        """
+        model_class = self.model_class
+        if key in model_class.Meta.row_key:
+            rows = self.iter_rows(limit=self.limit_value, keys_only=True)
+            return [model_class.deserialize_row_key(row_key)[key] for row_key, _ in rows]
+        rows = self.iter_rows(limit=self.limit_value, columns=[key])
+        return [getattr(instance, key) for instance in model_class.init_from_rows(rows)]
+
+    def chunks(self, chunk_size):
+        instances = iter(self)
+        while True:
+            chunk = list(islice(instances, chunk_size))
+            if not chunk:
+                return
+            yield chunk
+
+
+def decrement(row_key):
+    """
+    a row key smaller than row_key, used as the (excluded) stop row of a
+    reversed scan that has to include row_key, the rows in between are
+    dropped by the caller. None means unbounded
+    """
+    if not row_key:
+        return None
+    last = row_key[-1]
+    if last == 0:
+        return row_key[:-1] or None
+    return row_key[:-1] + bytes([last - 1])
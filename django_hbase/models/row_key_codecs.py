@@ -0,0 +1,134 @@
+from django_hbase.models.exceptions import BadRowKeyError
+
+
+class TextRowKeyCodec:
+    """
+    encode the row key fields as text joined by ':'
+    {key1: val1} => b"val1"
+    {key1: val1, key2: val2} => b"val1:val2"
+    {key1: val1, key2: val2, key3: val3} => b"val1:val2:val3"
+    """
+
+    separator = ':'
+    # the first field is expected to be a reversed IntegerField, whose last
+    # digit (first character once reversed) is evenly distributed
+    leading_bytes = b'0123456789'
+
+    def __init__(self, row_key_fields):
+        # row_key_fields: ((key, field), ...) in Meta.row_key order
+        self.row_key_fields = row_key_fields
+        self.decoders = tuple(
+            (key, field.deserialize)
+            for key, field in row_key_fields
+        )
+
+    def encode(self, data, is_prefix=False):
+        values = []
+        for key, field in self.row_key_fields:
+            value = data.get(key)
+            if value is None:
+                if not is_prefix:
+                    raise BadRowKeyError(f"{key} is missing in row key")
+                break
+            value = field.serialize(value)
+            if self.separator in value:
+                raise BadRowKeyError(f"{key} should not contain ':' in value: {value}")
+            values.append(value)
+        return bytes(self.separator.join(values), encoding='utf-8')
+
+    def decode(self, row_key):
+        """
+        "val1" => {'key1': val1}
+        "val1:val2" => {'key1': val1, 'key2': val2}
+        "val1:val2:val3" => {'key1': val1, 'key2': val2, 'key3': val3}
+        """
+        if isinstance(row_key, bytes):
+            row_key = row_key.decode('utf-8')
+        # zip stops at the shorter one, so prefixes decode to partial dicts
+        return {
+            key: decode(value)
+            for (key, decode), value in zip(self.decoders, row_key.split(self.separator))
+        }
+
+
+# bytes.translate table that reverses the bit order inside every byte
+BIT_REVERSE_TABLE = bytes(int('{:08b}'.format(i)[::-1], 2) for i in range(256))
+
+
+class BinaryRowKeyCodec:
+    """
+    encode every row key field as a big-endian 8 bytes integer, no separator
+    {key1: 1, key2: 2} => 0x80000000_00000001 80000000_00000002 (16 bytes)
+
+    - the value is shifted by 2^63 so that signed integers keep their order
+      when compared byte by byte
+    - reverse=True reverses all 64 bits instead of the decimal digits, it is
+      a bijection as well, so consecutive ids still land far away from each
+      other and the value can be decoded back
+
+    a 2 fields row key takes 16 bytes instead of 33 characters.
+    """
+
+    width = 8
+    offset = 1 << 63
+    leading_bytes = bytes(range(256))
+
+    def __init__(self, row_key_fields):
+        for key, field in row_key_fields:
+            if field.field_type not in ('int', 'timestamp'):
+                raise BadRowKeyError(f'{key} can not be encoded by BinaryRowKeyCodec')
+        self.row_key_fields = row_key_fields
+
+    def encode_value(self, field, value):
+        if field.descending:
+            value = field.to_sort_value(value)
+        value = int(value) + self.offset
+        if not 0 <= value < (1 << 64):
+            raise BadRowKeyError(f'{value - self.offset} is out of the 64 bits range')
+        encoded = value.to_bytes(self.width, 'big')
+        if field.reverse:
+            encoded = encoded.translate(BIT_REVERSE_TABLE)[::-1]
+        return encoded
+
+    def decode_value(self, field, encoded):
+        if field.reverse:
+            encoded = encoded.translate(BIT_REVERSE_TABLE)[::-1]
+        value = int.from_bytes(encoded, 'big') - self.offset
+        if field.descending:
+            value = field.to_sort_value(value)
+        return value
+
+    def encode(self, data, is_prefix=False):
+        values = []
+        for key, field in self.row_key_fields:
+            value = data.get(key)
+            if value is None:
+                if not is_prefix:
+                    raise BadRowKeyError(f"{key} is missing in row key")
+                break
+            values.append(self.encode_value(field, value))
+        return b''.join(values)
+
+    def decode(self, row_key):
+        data = {}
+        for index, (key, field) in enumerate(self.row_key_fields):
+            encoded = row_key[index * self.width: (index + 1) * self.width]
+            if len(encoded) < self.width:
+                break
+            data[key] = self.decode_value(field, encoded)
+        return data
+
+
+ROW_KEY_CODECS = {
+    'text': TextRowKeyCodec,
+    'binary': BinaryRowKeyCodec,
+}
+
+
+def get_row_key_codec_class(name):
+    if name not in ROW_KEY_CODECS:
+        raise BadRowKeyError('Unknown row key codec {}, choose from {}'.format(
+            name,
+            ', '.join(ROW_KEY_CODECS),
+        ))
+    return ROW_KEY_CODECS[name]
@@ -0,0 +1,135 @@
+from concurrent.futures import ThreadPoolExecutor
+from django_hbase.models.exceptions import BadRowKeyError
+from happybase.util import bytes_increment
+from itertools import islice
+import heapq
+import zlib
+
+
+class RowKeySalt:
+    """
+    prefix every row key with one salt byte, the bucket of the row, computed
+    from a row key field that is not the first one:
+        Meta.salt_buckets = 16
+        Meta.salt_field = 'created_at'
+    the rows of one user are then spread over salt_buckets key ranges (and
+    regions) instead of a single one, at the price of one scan per bucket
+    when the salt field is not known.
+    """
+
+    def __init__(self, buckets, key, field):
+        if not 1 < buckets <= 256:
+            raise BadRowKeyError('salt_buckets should be between 2 and 256')
+        self.buckets = buckets
+        self.key = key
+        self.field = field
+        self.salts = tuple(bytes([bucket]) for bucket in range(buckets))
+
+    def get_salt(self, data):
+        value = self.field.serialize(data[self.key])
+        if isinstance(value, str):
+            value = value.encode('utf-8')
+        # crc32 is stable across processes, unlike the builtin hash()
+        return self.salts[zlib.crc32(value) % self.buckets]
+
+    def get_salts(self, data):
+        if data and data.get(self.key) is not None:
+            return [self.get_salt(data)]
+        return list(self.salts)
+
+    def add(self, row_key, data):
+        return self.get_salt(data) + row_key
+
+    def strip(self, row_key):
+        return row_key[1:]
+
+
+class SaltedScan:
+    """
+    scatter a scan to every salt bucket and merge the sorted results back,
+    the buckets are read page by page so memory stays bounded by
+    buckets * batch_size rows and no connection is held between pages.
+    the first page of every bucket is fetched in parallel from a thread pool.
+    """
+
+    def __init__(
+        self,
+        model_class,
+        salts,
+        row_start=None,
+        row_stop=None,
+        row_prefix=None,
+        limit=None,
+        reverse=False,
+        batch_size=1000,
+        scan_filter=None,
+        scan_columns=None,
+        max_workers=None,
+    ):
+        self.model_class = model_class
+        self.salts = salts
+        self.row_start = row_start
+        self.row_stop = row_stop
+        self.row_prefix = row_prefix
+        self.limit = limit
+        self.reverse = reverse
+        self.page_size = min(batch_size, limit) if limit else batch_size
+        self.scan_filter = scan_filter
+        self.scan_columns = scan_columns
+        self.max_workers = max_workers or len(salts)
+
+    def get_bounds(self, salt):
+        # same semantic as happybase: in a reverse scan row_start is the
+        # (inclusive) upper bound and row_stop the (exclusive) lower bound
+        if self.row_prefix is not None:
+            lower, upper = salt + self.row_prefix, bytes_increment(salt + self.row_prefix)
+        else:
+            lower, upper = salt, bytes_increment(salt)
+        if self.reverse:
+            row_start = salt + self.row_start if self.row_start is not None else upper
+            row_stop = salt + self.row_stop if self.row_stop is not None else lower
+        else:
+            row_start = salt + self.row_start if self.row_start is not None else lower
+            row_stop = salt + self.row_stop if self.row_stop is not None else upper
+        return row_start, row_stop
+
+    def fetch_page(self, row_start, row_stop, last_row_key=None):
+        # a page restarts at the last row key seen (inclusive), so one more
+        # row is asked for and the already returned one is skipped
+        page_size = self.page_size + (1 if last_row_key is not None else 0)
+        rows = self.model_class.execute(lambda table: list(table.scan(
+            row_start,
+            row_stop,
+            columns=self.scan_columns,
+            filter=self.scan_filter,
+            limit=page_size,
+            reverse=self.reverse,
+            batch_size=page_size,
+        )), idempotent=True)
+        is_last_page = len(rows) < page_size
+        if last_row_key is not None and rows and rows[0][0] == last_row_key:
+            rows = rows[1:]
+        return rows, is_last_page
+
+    def iter_bucket(self, row_stop, first_page):
+        rows, is_last_page = first_page
+        while True:
+            yield from rows
+            if is_last_page or not rows:
+                return
+            last_row_key = rows[-1][0]
+            rows, is_last_page = self.fetch_page(last_row_key, row_stop, last_row_key)
+
+    def __iter__(self):
+        bounds = [self.get_bounds(salt) for salt in self.salts]
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(bounds))) as executor:
+            first_pages = list(executor.map(lambda bound: self.fetch_page(*bound), bounds))
+        buckets = [
+            self.iter_bucket(row_stop, first_page)
+            for (_, row_stop), first_page in zip(bounds, first_pages)
+        ]
+        # rows of different buckets only differ by the salt byte prefix
+        rows = heapq.merge(*buckets, key=lambda row: row[0][1:], reverse=self.reverse)
+        if self.limit:
+            rows = islice(rows, self.limit)
+        return iter(rows)
@@ -0,0 +1,151 @@
+from django_hbase.models.exceptions import BadRowKeyError
+from django_hbase.models.fields import CounterField, HBaseField
+from django_hbase.models.row_key_codecs import get_row_key_codec_class
+from django_hbase.models.salting import RowKeySalt
+from types import MappingProxyType
+
+
+# options of a column family understood by happybase.Connection.create_table
+COLUMN_FAMILY_OPTIONS = (
+    'max_versions',
+    'time_to_live',
+    'bloom_filter_type',
+    'compression',
+    'block_cache_enabled',
+    'in_memory',
+)
+
+
+def get_split_keys(leading_bytes, regions):
+    """
+    split the key space evenly on the possible values of the first byte
+    of the row key (the salt, or the leading byte of the row key codec):
+        get_split_keys(b'0123456789', 5) => [b'2', b'4', b'6', b'8']
+    """
+    if not regions or regions <= 1:
+        return []
+    regions = min(regions, len(leading_bytes))
+    return [
+        leading_bytes[index * len(leading_bytes) // regions:][:1]
+        for index in range(1, regions)
+    ]
+
+
+class HBaseSchema:
+    """
+    everything HBaseModel needs to (de)serialize a row, compiled once per
+    model class instead of walking the class attributes on every call.
+    treat it as read only, the mappings are exposed as MappingProxyType.
+    """
+
+    def __init__(self, model_class):
+        fields = {}
+        for klass in reversed(model_class.__mro__):
+            for key, value in vars(klass).items():
+                if isinstance(value, HBaseField):
+                    fields[key] = value
+        self.fields = MappingProxyType(fields)
+
+        for key in model_class.Meta.row_key:
+            if key not in fields or fields[key].column_family:
+                raise BadRowKeyError(
+                    f'{key} in {model_class.__name__}.Meta.row_key is not a row key field'
+                )
+        self.row_key_fields = tuple(
+            (key, fields[key])
+            for key in model_class.Meta.row_key
+        )
+        self.salt = None
+        salt_buckets = getattr(model_class.Meta, 'salt_buckets', None)
+        if salt_buckets:
+            salt_key = getattr(model_class.Meta, 'salt_field', None)
+            if salt_key not in model_class.Meta.row_key[1:]:
+                raise BadRowKeyError(
+                    f'{model_class.__name__}.Meta.salt_field should be a row key field but the first one'
+                )
+            self.salt = RowKeySalt(salt_buckets, salt_key, fields[salt_key])
+
+        codec_class = get_row_key_codec_class(getattr(model_class.Meta, 'row_key_codec', 'text'))
+        self.row_key_codec = codec_class(self.row_key_fields)
+        self.indexes = MappingProxyType({
+            index.name: index.bind(self, codec_class)
+            for index in getattr(model_class.Meta, 'indexes', ())
+        })
+
+        # column key is prebuilt as b'cf:name', which is what happybase
+        # returns in row data, so decoding is a single dict lookup
+        self.column_fields = tuple(
+            (key, field, '{}:{}'.format(field.column_family, key).encode('utf-8'))
+            for key, field in fields.items()
+            if field.column_family
+        )
+        self.column_keys = MappingProxyType({
+            key: column_key
+            for key, _, column_key in self.column_fields
+        })
+        self.column_decoders = MappingProxyType({
+            column_key: (key, field.deserialize)
+            for key, field, column_key in self.column_fields
+        })
+        self.column_families = tuple(sorted(set(
+            field.column_family
+            for _, field, _ in self.column_fields
+        )))
+
+        column_family_options = getattr(model_class.Meta, 'column_family_options', None) or {}
+        for column_family, options in column_family_options.items():
+            if column_family not in self.column_families:
+                raise ValueError(f'{model_class.__name__} has no column family {column_family}')
+            for option in options:
+                if option not in COLUMN_FAMILY_OPTIONS:
+                    raise ValueError('Unknown column family option {}, choose from {}'.format(
+                        option,
+                        ', '.join(COLUMN_FAMILY_OPTIONS),
+                    ))
+        self.column_family_options = MappingProxyType({
+            column_family: MappingProxyType(dict(column_family_options.get(column_family, {})))
+            for column_family in self.column_families
+        })
+        self.pre_split_regions = getattr(model_class.Meta, 'pre_split_regions', None)
+
+    def get_split_keys(self):
+        if self.salt is not None:
+            return get_split_keys(b''.join(self.salt.salts), self.pre_split_regions)
+        return get_split_keys(self.row_key_codec.leading_bytes, self.pre_split_regions)
+
+    def encode_row_key(self, data, is_prefix=False):
+        # prefixes are returned without salt, the scan adds the salt of
+        # every bucket it reads from
+        row_key = self.row_key_codec.encode(data, is_prefix=is_prefix)
+        if self.salt is None or is_prefix:
+            return row_key
+        return self.salt.add(row_key, data)
+
+    def decode_row_key(self, row_key):
+        if self.salt is not None:
+            row_key = self.salt.strip(row_key)
+        return self.row_key_codec.decode(row_key)
+
+    def encode_row_data(self, data):
+        row_data = {}
+        for key, field, column_key in self.column_fields:
+            # counters are only written by atomic increments
+            if field.field_type == CounterField.field_type:
+                continue
+            value = data.get(key)
+            if value is None:
+                continue
+            row_data[column_key] = field.serialize(value)
+        return row_data
+
+    def decode_row(self, row_key, row_data):
+        data = self.decode_row_key(row_key)
+        column_decoders = self.column_decoders
+        for column_key, column_value in row_data.items():
+            decoder = column_decoders.get(column_key)
+            # columns that are no longer declared on the model are ignored
+            if decoder is None:
+                continue
+            key, decode = decoder
+            data[key] = decode(column_value)
+        return data
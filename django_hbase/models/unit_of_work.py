@@ -0,0 +1,72 @@
+from django_hbase.client import HBaseClient
+import time
+
+
+class HBaseUnitOfWork:
+    """
+    collect puts and deletes across several models / tables and send them
+    as one batch per table when the with block exits:
+
+        with HBaseUnitOfWork() as unit_of_work:
+            HBaseFollower.create(unit_of_work=unit_of_work, ...)
+            HBaseFollowing.create(unit_of_work=unit_of_work, ...)
+
+    tables are flushed in the order they were first written to, so a model's
+    primary rows always reach hbase before its index rows. once a table has
+    batch_size pending mutations everything is flushed, keeping memory
+    bounded for bulk jobs. nothing is sent if the block raises.
+    stats holds the per table counts and flush timings of the last flushes.
+    """
+
+    def __init__(self, batch_size=1000):
+        self.batch_size = batch_size
+        # table name => [(row_key, row_data), ...], row_data None means delete
+        self.pending = {}
+        self.stats = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.flush()
+        else:
+            self.pending = {}
+        return False
+
+    def put(self, table_name, row_key, row_data):
+        self._add(table_name, row_key, row_data)
+
+    def delete(self, table_name, row_key):
+        self._add(table_name, row_key, None)
+
+    def _add(self, table_name, row_key, row_data):
+        mutations = self.pending.setdefault(table_name, [])
+        mutations.append((row_key, row_data))
+        if len(mutations) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+        pending, self.pending = self.pending, {}
+        # writes are not retried, a timed out batch may have been applied
+        HBaseClient.execute(lambda conn: self.send(conn, pending))
+
+    def send(self, conn, pending):
+        for table_name, mutations in pending.items():
+            start = time.perf_counter()
+            with conn.table(table_name).batch(batch_size=self.batch_size) as batch:
+                for row_key, row_data in mutations:
+                    if row_data is None:
+                        batch.delete(row_key)
+                    else:
+                        batch.put(row_key, row_data)
+            stats = self.stats.setdefault(table_name, {
+                'mutations': 0,
+                'flushes': 0,
+                'seconds': 0.0,
+            })
+            stats['mutations'] += len(mutations)
+            stats['flushes'] += 1
+            stats['seconds'] += time.perf_counter() - start
@@ -0,0 +1,767 @@
+from django_hbase.circuit_breaker import CircuitBreaker, CircuitOpenError, HBaseUnavailable
+from django_hbase.client import HBaseClient, HBaseConnectionPool, NoConnectionsAvailable
+from django_hbase.emulator import Connection, FilterSyntaxError, HBaseEmulator, IOError as HBaseIOError
+from django_hbase.models import (
+    BadFilterError,
+    BadRowKeyError,
+    BinaryRowKeyCodec,
+    HBaseModel,
+    HBaseSchema,
+    HBaseUnitOfWork,
+    IntegerField,
+    RowKeySalt,
+    TimestampField,
+    compile_where,
+    get_split_keys,
+)
+from django.conf import settings
+from django.core.management import call_command
+from django.utils.module_loading import import_string
+from friendships.models import HBaseFollowing, HBaseFollower, HBaseFriendshipCount
+from newsfeeds.models import HBaseNewsFeed
+from io import StringIO
+from testing.testcases import TestCase
+from thriftpy2.transport import TTransportException
+from unittest import mock
+
+import copy
+import gc
+import pickle
+import threading
+import time
+
+
+def in_row_key_order(model_class, newest_first):
+    # the models of the timelines are stored newest first or in the old
+    # ascending layout, see HBASE_NEWEST_FIRST_TIMELINES
+    if model_class.get_field_hash()['created_at'].descending:
+        return newest_first
+    return newest_first[::-1]
+
+
+class HBaseSaltedNewsFeed(HBaseModel):
+    __slots__ = ()
+
+    user_id = IntegerField(reverse=True)
+    created_at = TimestampField()
+    tweet_id = IntegerField(column_family='cf')
+
+    class Meta:
+        table_name = 'salted_newsfeeds'
+        row_key = ('user_id', 'created_at')
+        salt_buckets = 4
+        salt_field = 'created_at'
+
+
+class HBaseConnectionPoolTests(TestCase):
+
+    @property
+    def ts_now(self):
+        return int(time.time() * 1000000)
+
+    def create_pool(self):
+        return HBaseConnectionPool(
+            size=1,
+            timeout=0.1,
+            connection_class=import_string(settings.HBASE_CONNECTION_CLASS),
+            host=settings.HBASE_HOST,
+        )
+
+    def test_nested_checkout_reuses_connection(self):
+        pool = self.create_pool()
+        with pool.connection() as conn1:
+            with pool.connection() as conn2:
+                self.assertIs(conn1, conn2)
+        pool.close()
+
+    def test_interleaved_scans(self):
+        ts = self.ts_now
+        for to_user_id in (2, 3):
+            HBaseFollowing.create(from_user_id=1, to_user_id=to_user_id, created_at=ts + to_user_id)
+        pool = self.create_pool()
+
+        def scan():
+            with pool.connection() as conn:
+                for row in conn.table(HBaseFollowing.get_table_name()).scan():
+                    yield row
+
+        errors = []
+
+        def checkout():
+            try:
+                with pool.connection():
+                    pass
+            except NoConnectionsAvailable as e:
+                errors.append(e)
+
+        # the second scan starts inside the first one and outlives it
+        first = scan()
+        next(first)
+        second = scan()
+        next(second)
+        self.assertEqual(len(list(first)), 1)
+        # still in use by the second scan, not back in the pool
+        thread = threading.Thread(target=checkout)
+        thread.start()
+        thread.join()
+        self.assertEqual(len(errors), 1)
+        self.assertEqual(len(list(second)), 1)
+        checkout()
+        self.assertEqual(len(errors), 1)
+
+        # an error in a nested checkout drops the connection
+        with pool.connection() as conn:
+            with self.assertRaises(TTransportException):
+                with pool.connection():
+                    raise TTransportException()
+        self.assertFalse(conn.transport.is_open())
+        with pool.connection() as new_conn:
+            self.assertIsNot(new_conn, conn)
+        pool.close()
+
+    def test_pool_is_bounded(self):
+        pool = self.create_pool()
+        errors = []
+
+        def checkout():
+            try:
+                with pool.connection():
+                    pass
+            except NoConnectionsAvailable as e:
+                errors.append(e)
+
+        with pool.connection():
+            thread = threading.Thread(target=checkout)
+            thread.start()
+            thread.join()
+        self.assertEqual(len(errors), 1)
+
+        # the connection is back in the pool, so the next checkout succeeds
+        checkout()
+        self.assertEqual(len(errors), 1)
+        pool.close()
+
+    def test_idle_connection_is_pinged(self):
+        pool = self.create_pool()
+        with pool.connection() as conn:
+            pass
+        # a half closed socket still looks open until a call goes through it
+        with mock.patch.object(conn, 'tables', side_effect=TTransportException()):
+            with pool.connection() as same_conn:
+                self.assertIs(same_conn, conn)
+            pool.idle_check = 0
+            with pool.connection() as new_conn:
+                self.assertIsNot(new_conn, conn)
+        self.assertFalse(conn.transport.is_open())
+        with pool.connection() as conn:
+            self.assertIs(conn, new_conn)
+        pool.close()
+
+    def test_reconnect_after_socket_closed(self):
+        ts = self.ts_now
+        HBaseFollowing.create(from_user_id=1, to_user_id=2, created_at=ts)
+        with HBaseClient.connection() as conn:
+            conn.close()
+        instance = HBaseFollowing.get(from_user_id=1, created_at=ts)
+        self.assertEqual(instance.to_user_id, 2)
+
+
+class HBaseSchemaTests(TestCase):
+
+    def test_schema(self):
+        schema = HBaseNewsFeed._schema
+        self.assertEqual([key for key, _ in schema.row_key_fields], ['user_id', 'created_at'])
+        self.assertEqual(
+            [column_key for _, _, column_key in schema.column_fields],
+            [b'cf:tweet_id'],
+        )
+        self.assertEqual(schema.column_families, ('cf',))
+        self.assertIs(HBaseNewsFeed.get_field_hash(), schema.fields)
+
+    def test_table_specs(self):
+        self.assertEqual(get_split_keys(b'0123456789', 5), [b'2', b'4', b'6', b'8'])
+        self.assertEqual(get_split_keys(b'0123456789', 20), [bytes([c]) for c in b'123456789'])
+        self.assertEqual(get_split_keys(bytes(range(256)), 4), [b'\x40', b'\x80', b'\xc0'])
+        self.assertEqual(get_split_keys(b'0123456789', None), [])
+
+        specs = HBaseFollowing.get_table_specs()
+        column_families, split_keys = specs[HBaseFollowing.get_table_name()]
+        self.assertEqual(column_families, {'cf': {'max_versions': 1, 'bloom_filter_type': 'ROW'}})
+        self.assertEqual(len(split_keys), 9)
+        index_table_name = HBaseFollowing.get_index_table_name('from_user_id_to_user_id')
+        self.assertEqual(specs[index_table_name][0], column_families)
+        self.assertEqual(HBaseSaltedNewsFeed.get_table_specs()[HBaseSaltedNewsFeed.get_table_name()][1], [])
+
+        # the tables created by setUp already match their Meta
+        out = StringIO()
+        call_command('hbase_sync_tables', 'newsfeeds.models.HBaseNewsFeed', shell_only=True, stdout=out)
+        self.assertNotIn('alter', out.getvalue())
+
+        # a missing table is printed as a create statement, not created
+        with HBaseClient.connection() as conn:
+            conn.delete_table(index_table_name, disable=True)
+        out = StringIO()
+        call_command('hbase_sync_tables', 'friendships.models.HBaseFollowing', shell_only=True, stdout=out)
+        self.assertIn("create '{}', {{NAME => 'cf'".format(index_table_name), out.getvalue())
+        with HBaseClient.connection() as conn:
+            self.assertNotIn(index_table_name.encode('utf-8'), conn.tables())
+            conn.create_table(index_table_name, column_families)
+
+    def test_rewrite_table_creates_target_from_specs(self):
+        HBaseFollowing.create(from_user_id=1, to_user_id=2, created_at=int(time.time() * 1000000))
+        target_table_name = 'test_rewritten_followings'
+        out = StringIO()
+        call_command(
+            'hbase_rewrite_table',
+            'friendships.models.HBaseFollowing',
+            target_table=target_table_name,
+            to_codec='text',
+            stdout=out,
+        )
+        # created with the column family options and splits of the model
+        with HBaseClient.connection() as conn:
+            families = conn.table(target_table_name).families()
+            conn.delete_table(target_table_name, disable=True)
+        self.assertEqual(families[b'cf']['max_versions'], 1)
+        self.assertEqual(families[b'cf']['bloom_filter_type'], b'ROW')
+        _, split_keys = HBaseFollowing.get_table_specs()[HBaseFollowing.get_table_name()]
+        split_statements = [line for line in out.getvalue().splitlines() if line.startswith('split ')]
+        self.assertEqual(len(split_statements), len(split_keys))
+        self.assertIn('1 rows rewritten', out.getvalue())
+
+    def test_build_index_creates_tables_from_specs(self):
+        HBaseFollowing.create(from_user_id=1, to_user_id=2, created_at=int(time.time() * 1000000))
+        index_table_name = HBaseFollowing.get_index_table_name('from_user_id_to_user_id')
+        with HBaseClient.connection() as conn:
+            conn.delete_table(index_table_name, disable=True)
+        out = StringIO()
+        call_command('hbase_build_index', 'friendships.models.HBaseFollowing', stdout=out)
+        with HBaseClient.connection() as conn:
+            families = conn.table(index_table_name).families()
+        self.assertEqual(families[b'cf']['max_versions'], 1)
+        self.assertEqual(families[b'cf']['bloom_filter_type'], b'ROW')
+        _, split_keys = HBaseFollowing.get_table_specs()[index_table_name]
+        split_statements = [line for line in out.getvalue().splitlines() if line.startswith('split ')]
+        self.assertEqual(len(split_statements), len(split_keys))
+        self.assertIn('1 rows indexed', out.getvalue())
+        self.assertIsNotNone(HBaseFollowing.get_by_index('from_user_id_to_user_id', from_user_id=1, to_user_id=2))
+
+    def test_row_round_trip(self):
+        data = {'user_id': 12, 'created_at': 1600000000000000, 'tweet_id': 3}
+        row_key = HBaseNewsFeed.serialize_row_key(data)
+        if HBaseNewsFeed.get_field_hash()['created_at'].descending:
+            # stored as MAX_TIMESTAMP - created_at
+            self.assertEqual(row_key, b'2100000000000000:8399999999999999')
+        else:
+            self.assertEqual(row_key, b'2100000000000000:1600000000000000')
+        self.assertEqual(
+            HBaseNewsFeed.deserialize_row_key(row_key),
+            {'user_id': 12, 'created_at': 1600000000000000},
+        )
+        self.assertEqual(HBaseNewsFeed.deserialize_row_key(b'2100000000000000'), {'user_id': 12})
+        instance = HBaseNewsFeed.init_from_row(row_key, {b'cf:tweet_id': b'0000000000000003'})
+        self.assertEqual(instance.user_id, 12)
+        self.assertEqual(instance.created_at, 1600000000000000)
+        self.assertEqual(instance.tweet_id, 3)
+        self.assertEqual(instance.row_key, row_key)
+
+    def test_slotted_instances(self):
+        newsfeed = HBaseNewsFeed(user_id=1, created_at=100, tweet_id=2)
+        self.assertIsInstance(newsfeed, HBaseNewsFeed)
+        self.assertEqual(newsfeed.__class__.__name__, 'HBaseNewsFeed')
+        self.assertEqual(type(newsfeed).__slots__, ('user_id', 'created_at', 'tweet_id'))
+        for model_class in HBaseModel.__subclasses__():
+            self.assertFalse(hasattr(model_class(), '__dict__'), model_class)
+        # the attributes the model declares can be set
+        newsfeed.hydrated_tweet = None
+        self.assertEqual(newsfeed.to_dict(), {'user_id': 1, 'created_at': 100, 'tweet_id': 2})
+        self.assertEqual(HBaseNewsFeed.get_field_hash()['tweet_id'].column_family, 'cf')
+        newsfeed.tweet_id = 3
+        copied = pickle.loads(pickle.dumps(newsfeed))
+        self.assertEqual(copied.to_dict(), newsfeed.to_dict())
+        self.assertEqual(copy.copy(newsfeed).row_key, newsfeed.row_key)
+
+        # a model that forgets __slots__ is refused
+        with self.assertRaises(TypeError):
+            type('HBaseDictNewsFeed', (HBaseModel,), {'user_id': IntegerField()})
+        # the refused class is still a subclass of HBaseModel until collected
+        gc.collect()
+
+    def test_benchmark_memory(self):
+        out = StringIO()
+        call_command('hbase_benchmark_memory', 'newsfeeds.models.HBaseNewsFeed', rows=100, stdout=out)
+        self.assertIn('100 rows of HBaseNewsFeed', out.getvalue())
+        self.assertIn('__dict__:', out.getvalue())
+
+
+class BinaryRowKeyCodecTests(TestCase):
+
+    def setUp(self):
+        super(BinaryRowKeyCodecTests, self).setUp()
+        self.codec = BinaryRowKeyCodec(HBaseNewsFeed._schema.row_key_fields)
+
+    def test_encode_and_decode(self):
+        data = {'user_id': 12, 'created_at': 1600000000000000}
+        row_key = self.codec.encode(data)
+        self.assertEqual(len(row_key), 16)
+        self.assertEqual(self.codec.decode(row_key), data)
+        # prefix only contains the user_id part
+        prefix = self.codec.encode({'user_id': 12}, is_prefix=True)
+        self.assertEqual(len(prefix), 8)
+        self.assertTrue(row_key.startswith(prefix))
+        self.assertEqual(self.codec.decode(prefix), {'user_id': 12})
+
+        try:
+            self.codec.encode({'user_id': 12})
+            exception_raised = False
+        except BadRowKeyError as e:
+            exception_raised = True
+            self.assertEqual(str(e), 'created_at is missing in row key')
+        self.assertEqual(exception_raised, True)
+
+    def test_order_preserving(self):
+        timestamps = [-5, 0, 1, 2, 10, 255, 256, 1600000000000000]
+        row_keys = [
+            self.codec.encode({'user_id': 1, 'created_at': ts})
+            for ts in timestamps
+        ]
+        # the newest row comes first when created_at is descending
+        self.assertEqual(sorted(row_keys), in_row_key_order(HBaseNewsFeed, row_keys[::-1]))
+
+    def test_reverse_spreads_sequential_ids(self):
+        first = self.codec.encode({'user_id': 1}, is_prefix=True)
+        second = self.codec.encode({'user_id': 2}, is_prefix=True)
+        # bit reversed, consecutive user ids differ in the leading byte
+        self.assertNotEqual(first[0], second[0])
+
+
+class HBaseIterFilterTests(TestCase):
+
+    def test_iter_filter_and_chunks(self):
+        for to_user_id in range(5):
+            HBaseFollowing.create(from_user_id=1, to_user_id=to_user_id, created_at=100 + to_user_id)
+        HBaseFollowing.create(from_user_id=2, to_user_id=10, created_at=100)
+
+        # in row key order
+        to_user_ids = in_row_key_order(HBaseFollowing, [4, 3, 2, 1, 0])
+        followings = HBaseFollowing.iter_filter(prefix=(1, None), batch_size=2)
+        self.assertFalse(isinstance(followings, list))
+        self.assertEqual([f.to_user_id for f in followings], to_user_ids)
+
+        chunks = list(HBaseFollowing.chunks(2, prefix=(1, None)))
+        self.assertEqual(
+            [[f.to_user_id for f in chunk] for chunk in chunks],
+            [to_user_ids[0:2], to_user_ids[2:4], to_user_ids[4:]],
+        )
+        chunks = list(HBaseFollowing.chunks(2, prefix=(1, None), reverse=True, limit=3))
+        self.assertEqual(
+            [[f.to_user_id for f in chunk] for chunk in chunks],
+            [to_user_ids[:-3:-1], to_user_ids[-3:-2]],
+        )
+        self.assertEqual(list(HBaseFollowing.chunks(2, prefix=(3, None))), [])
+
+
+class HBaseGetManyTests(TestCase):
+
+    def test_get_many(self):
+        HBaseFollowing.create(from_user_id=1, to_user_id=2, created_at=100)
+        HBaseFollower.create(from_user_id=1, to_user_id=2, created_at=100)
+        HBaseNewsFeed.create(user_id=1, tweet_id=3, created_at=100)
+        HBaseNewsFeed.create(user_id=2, tweet_id=4, created_at=200)
+
+        self.assertEqual(HBaseNewsFeed.get_many([]), [])
+        newsfeeds = HBaseNewsFeed.get_many([
+            {'user_id': 2, 'created_at': 200},
+            {'user_id': 1, 'created_at': 300},
+            {'user_id': 1, 'created_at': 100},
+        ], chunk_size=2)
+        self.assertEqual(newsfeeds[0].tweet_id, 4)
+        self.assertEqual(newsfeeds[1], None)
+        self.assertEqual(newsfeeds[2].tweet_id, 3)
+
+        followings = HBaseFollowing.get_many([{'from_user_id': 1, 'created_at': 100}])
+        self.assertEqual(followings[0].to_user_id, 2)
+        followers = HBaseFollower.get_many([{'to_user_id': 2, 'created_at': 100}])
+        self.assertEqual(followers[0].from_user_id, 1)
+
+
+class HBaseScanFilterTests(TestCase):
+
+    def test_compile_where(self):
+        self.assertEqual(
+            compile_where(HBaseFollowing._schema, {'to_user_id': 12}),
+            b"SingleColumnValueFilter('cf', 'to_user_id', =, 'binary:0000000000000012', true, true)",
+        )
+        self.assertEqual(
+            compile_where(HBaseNewsFeed._schema, {'tweet_id__gte': 1, 'tweet_id__lt': 5}),
+            b"SingleColumnValueFilter('cf', 'tweet_id', >=, 'binary:0000000000000001', true, true)"
+            b" AND SingleColumnValueFilter('cf', 'tweet_id', <, 'binary:0000000000000005', true, true)",
+        )
+        # counters are compared as binary, the quote byte 0x27 is doubled
+        self.assertEqual(
+            compile_where(HBaseFriendshipCount._schema, {'followers_count': 0x27ff}),
+            b"SingleColumnValueFilter('cf', 'followers_count', =, "
+            b"'binary:\x00\x00\x00\x00\x00\x00''\xff', true, true)",
+        )
+        for where in [{'from_user_id': 1}, {'to_user_id__in': [1]}]:
+            with self.assertRaises(BadFilterError):
+                compile_where(HBaseFollowing._schema, where)
+
+    def test_filter_with_where_columns_and_keys_only(self):
+        for to_user_id in range(5):
+            HBaseFollowing.create(from_user_id=1, to_user_id=to_user_id, created_at=100 + to_user_id)
+
+        followings = HBaseFollowing.filter(prefix=(1, None), where={'to_user_id': 3})
+        self.assertEqual([(f.to_user_id, f.created_at) for f in followings], [(3, 103)])
+        followings = HBaseFollowing.filter(prefix=(1, None), where={'to_user_id__gt': 2})
+        self.assertEqual([f.to_user_id for f in followings], in_row_key_order(HBaseFollowing, [4, 3]))
+        followings = HBaseFollowing.filter(prefix=(1, None), where={'to_user_id': 10})
+        self.assertEqual(followings, [])
+
+        to_user_ids = in_row_key_order(HBaseFollowing, [4, 3, 2, 1, 0])
+        followings = HBaseFollowing.filter(prefix=(1, None), columns=['to_user_id'], limit=2)
+        self.assertEqual([f.to_user_id for f in followings], to_user_ids[:2])
+
+        followings = HBaseFollowing.filter(prefix=(1, None), keys_only=True)
+        self.assertEqual([f.created_at for f in followings], [100 + to_user_id for to_user_id in to_user_ids])
+        self.assertEqual(followings[0].to_user_id, None)
+
+        # a counter holding a quote and a non utf-8 byte
+        HBaseFriendshipCount.set_counter('followers_count', 0x27ff, user_id=1)
+        HBaseFriendshipCount.set_counter('followers_count', 1, user_id=2)
+        counts = HBaseFriendshipCount.filter(where={'followers_count': 0x27ff})
+        self.assertEqual([(c.user_id, c.followers_count) for c in counts], [(1, 0x27ff)])
+
+
+class HBaseIndexTests(TestCase):
+
+    def test_get_by_index(self):
+        index_name = 'from_user_id_to_user_id'
+        HBaseFollowing.create(from_user_id=1, to_user_id=2, created_at=100)
+        HBaseFollowing.batch_create([
+            {'from_user_id': 1, 'to_user_id': 3, 'created_at': 101},
+            {'from_user_id': 2, 'to_user_id': 3, 'created_at': 102},
+        ])
+
+        instance = HBaseFollowing.get_by_index(index_name, from_user_id=1, to_user_id=2)
+        self.assertEqual(instance.created_at, 100)
+        instance = HBaseFollowing.get_by_index(index_name, from_user_id=2, to_user_id=3)
+        self.assertEqual(instance.created_at, 102)
+        self.assertEqual(HBaseFollowing.get_by_index(index_name, from_user_id=3, to_user_id=1), None)
+
+        # delete with and without the indexed fields
+        HBaseFollowing.delete(from_user_id=1, created_at=100, to_user_id=2)
+        self.assertEqual(HBaseFollowing.get_by_index(index_name, from_user_id=1, to_user_id=2), None)
+        HBaseFollowing.delete(from_user_id=1, created_at=101)
+        self.assertEqual(HBaseFollowing.get_by_index(index_name, from_user_id=1, to_user_id=3), None)
+
+        # the indexed field changed, the old index row is stale
+        instance = HBaseFollowing.get(from_user_id=2, created_at=102)
+        instance.to_user_id = 4
+        instance.save()
+        self.assertEqual(HBaseFollowing.get_by_index(index_name, from_user_id=2, to_user_id=3), None)
+        instance = HBaseFollowing.get_by_index(index_name, from_user_id=2, to_user_id=4)
+        self.assertEqual(instance.created_at, 102)
+
+
+class HBaseCounterTests(TestCase):
+
+    def test_counter(self):
+        self.assertEqual(HBaseFriendshipCount.get_counter('followers_count', user_id=1), 0)
+        self.assertEqual(HBaseFriendshipCount.increase_counter('followers_count', user_id=1), 1)
+        self.assertEqual(HBaseFriendshipCount.increase_counter('followers_count', 5, user_id=1), 6)
+        self.assertEqual(HBaseFriendshipCount.increase_counter('followers_count', -2, user_id=1), 4)
+        HBaseFriendshipCount.set_counter('followings_count', 10, user_id=1)
+
+        instance = HBaseFriendshipCount.get(user_id=1)
+        self.assertEqual(instance.followers_count, 4)
+        self.assertEqual(instance.followings_count, 10)
+        self.assertEqual(HBaseFriendshipCount.get_counter('followers_count', user_id=2), 0)
+
+        with self.assertRaises(TypeError):
+            HBaseFriendshipCount.increase_counter('user_id', user_id=1)
+
+
+class HBaseUnitOfWorkTests(TestCase):
+
+    def test_unit_of_work(self):
+        with HBaseUnitOfWork() as unit_of_work:
+            HBaseFollower.create(unit_of_work=unit_of_work, from_user_id=1, to_user_id=2, created_at=100)
+            HBaseFollowing.create(unit_of_work=unit_of_work, from_user_id=1, to_user_id=2, created_at=100)
+            # nothing is sent before the block exits
+            self.assertEqual(HBaseFollowing.get(from_user_id=1, created_at=100), None)
+        self.assertEqual(HBaseFollower.get(to_user_id=2, created_at=100).from_user_id, 1)
+        self.assertEqual(HBaseFollowing.get(from_user_id=1, created_at=100).to_user_id, 2)
+        self.assertEqual(unit_of_work.stats[HBaseFollower.get_table_name()]['mutations'], 1)
+        # the following row and its index row
+        self.assertEqual(len(unit_of_work.stats), 3)
+
+        # nothing is sent if the block raises
+        try:
+            with HBaseUnitOfWork() as unit_of_work:
+                HBaseFollowing.delete(unit_of_work=unit_of_work, from_user_id=1, created_at=100)
+                raise ValueError()
+        except ValueError:
+            pass
+        self.assertNotEqual(HBaseFollowing.get(from_user_id=1, created_at=100), None)
+
+        with HBaseUnitOfWork() as unit_of_work:
+            HBaseFollowing.delete(unit_of_work=unit_of_work, from_user_id=1, created_at=100)
+            HBaseFollower.delete(unit_of_work=unit_of_work, to_user_id=2, created_at=100)
+        self.assertEqual(HBaseFollowing.get(from_user_id=1, created_at=100), None)
+        self.assertEqual(HBaseFollower.get(to_user_id=2, created_at=100), None)
+
+    def test_flush_on_batch_size(self):
+        with HBaseUnitOfWork(batch_size=2) as unit_of_work:
+            for created_at in range(5):
+                HBaseNewsFeed.create(unit_of_work=unit_of_work, user_id=1, tweet_id=1, created_at=created_at)
+            self.assertEqual(len(HBaseNewsFeed.filter(prefix=(1, None))), 4)
+        self.assertEqual(len(HBaseNewsFeed.filter(prefix=(1, None))), 5)
+        self.assertEqual(unit_of_work.stats[HBaseNewsFeed.get_table_name()]['flushes'], 3)
+
+
+class HBaseSaltingTests(TestCase):
+
+    def test_row_key_salt(self):
+        salt = RowKeySalt(4, 'created_at', TimestampField())
+        self.assertEqual(salt.get_salt({'created_at': 100}), salt.get_salt({'created_at': 100}))
+        self.assertEqual(len(salt.get_salts(None)), 4)
+        self.assertEqual(salt.get_salts({'created_at': 100}), [salt.get_salt({'created_at': 100})])
+        with self.assertRaises(BadRowKeyError):
+            RowKeySalt(1, 'created_at', TimestampField())
+
+
+        # not an HBaseModel subclass, TestCase.setUp would create its table
+        class BadSaltedModel:
+            user_id = IntegerField()
+
+            class Meta:
+                table_name = 'bad_salted'
+                row_key = ('user_id',)
+                salt_buckets = 4
+                salt_field = 'user_id'
+
+        with self.assertRaises(BadRowKeyError):
+            HBaseSchema(BadSaltedModel)
+
+    def test_salted_scan(self):
+        for created_at in range(100, 120):
+            HBaseSaltedNewsFeed.create(user_id=1, created_at=created_at, tweet_id=created_at)
+        HBaseSaltedNewsFeed.create(user_id=2, created_at=105, tweet_id=0)
+
+        row_key = HBaseSaltedNewsFeed.serialize_row_key({'user_id': 1, 'created_at': 100})
+        self.assertEqual(row_key[1:], b'1000000000000000:100')
+        salts = {
+            HBaseSaltedNewsFeed.serialize_row_key({'user_id': 1, 'created_at': created_at})[0]
+            for created_at in range(100, 120)
+        }
+        self.assertTrue(len(salts) > 1)
+
+        newsfeed = HBaseSaltedNewsFeed.get(user_id=1, created_at=110)
+        self.assertEqual(newsfeed.tweet_id, 110)
+
+        # rows come back in row key order across all buckets, page by page
+        newsfeeds = list(HBaseSaltedNewsFeed.iter_filter(prefix=(1, None), batch_size=3))
+        self.assertEqual([n.created_at for n in newsfeeds], list(range(100, 120)))
+        newsfeeds = HBaseSaltedNewsFeed.filter(prefix=(1, None), reverse=True, limit=5)
+        self.assertEqual([n.created_at for n in newsfeeds], list(range(119, 114, -1)))
+        newsfeeds = list(HBaseSaltedNewsFeed.iter_filter(start=(1, 105), stop=(1, 110), batch_size=2))
+        self.assertEqual([n.created_at for n in newsfeeds], list(range(105, 110)))
+        newsfeeds = HBaseSaltedNewsFeed.filter(start=(1, 115), stop=(1, 110), reverse=True)
+        self.assertEqual([n.created_at for n in newsfeeds], list(range(115, 110, -1)))
+        newsfeeds = HBaseSaltedNewsFeed.filter(prefix=(1, 105), keys_only=True)
+        self.assertEqual([(n.user_id, n.created_at) for n in newsfeeds], [(1, 105)])
+        self.assertEqual(len(HBaseSaltedNewsFeed.filter(prefix=(2, None))), 1)
+
+        HBaseSaltedNewsFeed.delete(user_id=1, created_at=110)
+        self.assertEqual(HBaseSaltedNewsFeed.get(user_id=1, created_at=110), None)
+
+
+class HBaseQueryTests(TestCase):
+
+    def test_query(self):
+        for to_user_id in range(5):
+            HBaseFollowing.create(from_user_id=1, to_user_id=to_user_id, created_at=100 + to_user_id)
+        HBaseFollowing.create(from_user_id=2, to_user_id=10, created_at=100)
+
+        query = HBaseFollowing.scan().prefix(1)
+        is_descending = HBaseFollowing.get_field_hash()['created_at'].descending
+        # chained calls return new queries, nothing is read until then
+        self.assertIsNot(query.newest_first(), query)
+        # a reversed scan on the ascending layout only
+        self.assertEqual(query.newest_first().get_reverse(), not is_descending)
+        self.assertEqual([f.to_user_id for f in query.newest_first()], [4, 3, 2, 1, 0])
+        # without newest_first rows come in row key order
+        self.assertEqual([f.to_user_id for f in query], in_row_key_order(HBaseFollowing, [4, 3, 2, 1, 0]))
+        self.assertEqual(
+            [f.created_at for f in query.after(101).before(104)],
+            in_row_key_order(HBaseFollowing, [103, 102]),
+        )
+        self.assertEqual(
+            [f.created_at for f in query.before(103).newest_first().limit(2)],
+            [102, 101],
+        )
+        self.assertEqual([f.created_at for f in query.after(104)], [])
+
+        self.assertEqual(query.newest_first().first().to_user_id, 4)
+        self.assertEqual(query.after(104).first(), None)
+        self.assertTrue(query.exists())
+        self.assertFalse(HBaseFollowing.scan().prefix(3).exists())
+        self.assertEqual(query.count(), 5)
+        self.assertEqual(HBaseFollowing.scan().count(), 6)
+        self.assertEqual(query.newest_first().limit(3).ids('to_user_id'), [4, 3, 2])
+        self.assertEqual(
+            query.limit(2).ids('created_at'),
+            in_row_key_order(HBaseFollowing, [104, 103, 102, 101, 100])[:2],
+        )
+        followings = list(query.only('to_user_id'))
+        self.assertEqual(followings[0].to_user_id, 4 if is_descending else 0)
+        self.assertEqual(
+            [[f.to_user_id for f in chunk] for chunk in query.newest_first().chunks(2)],
+            [[4, 3], [2, 1], [0]],
+        )
+        with self.assertRaises(ValueError):
+            query.limit(0)
+
+    def test_ascending_and_salted_query(self):
+        for created_at in range(100, 110):
+            HBaseSaltedNewsFeed.create(user_id=1, created_at=created_at, tweet_id=created_at)
+        HBaseSaltedNewsFeed.create(user_id=2, created_at=105, tweet_id=0)
+
+        # created_at is ascending here, newest_first is a reversed scan
+        query = HBaseSaltedNewsFeed.scan().prefix(1)
+        self.assertEqual(query.newest_first().get_reverse(), True)
+        self.assertEqual([n.created_at for n in query.newest_first().limit(3)], [109, 108, 107])
+        self.assertEqual(
+            [n.created_at for n in query.before(105).after(101).newest_first()],
+            [104, 103, 102],
+        )
+        self.assertEqual([n.created_at for n in query.after(107)], [108, 109])
+        self.assertEqual(query.newest_first().first().tweet_id, 109)
+        self.assertEqual(query.count(), 10)
+        self.assertEqual(HBaseSaltedNewsFeed.scan().prefix(2).ids('tweet_id'), [0])
+
+
+class HBaseCircuitBreakerTests(TestCase):
+
+    def test_circuit_breaker(self):
+        now = [0]
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10, clock=lambda: now[0])
+        breaker.before_call()
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        with self.assertRaises(CircuitOpenError):
+            breaker.before_call()
+
+        # a single probe once reset_timeout has passed, its failure opens it again
+        now[0] = 10
+        self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+        breaker.before_call()
+        with self.assertRaises(CircuitOpenError):
+            breaker.before_call()
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        now[0] = 20
+        breaker.before_call()
+        breaker.record_success()
+        self.assertEqual(breaker.stats(), {
+            'state': CircuitBreaker.CLOSED,
+            'consecutive_failures': 0,
+            'failures': 3,
+            'trips': 2,
+            'rejected_calls': 2,
+        })
+
+    def test_execute_retries_and_fails_fast(self):
+        original_breaker = HBaseClient.breaker
+        HBaseClient.breaker = CircuitBreaker(failure_threshold=3)
+        calls = []
+
+        def flaky_read(conn):
+            calls.append(conn)
+            if len(calls) < 3:
+                raise TTransportException(message='timed out')
+            return 'row'
+
+        try:
+            with self.settings(HBASE_READ_RETRIES=2, HBASE_RETRY_BACKOFF=0):
+                self.assertEqual(HBaseClient.execute(flaky_read, idempotent=True), 'row')
+                self.assertEqual(len(calls), 3)
+                self.assertEqual(HBaseClient.breaker.stats()['consecutive_failures'], 0)
+
+                # writes are not retried
+                calls.clear()
+                with self.assertRaises(HBaseUnavailable):
+                    HBaseClient.execute(flaky_read)
+                self.assertEqual(len(calls), 1)
+
+                # a scan is retried until its first row only
+                attempts = []
+
+                def flaky_scan(conn):
+                    attempts.append(conn)
+                    if len(attempts) == 1:
+                        raise TTransportException(message='timed out')
+                    yield 'row'
+                    raise TTransportException(message='timed out')
+
+                rows = HBaseClient.execute_scan(flaky_scan)
+                self.assertEqual(next(rows), 'row')
+                with self.assertRaises(HBaseUnavailable):
+                    next(rows)
+                self.assertEqual(len(attempts), 2)
+
+                # 3 consecutive failures, the circuit is open and hbase is not called
+                self.assertFalse(HBaseClient.is_available())
+                calls.clear()
+                with self.assertRaises(CircuitOpenError):
+                    HBaseFollowing.get(from_user_id=1, created_at=1)
+                self.assertEqual(HBaseClient.breaker.stats()['trips'], 1)
+        finally:
+            HBaseClient.breaker = original_breaker
+
+
+class HBaseEmulatorTests(TestCase):
+
+    def setUp(self):
+        super(HBaseEmulatorTests, self).setUp()
+        self.conn = Connection(emulator=HBaseEmulator())
+        self.conn.create_table('emulated', {'cf': dict(), 'ttl': {'time_to_live': 1}})
+        self.table = self.conn.table('emulated')
+
+    def test_scan(self):
+        for row_key in [b'a1', b'a2', b'a3', b'b1']:
+            self.table.put(row_key, {b'cf:value': row_key[1:]})
+        self.assertEqual([key for key, _ in self.table.scan(row_prefix=b'a')], [b'a1', b'a2', b'a3'])
+        self.assertEqual([key for key, _ in self.table.scan(b'a2', b'b1')], [b'a2', b'a3'])
+        # reversed scans start from row_start (included) down to row_stop (excluded)
+        self.assertEqual([key for key, _ in self.table.scan(b'a3', b'a1', reverse=True)], [b'a3', b'a2'])
+        self.assertEqual([key for key, _ in self.table.scan(reverse=True, limit=2)], [b'b1', b'a3'])
+        self.assertEqual(
+            [key for key, _ in self.table.scan(filter="SingleColumnValueFilter('cf', 'value', >=, 'binary:2', true, true)")],
+            [b'a2', b'a3'],
+        )
+        rows = list(self.table.scan(row_prefix=b'a', filter='KeyOnlyFilter() AND FirstKeyOnlyFilter()'))
+        self.assertEqual(rows[0], (b'a1', {b'cf:value': b''}))
+        with self.assertRaises(FilterSyntaxError):
+            list(self.table.scan(filter='ValueFilter(=, \'binary:1\')'))
+
+        self.table.delete(b'a2')
+        self.assertEqual(self.table.row(b'a2'), {})
+        self.assertEqual([key for key, _ in self.table.rows([b'a1', b'a2'])], [b'a1'])
+
+    def test_counters_ttl_and_closed_transport(self):
+        self.assertEqual(self.table.counter_inc(b'row', b'cf:count', 3), 3)
+        self.assertEqual(self.table.counter_dec(b'row', b'cf:count'), 2)
+        with self.assertRaises(HBaseIOError):
+            self.table.put(b'row', {b'unknown:value': b'1'})
+
+        # the ttl family expires its cells after 1 second
+        self.table.put(b'row', {b'ttl:value': b'1'}, timestamp=int(time.time() * 1000) - 2000)
+        self.assertEqual(self.table.row(b'row', columns=[b'ttl']), {})
+
+        self.conn.close()
+        with self.assertRaises(TTransportException):
+            self.table.row(b'row')
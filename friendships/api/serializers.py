@@ -5,6 +5,8 @@ from friendships.models import Friendship
 from friendships.services import FriendshipService
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
+from utils.memcached_helper import MemcachedHelper
+from utils.serializers import PrefetchListSerializer
 
 
 class BaseFriendshipSerializer(serializers.Serializer):
@@ -12,6 +14,9 @@ class BaseFriendshipSerializer(serializers.Serializer):
     created_at = serializers.SerializerMethodField()
     has_followed = serializers.SerializerMethodField()
 
+    class Meta:
+        list_serializer_class = PrefetchListSerializer
+
     def update(self, instance, validated_data):
         pass
 
@@ -35,8 +40,18 @@ class BaseFriendshipSerializer(serializers.Serializer):
     def get_has_followed(self, obj):
         return self.get_user_id(obj) in self._get_following_user_id_set()
 
+    def prefetch(self, friendships):
+        self._prefetched_users = MemcachedHelper.get_objects_through_cache(
+            User,
+            [self.get_user_id(obj) for obj in friendships],
+        )
+        UserSerializerForFriendship().prefetch(list(self._prefetched_users.values()))
+
     def get_user(self, obj):
-        user = UserService.get_user_by_id(self.get_user_id(obj))
+        user_id = self.get_user_id(obj)
+        user = getattr(self, '_prefetched_users', {}).get(user_id)
+        if user is None:
+            user = UserService.get_user_by_id(user_id)
         return UserSerializerForFriendship(user).data
 
     def get_created_at(self, obj):
@@ -5,6 +5,7 @@ from friendships.api.serializers import (
 )
 from django.contrib.auth.models import User
 from django.utils.decorators import method_decorator
+from django_hbase.circuit_breaker import HBaseUnavailable
 from friendships.models import HBaseFollowing, HBaseFollower, Friendship
 from friendships.services import FriendshipService
 from gatekeeper.models import GateKeeper
@@ -28,12 +29,21 @@ class FriendshipViewSet(viewsets.GenericViewSet):
     # generally, different views needs different pagination rules, so we need to define our own pagination rules
     pagination_class = EndlessPagination
 
+    def paginate_hbase_or_none(self, hb_model, pk, request):
+        # None means the mysql friendships should be used, either because the
+        # switch is off or because hbase timed out / its circuit is open
+        if not GateKeeper.is_switched_on('switch_friendship_to_hbase'):
+            return None
+        try:
+            return self.paginator.paginate_hbase(hb_model, (pk,), request)
+        except HBaseUnavailable:
+            return None
+
     @action(methods=['GET'], detail=True, permission_classes=[AllowAny])
     @method_decorator(ratelimit(key='user_or_ip', rate='3/s', method='GET', block=True))
     def followers(self, request, pk):
-        if GateKeeper.is_switched_on('switch_friendship_to_hbase'):
-            page = self.paginator.paginate_hbase(HBaseFollower, (pk,), request)
-        else:
+        page = self.paginate_hbase_or_none(HBaseFollower, pk, request)
+        if page is None:
             friendships = Friendship.objects.filter(to_user_id=pk).order_by('-created_at')
             page = self.paginate_queryset(friendships)
         serializer = FollowerSerializer(page, many=True, context={'request': request})
@@ -42,9 +52,8 @@ class FriendshipViewSet(viewsets.GenericViewSet):
     @action(methods=['GET'], detail=True, permission_classes=[AllowAny])
     @method_decorator(ratelimit(key='user_or_ip', rate='3/s', method='GET', block=True))
     def followings(self, request, pk):
-        if GateKeeper.is_switched_on('switch_friendship_to_hbase'):
-            page = self.paginator.paginate_hbase(HBaseFollowing, (pk,), request)
-        else:
+        page = self.paginate_hbase_or_none(HBaseFollowing, pk, request)
+        if page is None:
             friendships = Friendship.objects.filter(from_user_id=pk).order_by('-created_at')
             page = self.paginate_queryset(friendships)
         serializer = FollowingSerializer(page, many=True, context={'request': request})
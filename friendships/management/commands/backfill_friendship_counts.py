@@ -0,0 +1,52 @@
+from django.core.management.base import BaseCommand
+from friendships.models import HBaseFollower, HBaseFollowing, HBaseFriendshipCount
+
+
+class Command(BaseCommand):
+    help = (
+        'Rebuild twitter_friendship_counts from twitter_followings and twitter_followers. '
+        'Run it once before relying on the counters, follows happening during the '
+        'backfill may be off by one until the next run. The counters of the users '
+        'that no longer follow anyone or have no follower are reset to 0.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def count_by_user(self, model_class, user_key, batch_size):
+        # rows of the same user are next to each other because user_key is
+        # the first part of the row key, so the counts can be streamed
+        user_id, count = None, 0
+        for instance in model_class.iter_filter(keys_only=True, batch_size=batch_size):
+            current_user_id = getattr(instance, user_key)
+            if current_user_id != user_id:
+                if user_id is not None:
+                    yield user_id, count
+                user_id, count = current_user_id, 0
+            count += 1
+        if user_id is not None:
+            yield user_id, count
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        for model_class, user_key, counter_key in [
+            (HBaseFollowing, 'from_user_id', 'followings_count'),
+            (HBaseFollower, 'to_user_id', 'followers_count'),
+        ]:
+            seen_user_ids = set()
+            for user_id, count in self.count_by_user(model_class, user_key, batch_size):
+                HBaseFriendshipCount.set_counter(counter_key, count, user_id=user_id)
+                seen_user_ids.add(user_id)
+            reset = self.reset_unseen_counters(counter_key, seen_user_ids, batch_size)
+            self.stdout.write(f'{counter_key} backfilled for {len(seen_user_ids)} users, {reset} reset to 0')
+
+    def reset_unseen_counters(self, counter_key, seen_user_ids, batch_size):
+        # only the rows that have the counter column are returned, a missing
+        # counter already reads as 0
+        reset = 0
+        for instance in HBaseFriendshipCount.iter_filter(columns=[counter_key], batch_size=batch_size):
+            if instance.user_id in seen_user_ids or not getattr(instance, counter_key):
+                continue
+            HBaseFriendshipCount.set_counter(counter_key, 0, user_id=instance.user_id)
+            reset += 1
+        return reset
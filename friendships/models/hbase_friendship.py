@@ -1,39 +1,73 @@
+from django.conf import settings
 from django_hbase import models
 
 
 class HBaseFollowing(models.HBaseModel):
     """
-    存储 from_user_id follow 了哪些人，row_key 按照 from_user_id + created_at 排序
+    存储 from_user_id follow 了哪些人，row_key 按照 from_user_id + created_at 倒序排序
     可以支持查询：
      - A 关注的所有人按照关注时间排序
      - A 在某个时间段内关注的人有哪些
      - A 在某个时间点之后/之前关注的前 X 个人是谁
+    通过 (from_user_id, to_user_id) 二级索引还可以 O(1) 查询：
+     - A 有没有关注 B，在什么时间关注的
     """
+    __slots__ = ()
+
     # row key
     from_user_id = models.IntegerField(reverse=True)
-    created_at = models.TimestampField()
+    # 旧表迁移完成之前 (HBASE_NEWEST_FIRST_TIMELINES) 继续读写正序存储的旧表
+    created_at = models.TimestampField(descending=settings.HBASE_NEWEST_FIRST_TIMELINES)
     # column key
     to_user_id = models.IntegerField(column_family='cf')
 
     class Meta:
-        table_name = 'twitter_followings'
+        table_name = 'twitter_followings_v2' if settings.HBASE_NEWEST_FIRST_TIMELINES else 'twitter_followings'
         row_key = ('from_user_id', 'created_at')
+        column_family_options = {'cf': {'max_versions': 1, 'bloom_filter_type': 'ROW'}}
+        pre_split_regions = 10
+        indexes = (
+            models.HBaseIndex(('from_user_id', 'to_user_id')),
+        )
 
 
 class HBaseFollower(models.HBaseModel):
     """
-    存储 to_user_id 被哪些人 follow 了，row_key 按照 to_user_id + created_at 排序
+    存储 to_user_id 被哪些人 follow 了，row_key 按照 to_user_id + created_at 倒序排序
     可以支持查询：
      - A 的所有粉丝按照关注时间排序
      - A 在某个时间段内被哪些粉丝关注了
      - 哪 X 人在某个时间点之后/之前关注了 A
     """
+    __slots__ = ()
+
     # row key
     to_user_id = models.IntegerField(reverse=True)
-    created_at = models.TimestampField()
+    created_at = models.TimestampField(descending=settings.HBASE_NEWEST_FIRST_TIMELINES)
     # column key
     from_user_id = models.IntegerField(column_family='cf')
 
     class Meta:
         row_key = ('to_user_id', 'created_at')
-        table_name = 'twitter_followers'
\ No newline at end of file
+        table_name = 'twitter_followers_v2' if settings.HBASE_NEWEST_FIRST_TIMELINES else 'twitter_followers'
+        column_family_options = {'cf': {'max_versions': 1, 'bloom_filter_type': 'ROW'}}
+        pre_split_regions = 10
+
+
+class HBaseFriendshipCount(models.HBaseModel):
+    """
+    存储每个用户关注了多少人以及有多少粉丝，由 FriendshipService.follow/unfollow
+    通过 hbase 的原子自增维护，查询数量只需要读一个 cell
+    """
+    __slots__ = ()
+
+    # row key
+    user_id = models.IntegerField(reverse=True)
+    # column key
+    followings_count = models.CounterField(column_family='cf')
+    followers_count = models.CounterField(column_family='cf')
+
+    class Meta:
+        table_name = 'twitter_friendship_counts'
+        row_key = ('user_id',)
+        column_family_options = {'cf': {'max_versions': 1, 'bloom_filter_type': 'ROW'}}
@@ -1,7 +1,9 @@
 from django.conf import settings
 from django.core.cache import caches
-from friendships.models import HBaseFollowing, HBaseFollower, Friendship
+from django_hbase.models import HBaseUnitOfWork
+from friendships.models import HBaseFollowing, HBaseFollower, HBaseFriendshipCount, Friendship
 from gatekeeper.models import GateKeeper
+from itertools import islice
 from twitter.cache import FOLLOWINGS_PATTERN
 
 import time
@@ -43,19 +45,34 @@ class FriendshipService(object):
 
     @classmethod
     def get_follower_ids(cls, to_user_id):
-        if not GateKeeper.is_switched_on('switch_friendship_to_hbase'):
-            friendships = Friendship.objects.filter(to_user_id=to_user_id)
-        else:
-            friendships = HBaseFollower.filter(prefix=(to_user_id, None))
+        if GateKeeper.is_switched_on('switch_friendship_to_hbase'):
+            return HBaseFollower.scan().prefix(to_user_id).ids('from_user_id')
+        friendships = Friendship.objects.filter(to_user_id=to_user_id)
         return [friendship.from_user_id for friendship in friendships]
 
+    @classmethod
+    def get_follower_id_chunks(cls, to_user_id, chunk_size):
+        # stream follower ids chunk by chunk, so fanning out to a user with
+        # millions of followers never holds all of them in memory
+        if not GateKeeper.is_switched_on('switch_friendship_to_hbase'):
+            follower_ids = Friendship.objects.filter(
+                to_user_id=to_user_id,
+            ).values_list('from_user_id', flat=True).iterator(chunk_size=chunk_size)
+            while True:
+                chunk = list(islice(follower_ids, chunk_size))
+                if not chunk:
+                    return
+                yield chunk
+        for followers in HBaseFollower.chunks(chunk_size, prefix=(to_user_id, None)):
+            yield [follower.from_user_id for follower in followers]
+
     @classmethod
     def get_following_user_id_set(cls, from_user_id):
         # <TODO> cache in redis set
-        if not GateKeeper.is_switched_on('switch_friendship_to_hbase'):
-            friendships = Friendship.objects.filter(from_user_id=from_user_id)
-        else:
-            friendships = HBaseFollowing.filter(prefix=(from_user_id, None))
+        if GateKeeper.is_switched_on('switch_friendship_to_hbase'):
+            # only the to_user_id column is fetched
+            return set(HBaseFollowing.scan().prefix(from_user_id).ids('to_user_id'))
+        friendships = Friendship.objects.filter(from_user_id=from_user_id)
         # we use a set to hold a data because it is fast to check whether an elements exists there
         user_id_set = set([
             fs.to_user_id
@@ -70,11 +87,12 @@ class FriendshipService(object):
 
     @classmethod
     def get_follow_instance(cls, from_user_id, to_user_id):
-        followings = HBaseFollowing.filter(prefix=(from_user_id, None))
-        for follow in followings:
-            if follow.to_user_id == to_user_id:
-                return follow
-        return None
+        # point lookup through the (from_user_id, to_user_id) index
+        return HBaseFollowing.get_by_index(
+            'from_user_id_to_user_id',
+            from_user_id=from_user_id,
+            to_user_id=to_user_id,
+        )
 
     @classmethod
     def has_followed(cls, from_user_id, to_user_id):
@@ -102,20 +120,33 @@ class FriendshipService(object):
                 to_user_id=to_user_id,
             )
 
+        # the counters are only increased for a new edge, following twice
+        # returns the existing one
+        instance = cls.get_follow_instance(from_user_id, to_user_id)
+        if instance is not None:
+            return instance
+
         # create data in hbase
         # first we retrieve the current time and store it in a local variable
         # in case there are inconsistencies between the two records that we created in those two tables
         now = int(time.time() * 1000000)
-        HBaseFollower.create(
-            from_user_id=from_user_id,
-            to_user_id=to_user_id,
-            created_at=now,
-        )
-        return HBaseFollowing.create(
-            from_user_id=from_user_id,
-            to_user_id=to_user_id,
-            created_at=now,
-        )
+        # both rows (and the following index row) are sent as one batch per table
+        with HBaseUnitOfWork() as unit_of_work:
+            HBaseFollower.create(
+                unit_of_work=unit_of_work,
+                from_user_id=from_user_id,
+                to_user_id=to_user_id,
+                created_at=now,
+            )
+            following = HBaseFollowing.create(
+                unit_of_work=unit_of_work,
+                from_user_id=from_user_id,
+                to_user_id=to_user_id,
+                created_at=now,
+            )
+        HBaseFriendshipCount.increase_counter('followings_count', user_id=from_user_id)
+        HBaseFriendshipCount.increase_counter('followers_count', user_id=to_user_id)
+        return following
 
     @classmethod
     def unfollow(cls, from_user_id, to_user_id):
@@ -140,17 +171,43 @@ class FriendshipService(object):
         if instance is None:
             return 0
 
-        HBaseFollowing.delete(from_user_id=from_user_id, created_at=instance.created_at)
-        HBaseFollower.delete(to_user_id=to_user_id, created_at=instance.created_at)
+        # to_user_id is passed so the index row is deleted without reading the row again
+        with HBaseUnitOfWork() as unit_of_work:
+            HBaseFollowing.delete(
+                unit_of_work=unit_of_work,
+                from_user_id=from_user_id,
+                created_at=instance.created_at,
+                to_user_id=to_user_id,
+            )
+            HBaseFollower.delete(
+                unit_of_work=unit_of_work,
+                to_user_id=to_user_id,
+                created_at=instance.created_at,
+            )
+        HBaseFriendshipCount.increase_counter('followings_count', -1, user_id=from_user_id)
+        HBaseFriendshipCount.increase_counter('followers_count', -1, user_id=to_user_id)
         return 1
 
+    # the hbase counters are increased with one atomic increment per user
+    # after the edge rows are written, they are not part of the same batch
+    # (hbase has no transaction across rows). they are best effort counts to
+    # display: a process that dies between the batch and the increments, or
+    # two concurrent follow / unfollow of the same edge that both pass the
+    # get_follow_instance check, leave a count off by one. the edges are the
+    # source of truth, has_followed and the follower scans read them
     @classmethod
     def get_following_count(cls, from_user_id):
         if not GateKeeper.is_switched_on('switch_friendship_to_hbase'):
             return Friendship.objects.filter(from_user_id=from_user_id).count()
 
-        followings = HBaseFollowing.filter(prefix=(from_user_id, None))
-        return len(followings)
+        return HBaseFriendshipCount.get_counter('followings_count', user_id=from_user_id)
+
+    @classmethod
+    def get_follower_count(cls, to_user_id):
+        if not GateKeeper.is_switched_on('switch_friendship_to_hbase'):
+            return Friendship.objects.filter(to_user_id=to_user_id).count()
+
+        return HBaseFriendshipCount.get_counter('followers_count', user_id=to_user_id)
 
 
 
@@ -1,6 +1,8 @@
+from django.core.management import call_command
 from django_hbase.models import BadRowKeyError, EmptyColumnError
-from friendships.models import HBaseFollowing, HBaseFollower
+from friendships.models import HBaseFollowing, HBaseFollower, HBaseFriendshipCount
 from friendships.services import FriendshipService
+from io import StringIO
 from testing.testcases import TestCase
 
 import time
@@ -24,6 +26,45 @@ class FriendshipServiceTests(TestCase):
         user_id_set = FriendshipService.get_following_user_id_set(self.bob.id)
         self.assertEqual(user_id_set, {user1.id, user2.id})
 
+    def test_friendship_counts(self):
+        user1 = self.create_user('user1')
+        self.assertEqual(FriendshipService.get_following_count(self.bob.id), 0)
+        for to_user in [user1, self.alex]:
+            self.create_friendship(from_user=self.bob, to_user=to_user)
+        self.create_friendship(from_user=user1, to_user=self.alex)
+        # following twice does not add an edge nor change the counts
+        following = FriendshipService.follow(self.bob.id, self.alex.id)
+        self.assertEqual(following.to_user_id, self.alex.id)
+        self.assertEqual(len(FriendshipService.get_follower_ids(self.alex.id)), 2)
+        self.assertEqual(FriendshipService.get_following_count(self.bob.id), 2)
+        self.assertEqual(FriendshipService.get_follower_count(self.alex.id), 2)
+
+        FriendshipService.unfollow(self.bob.id, self.alex.id)
+        # unfollow twice does not change the counts again
+        FriendshipService.unfollow(self.bob.id, self.alex.id)
+        self.assertEqual(FriendshipService.get_following_count(self.bob.id), 1)
+        self.assertEqual(FriendshipService.get_follower_count(self.alex.id), 1)
+        self.assertEqual(FriendshipService.get_follower_count(user1.id), 1)
+
+    def test_backfill_friendship_counts(self):
+        user1 = self.create_user('user1')
+        self.create_friendship(from_user=self.bob, to_user=user1)
+        self.create_friendship(from_user=self.bob, to_user=self.alex)
+        # stale counters, alex follows nobody and bob has no follower
+        HBaseFriendshipCount.set_counter('followings_count', 5, user_id=self.alex.id)
+        HBaseFriendshipCount.set_counter('followers_count', 3, user_id=self.bob.id)
+        HBaseFriendshipCount.set_counter('followers_count', 7, user_id=user1.id)
+
+        out = StringIO()
+        call_command('backfill_friendship_counts', stdout=out)
+        self.assertEqual(FriendshipService.get_following_count(self.bob.id), 2)
+        self.assertEqual(FriendshipService.get_following_count(self.alex.id), 0)
+        self.assertEqual(FriendshipService.get_follower_count(self.bob.id), 0)
+        self.assertEqual(FriendshipService.get_follower_count(user1.id), 1)
+        self.assertEqual(FriendshipService.get_follower_count(self.alex.id), 1)
+        self.assertIn('followings_count backfilled for 1 users, 1 reset to 0', out.getvalue())
+        self.assertIn('followers_count backfilled for 2 users, 1 reset to 0', out.getvalue())
+
 
 class HBaseTests(TestCase):
 
@@ -90,43 +131,33 @@ class HBaseTests(TestCase):
         HBaseFollowing.create(from_user_id=1, to_user_id=3, created_at=self.ts_now)
         HBaseFollowing.create(from_user_id=1, to_user_id=4, created_at=self.ts_now)
 
+        # the newest following comes first when created_at is stored in descending
+        # order (HBASE_NEWEST_FIRST_TIMELINES), the oldest one in the old layout
+        if HBaseFollowing.get_field_hash()['created_at'].descending:
+            to_user_ids = [4, 3, 2]
+        else:
+            to_user_ids = [2, 3, 4]
         followings = HBaseFollowing.filter(prefix=(1, None, None))
         self.assertEqual(3, len(followings))
-        self.assertEqual(followings[0].from_user_id, 1)
-        self.assertEqual(followings[0].to_user_id, 2)
-        self.assertEqual(followings[1].from_user_id, 1)
-        self.assertEqual(followings[1].to_user_id, 3)
-        self.assertEqual(followings[2].from_user_id, 1)
-        self.assertEqual(followings[2].to_user_id, 4)
+        self.assertEqual([f.from_user_id for f in followings], [1, 1, 1])
+        self.assertEqual([f.to_user_id for f in followings], to_user_ids)
 
         # test limit
         results = HBaseFollowing.filter(prefix=(1, None, None), limit=1)
-        self.assertEqual(1, len(results))
-        self.assertEqual(results[0].to_user_id, 2)
+        self.assertEqual([r.to_user_id for r in results], to_user_ids[:1])
 
         results = HBaseFollowing.filter(prefix=(1, None, None), limit=2)
-        self.assertEqual(2, len(results))
-        self.assertEqual(results[0].to_user_id, 2)
-        self.assertEqual(results[1].to_user_id, 3)
+        self.assertEqual([r.to_user_id for r in results], to_user_ids[:2])
 
         results = HBaseFollowing.filter(prefix=(1, None, None), limit=4)
-        self.assertEqual(3, len(results))
-        self.assertEqual(results[0].to_user_id, 2)
-        self.assertEqual(results[1].to_user_id, 3)
-        self.assertEqual(results[2].to_user_id, 4)
+        self.assertEqual([r.to_user_id for r in results], to_user_ids)
 
         results = HBaseFollowing.filter(start=(1, results[1].created_at, None), limit=2)
-        self.assertEqual(2, len(results))
-        self.assertEqual(results[0].to_user_id, 3)
-        self.assertEqual(results[1].to_user_id, 4)
+        self.assertEqual([r.to_user_id for r in results], to_user_ids[1:])
 
         # test reverse
         results = HBaseFollowing.filter(prefix=(1, None, None), limit=2, reverse=True)
-        self.assertEqual(2, len(results))
-        self.assertEqual(results[0].to_user_id, 4)
-        self.assertEqual(results[1].to_user_id, 3)
+        self.assertEqual([r.to_user_id for r in results], to_user_ids[:0:-1])
 
         results = HBaseFollowing.filter(start=(1, results[1].created_at, None), limit=2, reverse=True)
-        self.assertEqual(2, len(results))
-        self.assertEqual(results[0].to_user_id, 3)
-        self.assertEqual(results[1].to_user_id, 2)
\ No newline at end of file
+        self.assertEqual([r.to_user_id for r in results], to_user_ids[1::-1])
\ No newline at end of file
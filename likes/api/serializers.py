@@ -1,10 +1,13 @@
 from accounts.api.serializers import UserSerializerForLike
 from comments.models import Comment
+from django.contrib.auth.models import User
 from django.contrib.contenttypes.models import ContentType
 from likes.models import Like
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
 from tweets.models import Tweet
+from utils.memcached_helper import MemcachedHelper
+from utils.serializers import PrefetchListSerializer
 
 
 class LikeSerializer(serializers.ModelSerializer):
@@ -13,6 +16,12 @@ class LikeSerializer(serializers.ModelSerializer):
     class Meta:
         model = Like
         fields = ('user', 'created_at')
+        list_serializer_class = PrefetchListSerializer
+
+    def prefetch(self, likes):
+        MemcachedHelper.hydrate_objects(likes, User, 'user_id', 'hydrated_user')
+        users = [like.hydrated_user for like in likes if like.hydrated_user is not None]
+        self.fields['user'].prefetch(users)
 
 
 class BaseLikeSerializerForCreateAndCancel(serializers.ModelSerializer):
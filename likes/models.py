@@ -38,7 +38,7 @@ class Like(models.Model):
 
     @property
     def cached_user(self):
-        return MemcachedHelper.get_object_through_cache(User, self.user_id)
+        return MemcachedHelper.get_hydrated_object(self, 'hydrated_user', User, self.user_id)
 
 
 post_save.connect(incr_likes_count, sender=Like)
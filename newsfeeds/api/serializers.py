@@ -1,17 +1,34 @@
 from rest_framework import serializers
 from tweets.api.serializers import TweetSerializer
+from tweets.models import Tweet
+from utils.memcached_helper import MemcachedHelper
+from utils.serializers import PrefetchListSerializer
 
 
 class NewsFeedSerializer(serializers.Serializer):
     tweet = serializers.SerializerMethodField()
     created_at = serializers.SerializerMethodField()
 
+    class Meta:
+        list_serializer_class = PrefetchListSerializer
+
     def update(self, instance, validated_data):
         pass
 
     def create(self, validated_data):
         pass
 
+    def prefetch(self, newsfeeds):
+        # the tweets may be hydrated already, from the redis object cache
+        MemcachedHelper.hydrate_objects(
+            [newsfeed for newsfeed in newsfeeds if getattr(newsfeed, 'hydrated_tweet', None) is None],
+            Tweet,
+            'tweet_id',
+            'hydrated_tweet',
+        )
+        tweets = [newsfeed.cached_tweet for newsfeed in newsfeeds]
+        TweetSerializer(context=self.context).prefetch([tweet for tweet in tweets if tweet is not None])
+
     def get_tweet(self, obj):
         return TweetSerializer(obj.cached_tweet, context=self.context).data
 
@@ -1,4 +1,7 @@
 from django.conf import settings
+from django.test import override_settings
+from django_hbase.circuit_breaker import CircuitBreaker
+from django_hbase.client import HBaseClient
 from gatekeeper.models import GateKeeper
 from newsfeeds.models import NewsFeed, HBaseNewsFeed
 from newsfeeds.services import NewsFeedService
@@ -55,6 +58,24 @@ class NewsFeedApiTests(TestCase):
         self.assertEqual(len(response.data['results']), 2)
         self.assertEqual(response.data['results'][0]['tweet']['id'], posted_tweet_id)
 
+    def test_fallback_when_hbase_is_unavailable(self):
+        tweet = self.create_tweet(self.alex)
+        NewsFeed.objects.create(user=self.bob, tweet=tweet)
+        # the post_save listener cached the (empty) hbase newsfeeds
+        self.clear_cache()
+        original_breaker = HBaseClient.breaker
+        HBaseClient.breaker = CircuitBreaker(failure_threshold=1)
+        HBaseClient.breaker.record_failure()
+        try:
+            # the circuit is open, the mysql newsfeeds are served right away
+            response = self.bob_client.get(NEWSFEEDS_URL)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.data['results']), 1)
+            self.assertEqual(response.data['results'][0]['tweet']['id'], tweet.id)
+            self.assertEqual(HBaseClient.breaker.stats()['rejected_calls'], 1)
+        finally:
+            HBaseClient.breaker = original_breaker
+
     def test_pagination(self):
         page_size = EndlessPagination.page_size
         followed_user = self.create_user('followee')
@@ -109,6 +130,10 @@ class NewsFeedApiTests(TestCase):
         self.assertEqual(len(response.data['results']), 1)
         self.assertEqual(response.data['results'][0]['created_at'], new_newsfeed.created_at)
 
+    @override_settings(REDIS_SORTED_SET_TIMELINES=True)
+    def test_pagination_with_sorted_set_timelines(self):
+        self.test_pagination()
+
     def test_user_cache(self):
         profile = self.alex.profile
         profile.nickname = 'lex'
@@ -157,6 +182,24 @@ class NewsFeedApiTests(TestCase):
         results = response.data['results']
         self.assertEqual(results[0]['tweet']['content'], 'content2')
 
+    @override_settings(REDIS_NORMALIZED_TIMELINES=True)
+    def test_normalized_timelines(self):
+        page_size = EndlessPagination.page_size
+        tweets = [self.create_tweet(self.bob, 'tweet{}'.format(i)) for i in range(page_size + 1)]
+        newsfeeds = [self.create_newsfeed(self.alex, tweet) for tweet in tweets][::-1]
+
+        results = self._paginate_to_get_newsfeeds(self.alex_client)
+        self.assertEqual([r['created_at'] for r in results], [f.created_at for f in newsfeeds])
+        self.assertEqual(
+            [r['tweet']['content'] for r in results],
+            ['tweet{}'.format(i) for i in range(page_size, -1, -1)],
+        )
+
+        tweets[-1].content = 'edited'
+        tweets[-1].save()
+        response = self.alex_client.get(NEWSFEEDS_URL)
+        self.assertEqual(response.data['results'][0]['tweet']['content'], 'edited')
+
     def _paginate_to_get_newsfeeds(self, client):
         # paginate until the end
         response = client.get(NEWSFEEDS_URL)
@@ -211,8 +254,6 @@ class NewsFeedApiTests(TestCase):
         self.clear_cache()
         _test_newsfeeds_after_new_feed_pushed()
 
-
-
-
-
-
+    @override_settings(REDIS_SORTED_SET_TIMELINES=True)
+    def test_redis_sorted_set_limit(self):
+        self.test_redis_list_limit()
@@ -1,3 +1,6 @@
+from django.conf import settings
+from django_hbase.circuit_breaker import HBaseUnavailable
+from functools import partial
 from newsfeeds.api.serializers import NewsFeedSerializer
 from newsfeeds.models import NewsFeed, HBaseNewsFeed
 from gatekeeper.models import GateKeeper
@@ -17,16 +20,26 @@ class NewsFeedViewSet(viewsets.GenericViewSet):
 
     @method_decorator(ratelimit(key='user', rate='5/s', method='GET', block=True))
     def list(self, request):
-        cached_newsfeeds = NewsFeedService.get_cached_newsfeeds(request.user.id)
-        page = self.paginator.paginate_cached_list(cached_newsfeeds, request)
-        # page is None means the data we get from cache is not enough to satisfy the request
-        # so we instead retrieve directly from db
-        if page is None:
-            if GateKeeper.is_switched_on('switch_newsfeed_to_hbase'):
-                page = self.paginator.paginate_hbase(HBaseNewsFeed, (request.user.id,), request)
+        try:
+            if settings.REDIS_SORTED_SET_TIMELINES:
+                page = self.paginator.paginate_cached_sorted_set(
+                    partial(NewsFeedService.load_cached_newsfeeds, request.user.id),
+                    request,
+                )
             else:
-                queryset = NewsFeed.objects.filter(user=request.user)
-                page = self.paginate_queryset(queryset)
+                cached_newsfeeds = NewsFeedService.get_cached_newsfeeds(request.user.id)
+                page = self.paginator.paginate_cached_list(cached_newsfeeds, request)
+            # page is None means the data we get from cache is not enough to satisfy the request
+            # so we instead retrieve directly from db
+            if page is None and GateKeeper.is_switched_on('switch_newsfeed_to_hbase'):
+                page = self.paginator.paginate_hbase(HBaseNewsFeed, (request.user.id,), request)
+        except HBaseUnavailable:
+            # hbase 超时或者熔断中，降级到 mysql 里的 newsfeeds，而不是让请求一直等待
+            page = None
+        if page is None:
+            queryset = NewsFeed.objects.filter(user=request.user)
+            page = self.paginate_queryset(queryset)
+        page = NewsFeedService.hydrate_newsfeeds(page)
 
         serializer = NewsFeedSerializer(
             page,
@@ -0,0 +1,69 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django_hbase.client import HBaseClient, HBaseConnectionPool
+from django_hbase.emulator import Connection, HBaseEmulator
+from friendships.models import HBaseFollower
+from functools import partial
+from newsfeeds.constants import FANOUT_BATCH_SIZE
+from newsfeeds.models import HBaseNewsFeed
+import time
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure the HBase side of a newsfeed fanout (stream the followers, '
+        'batch create their newsfeeds) against the in-process emulator, '
+        'no HBase server needed and nothing is written to the real tables'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--followers', type=int, default=10000)
+        parser.add_argument('--batch-size', type=int, default=FANOUT_BATCH_SIZE)
+        parser.add_argument('--repeat', type=int, default=3)
+
+    def handle(self, *args, **options):
+        followers_count, batch_size = options['followers'], options['batch_size']
+        original_pool = HBaseClient.pool
+        HBaseClient.pool = HBaseConnectionPool(
+            size=settings.HBASE_POOL_SIZE,
+            connection_class=partial(Connection, emulator=HBaseEmulator()),
+        )
+        try:
+            with HBaseClient.connection() as conn:
+                for model_class in (HBaseFollower, HBaseNewsFeed):
+                    for table_name, (column_families, _) in model_class.get_table_specs().items():
+                        conn.create_table(table_name, column_families)
+
+            created_at = int(time.time() * 1000000)
+            HBaseFollower.batch_create([
+                {'to_user_id': 1, 'from_user_id': 2 + i, 'created_at': created_at + i}
+                for i in range(followers_count)
+            ])
+
+            best = None
+            for repeat in range(options['repeat']):
+                start = time.perf_counter()
+                count = self.fanout(1, created_at + repeat, repeat, batch_size)
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+        finally:
+            HBaseClient.pool.close()
+            HBaseClient.pool = original_pool
+
+        self.stdout.write('{} newsfeeds fanned out in batches of {}: best {:.3f}s, {:.0f} newsfeeds/s'.format(
+            count,
+            batch_size,
+            best,
+            count / best,
+        ))
+
+    def fanout(self, tweet_user_id, created_at, tweet_id, batch_size):
+        # same HBase calls as fanout_newsfeeds_main_task and fanout_newsfeeds_batch_task
+        count = 0
+        for followers in HBaseFollower.chunks(batch_size, prefix=(tweet_user_id, None)):
+            HBaseNewsFeed.batch_create([
+                {'user_id': follower.from_user_id, 'created_at': created_at, 'tweet_id': tweet_id}
+                for follower in followers
+            ], batch_size=batch_size)
+            count += len(followers)
+        return count
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+from newsfeeds.models import HBaseNewsFeed
+import time
+
+
+class Command(BaseCommand):
+    help = 'Measure the cost of decoding HBaseNewsFeed rows, no HBase server needed'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000)
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def handle(self, *args, **options):
+        rows_count, repeat = options['rows'], options['repeat']
+        # build the rows exactly like happybase returns them from a scan
+        created_at = int(time.time() * 1000000)
+        rows = []
+        for i in range(rows_count):
+            data = {'user_id': 1, 'created_at': created_at - i, 'tweet_id': 10 + i}
+            row_key = HBaseNewsFeed.serialize_row_key(data)
+            row_data = {
+                column_key: value.encode('utf-8')
+                for column_key, value in HBaseNewsFeed.serialize_row_data(data).items()
+            }
+            rows.append((row_key, row_data))
+
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for row_key, row_data in rows:
+                HBaseNewsFeed.init_from_row(row_key, row_data)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+
+        self.stdout.write('decoded {} rows x {} runs, best run {:.2f} ms, {:.3f} us/row'.format(
+            rows_count,
+            repeat,
+            best * 1000,
+            best * 1000000 / rows_count,
+        ))
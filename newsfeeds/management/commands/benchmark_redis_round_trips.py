@@ -0,0 +1,92 @@
+from contextlib import contextmanager
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from newsfeeds.models import HBaseNewsFeed
+from utils.redis_client import RedisClient
+from utils.redis_helper import EMPTY_CACHE_SENTINEL, INCR_IF_EXISTS_SCRIPT, PUSH_IF_EXISTS_SCRIPT, RedisHelper
+import time
+
+
+class CountedObject:
+    # stands for a tweet in RedisHelper.get_count_key
+
+    def __init__(self, id):
+        self.id = id
+
+
+class Command(BaseCommand):
+    help = (
+        'Count the redis round trips of the RedisHelper operations a newsfeed '
+        'request and a fanout go through. Keys are written under a benchmark: '
+        'prefix of the configured redis and deleted afterwards, the newsfeeds '
+        'are built in memory so no database is needed.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--newsfeeds', type=int, default=settings.REDIS_LIST_LENGTH_LIMIT)
+
+    def handle(self, *args, **options):
+        key = 'benchmark:newsfeeds:{}'.format(int(time.time() * 1000000))
+        created_at = int(time.time() * 1000000)
+        newsfeeds = [
+            HBaseNewsFeed(user_id=1, created_at=created_at + i, tweet_id=i)
+            for i in range(options['newsfeeds'])
+        ]
+
+        def lazy_load(limit):
+            return newsfeeds[:limit]
+
+        # the counter key is filled up front, so incr_count never reads the db
+        counted = CountedObject(key)
+        count_key = RedisHelper.get_count_key(counted, 'likes_count')
+        RedisClient.get_cache_connection(count_key).set(count_key, 0)
+
+        scenarios = (
+            ('load newsfeeds, cache miss', lambda: RedisHelper.load_objects(key, lazy_load)),
+            ('load newsfeeds, cache hit', lambda: RedisHelper.load_objects(key, lazy_load)),
+            ('push a newsfeed, cache hit', lambda: RedisHelper.push_object(key, newsfeeds[0], lazy_load)),
+            ('increase a count, cache hit', lambda: RedisHelper.incr_count(counted, 'likes_count')),
+        )
+        try:
+            # the first EVALSHA of a script may need a SCRIPT LOAD, not counted,
+            # both scripts are no-ops on a missing key
+            RedisHelper.run_script(
+                PUSH_IF_EXISTS_SCRIPT,
+                keys=[key, RedisHelper.get_lock_key(key)],
+                args=['', 1, EMPTY_CACHE_SENTINEL],
+            )
+            RedisHelper.run_script(INCR_IF_EXISTS_SCRIPT, keys=[key], args=[1])
+            for name, run in scenarios:
+                with self.count_round_trips() as counter:
+                    run()
+                self.stdout.write('{}: {} round trips'.format(name, counter['round_trips']))
+        finally:
+            RedisClient.get_sharded_connection().delete(key, count_key)
+
+    @contextmanager
+    def count_round_trips(self):
+        # a command, a pipeline or a transaction is sent with a single
+        # send_packed_command call on the connection, that is a round trip
+        counter = {'round_trips': 0}
+        connection_classes = {
+            conn.connection_pool.connection_class
+            for conn in RedisClient.get_sharded_connection().shards.values()
+        }
+        originals = {
+            connection_class: connection_class.send_packed_command
+            for connection_class in connection_classes
+        }
+
+        def counting(send_packed_command):
+            def counting_send_packed_command(connection, command, *args, **kwargs):
+                counter['round_trips'] += 1
+                return send_packed_command(connection, command, *args, **kwargs)
+            return counting_send_packed_command
+
+        for connection_class, send_packed_command in originals.items():
+            connection_class.send_packed_command = counting(send_packed_command)
+        try:
+            yield counter
+        finally:
+            for connection_class, send_packed_command in originals.items():
+                connection_class.send_packed_command = send_packed_command
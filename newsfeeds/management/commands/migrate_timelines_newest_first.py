@@ -0,0 +1,56 @@
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.module_loading import import_string
+
+
+# model, table written by the ascending created_at layout
+TIMELINE_TABLES = (
+    ('newsfeeds.models.HBaseNewsFeed', 'twitter_newsfeeds'),
+    ('friendships.models.HBaseFollower', 'twitter_followers'),
+    ('friendships.models.HBaseFollowing', 'twitter_followings'),
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Copy the newsfeeds, followers and followings tables from the old '
+        'ascending created_at layout into the newest first (descending=True) '
+        'tables of the models, then rebuild their secondary indexes.\n'
+        'The models only use the new tables with HBASE_NEWEST_FIRST_TIMELINES, '
+        'the web and celery processes keep serving the old tables while it runs:\n'
+        '  HBASE_NEWEST_FIRST_TIMELINES=1 manage.py migrate_timelines_newest_first\n'
+        'then turn HBASE_NEWEST_FIRST_TIMELINES on for every process and run it once '
+        'more, the copy is idempotent and picks up the rows written to the old '
+        'tables in the meantime. Rows deleted from the old tables in the meantime '
+        '(unfollows) are not deleted from the new ones.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--source-prefix', default='', help='e.g. test_ for the test tables')
+
+    def handle(self, *args, **options):
+        if not settings.HBASE_NEWEST_FIRST_TIMELINES:
+            raise CommandError('Run it with HBASE_NEWEST_FIRST_TIMELINES=1, the models write to the new tables then')
+        for model_path, source_table in TIMELINE_TABLES:
+            model_class = import_string(model_path)
+            self.stdout.write(f'migrating {model_class.__name__}')
+            call_command(
+                'hbase_rewrite_table',
+                model_path,
+                source_table=options['source_prefix'] + source_table,
+                target_table=model_class.get_table_name(),
+                from_codec='text',
+                to_codec='text',
+                from_ascending=True,
+                batch_size=options['batch_size'],
+                stdout=self.stdout,
+            )
+            if model_class._schema.indexes:
+                call_command(
+                    'hbase_build_index',
+                    model_path,
+                    batch_size=options['batch_size'],
+                    stdout=self.stdout,
+                )
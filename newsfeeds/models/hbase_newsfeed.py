@@ -1,25 +1,43 @@
+from django.conf import settings
 from django.contrib.auth.models import User
 from django_hbase import models
 from tweets.models import Tweet
 from utils.memcached_helper import MemcachedHelper
+from utils.time_constants import ONE_DAY
+
+
+NEWSFEED_TIME_TO_LIVE = 180 * ONE_DAY
 
 
 class HBaseNewsFeed(models.HBaseModel):
+    # the tweet set by NewsFeedService / hydrate_objects, see cached_tweet
+    __slots__ = ('hydrated_tweet',)
     # 注意这个 user 不是存储谁发了这条 tweet，而是谁可以看到这条 tweet
     user_id = models.IntegerField(reverse=True)
-    created_at = models.TimestampField()
+    # 倒序存储，最新的 newsfeed 排在最前面，读最新一页只需要正向 scan
+    # 旧表迁移完成之前 (HBASE_NEWEST_FIRST_TIMELINES) 继续读写正序存储的旧表
+    created_at = models.TimestampField(descending=settings.HBASE_NEWEST_FIRST_TIMELINES)
     tweet_id = models.IntegerField(column_family='cf')
 
     class Meta:
-        table_name = 'twitter_newsfeeds'
+        table_name = 'twitter_newsfeeds_v2' if settings.HBASE_NEWEST_FIRST_TIMELINES else 'twitter_newsfeeds'
         row_key = ('user_id', 'created_at')
+        # 太旧的 newsfeed 没有人会翻到，过期之后由 hbase 自动删除，表不会无限增长
+        column_family_options = {
+            'cf': {
+                'max_versions': 1,
+                'time_to_live': NEWSFEED_TIME_TO_LIVE,
+                'bloom_filter_type': 'ROW',
+            },
+        }
+        pre_split_regions = 10
 
     def __str__(self):
         return '{} inbox of {}: {}'.format(self.created_at, self.user_id, self.tweet_id)
 
     @property
     def cached_tweet(self):
-        return MemcachedHelper.get_object_through_cache(Tweet, self.tweet_id)
+        return MemcachedHelper.get_hydrated_object(self, 'hydrated_tweet', Tweet, self.tweet_id)
 
     @property
     def cached_user(self):
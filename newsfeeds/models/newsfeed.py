@@ -28,7 +28,7 @@ class NewsFeed(models.Model):
 
     @property
     def cached_tweet(self):
-        return MemcachedHelper.get_object_through_cache(Tweet, self.tweet_id)
+        return MemcachedHelper.get_hydrated_object(self, 'hydrated_tweet', Tweet, self.tweet_id)
 
 
 post_save.connect(push_newsfeeds_to_cache, sender=NewsFeed)
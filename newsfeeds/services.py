@@ -1,20 +1,39 @@
+from django.conf import settings
 from gatekeeper.models import GateKeeper
 from newsfeeds.models import NewsFeed, HBaseNewsFeed
 from newsfeeds.models import NewsFeed
-from newsfeeds.tasks import fanout_newsfeeds_main_task
-from twitter.cache import USER_NEWSFEEDS_PATTERN
+from functools import partial
+from newsfeeds.tasks import fanout_newsfeeds_main_task, refresh_cached_newsfeeds_task
+from tweets.models import Tweet
+from twitter.cache import USER_NEWSFEEDS_PATTERN, USER_NEWSFEEDS_TIMELINE_PATTERN
 from utils.redis_helper import RedisHelper
-from utils.redis_serializers import DjangoModelSerializer, HBaseModelSerializer
+from utils.redis_serializers import (
+    TimelineEntrySerializer,
+    decode_datetime,
+    encode_datetime,
+    get_serializer,
+)
 
 
 def lazy_load_newsfeeds(user_id):
     def _lazy_load(limit):
         if GateKeeper.is_switched_on('switch_newsfeed_to_hbase'):
-            return HBaseNewsFeed.filter(prefix=(user_id, None), limit=limit, reverse=True)
+            return list(HBaseNewsFeed.scan().prefix(user_id).newest_first().limit(limit))
         return NewsFeed.objects.filter(user_id=user_id).order_by('-created_at')[:limit]
     return _lazy_load
 
 
+def get_newsfeed_timestamp(newsfeed):
+    # HBaseNewsFeed.created_at is already a timestamp in microseconds
+    if isinstance(newsfeed.created_at, int):
+        return newsfeed.created_at
+    return encode_datetime(newsfeed.created_at)
+
+
+def get_newsfeed_entry(newsfeed):
+    return newsfeed.tweet_id, get_newsfeed_timestamp(newsfeed)
+
+
 class NewsFeedService(object):
 
     @classmethod
@@ -35,19 +54,92 @@ class NewsFeedService(object):
             created_at = tweet.created_at
         fanout_newsfeeds_main_task.delay(tweet.id, created_at, tweet.user_id)
 
+    @classmethod
+    def get_cache_serializer(cls, user_id):
+        if not settings.REDIS_NORMALIZED_TIMELINES:
+            if GateKeeper.is_switched_on('switch_newsfeed_to_hbase'):
+                return get_serializer(HBaseNewsFeed)
+            return get_serializer(NewsFeed)
+        # only (tweet_id, created_at) is cached
+        if GateKeeper.is_switched_on('switch_newsfeed_to_hbase'):
+            def build_newsfeed(tweet_id, created_at):
+                return HBaseNewsFeed(user_id=user_id, created_at=created_at, tweet_id=tweet_id)
+        else:
+            def build_newsfeed(tweet_id, created_at):
+                return NewsFeed(user_id=user_id, tweet_id=tweet_id, created_at=decode_datetime(created_at))
+        return TimelineEntrySerializer(get_entry=get_newsfeed_entry, build_object=build_newsfeed)
+
     @classmethod
     def get_cached_newsfeeds(cls, user_id):
         key = USER_NEWSFEEDS_PATTERN.format(user_id=user_id)
-        if GateKeeper.is_switched_on('switch_newsfeed_to_hbase'):
-            serializer = HBaseModelSerializer
+        return RedisHelper.load_objects(
+            key,
+            lazy_load_newsfeeds(user_id),
+            serializer=cls.get_cache_serializer(user_id),
+            refresh=partial(refresh_cached_newsfeeds_task.delay, user_id),
+        )
+
+    @classmethod
+    def load_cached_newsfeeds(cls, user_id, before=None, after=None, count=None):
+        key = USER_NEWSFEEDS_TIMELINE_PATTERN.format(user_id=user_id)
+        return RedisHelper.load_sorted_objects(
+            key,
+            lazy_load_newsfeeds(user_id),
+            get_newsfeed_timestamp,
+            serializer=cls.get_cache_serializer(user_id),
+            before=before,
+            after=after,
+            count=count,
+            refresh=partial(refresh_cached_newsfeeds_task.delay, user_id),
+        )
+
+    @classmethod
+    def refresh_cached_newsfeeds(cls, user_id):
+        if settings.REDIS_SORTED_SET_TIMELINES:
+            RedisHelper.refresh_sorted_objects(
+                USER_NEWSFEEDS_TIMELINE_PATTERN.format(user_id=user_id),
+                lazy_load_newsfeeds(user_id),
+                get_newsfeed_timestamp,
+                serializer=cls.get_cache_serializer(user_id),
+            )
         else:
-            serializer = DjangoModelSerializer
-        return RedisHelper.load_objects(key, lazy_load_newsfeeds(user_id), serializer=serializer)
+            RedisHelper.refresh_objects(
+                USER_NEWSFEEDS_PATTERN.format(user_id=user_id),
+                lazy_load_newsfeeds(user_id),
+                serializer=cls.get_cache_serializer(user_id),
+            )
 
     @classmethod
     def push_newsfeeds_to_cache(cls, newsfeed):
+        if settings.REDIS_SORTED_SET_TIMELINES:
+            RedisHelper.push_sorted_object(
+                USER_NEWSFEEDS_TIMELINE_PATTERN.format(user_id=newsfeed.user_id),
+                newsfeed,
+                lazy_load_newsfeeds(newsfeed.user_id),
+                get_newsfeed_timestamp,
+                serializer=cls.get_cache_serializer(newsfeed.user_id),
+            )
+            return
         key = USER_NEWSFEEDS_PATTERN.format(user_id=newsfeed.user_id)
-        RedisHelper.push_object(key, newsfeed, lazy_load_newsfeeds(newsfeed.user_id))
+        RedisHelper.push_object(
+            key,
+            newsfeed,
+            lazy_load_newsfeeds(newsfeed.user_id),
+            serializer=cls.get_cache_serializer(newsfeed.user_id),
+        )
+
+    @classmethod
+    def hydrate_newsfeeds(cls, newsfeeds):
+        """
+        attach the tweets of a page of newsfeeds from the shared object cache,
+        one MGET instead of a memcached get per newsfeed in cached_tweet
+        """
+        if not settings.REDIS_NORMALIZED_TIMELINES:
+            return newsfeeds
+        tweets = RedisHelper.get_objects(Tweet, [newsfeed.tweet_id for newsfeed in newsfeeds])
+        for newsfeed in newsfeeds:
+            newsfeed.hydrated_tweet = tweets.get(newsfeed.tweet_id)
+        return newsfeeds
 
     @classmethod
     def create(cls, **kwargs):
@@ -1,7 +1,7 @@
 from celery import shared_task
 from friendships.services import FriendshipService
 from newsfeeds.constants import FANOUT_BATCH_SIZE
-from utils.time_constants import ONE_HOUR
+from utils.time_constants import ONE_HOUR, ONE_MINUTE
 
 
 @shared_task(routing_key='newsfeeds', time_limit=ONE_HOUR)
@@ -31,15 +31,22 @@ def fanout_newsfeeds_main_task(tweet_id, created_at, tweet_user_id):
         created_at=created_at,
     )
 
-    # retrieve all the follower id, and split into batches
-    follower_ids = FriendshipService.get_follower_ids(tweet_user_id)
-    index = 0
-    while index < len(follower_ids):
-        batch_ids = follower_ids[index: index + FANOUT_BATCH_SIZE]
+    # stream the follower ids batch by batch instead of loading all of them
+    follower_count, batch_count = 0, 0
+    for batch_ids in FriendshipService.get_follower_id_chunks(tweet_user_id, FANOUT_BATCH_SIZE):
         fanout_newsfeeds_batch_task.delay(tweet_id, created_at, batch_ids)
-        index += FANOUT_BATCH_SIZE
+        follower_count += len(batch_ids)
+        batch_count += 1
 
     return '{} newsfeeds going to fanout, {} batches created.'.format(
-        len(follower_ids),
-        (len(follower_ids) - 1) // FANOUT_BATCH_SIZE + 1,
+        follower_count,
+        batch_count,
     )
+
+
+@shared_task(routing_key='default', time_limit=ONE_MINUTE)
+def refresh_cached_newsfeeds_task(user_id):
+    # rebuilds the cached newsfeeds of a user ahead of their expiry
+    from newsfeeds.services import NewsFeedService
+
+    NewsFeedService.refresh_cached_newsfeeds(user_id)
@@ -1,9 +1,15 @@
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django_hbase.client import HBaseClient
 from gatekeeper.models import GateKeeper
 from newsfeeds.models import NewsFeed, HBaseNewsFeed
 from newsfeeds.services import NewsFeedService
 from newsfeeds.tasks import fanout_newsfeeds_main_task
 from testing.testcases import TestCase
+from io import StringIO
 from twitter.cache import USER_NEWSFEEDS_PATTERN
+from unittest import skipUnless
 from utils.redis_client import RedisClient
 
 
@@ -103,3 +109,45 @@ class NewsFeedTaskTests(TestCase):
         self.assertEqual(len(cached_list), 3)
         cached_list = NewsFeedService.get_cached_newsfeeds(self.alex.id)
         self.assertEqual(len(cached_list), 3)
+
+
+class BenchmarkCommandTests(TestCase):
+
+    def test_benchmark_redis_round_trips(self):
+        # keeps the command in line with the keys and args of the lua scripts
+        out = StringIO()
+        call_command('benchmark_redis_round_trips', newsfeeds=5, stdout=out)
+        self.assertIn('load newsfeeds, cache hit: 1 round trips', out.getvalue())
+        self.assertIn('push a newsfeed, cache hit: 1 round trips', out.getvalue())
+
+
+class MigrateTimelinesTests(TestCase):
+
+    def test_refused_while_serving_the_old_tables(self):
+        # the serving processes keep the old tables until the backfill is done
+        with self.settings(HBASE_NEWEST_FIRST_TIMELINES=False):
+            with self.assertRaises(CommandError):
+                call_command('migrate_timelines_newest_first', source_prefix='test_', stdout=StringIO())
+
+    @skipUnless(settings.HBASE_NEWEST_FIRST_TIMELINES, 'the models use the old tables')
+    def test_migrate_timelines_newest_first(self):
+        # the old tables, created_at ascending
+        old_tables = ['test_twitter_newsfeeds', 'test_twitter_followers', 'test_twitter_followings']
+        with HBaseClient.connection() as conn:
+            for table_name in old_tables:
+                conn.create_table(table_name, {'cf': dict()})
+            conn.table('test_twitter_newsfeeds').put(
+                b'2100000000000000:1600000000000000',
+                {b'cf:tweet_id': b'0000000000000003'},
+            )
+
+        call_command('migrate_timelines_newest_first', source_prefix='test_', stdout=StringIO())
+        with HBaseClient.connection() as conn:
+            for table_name in old_tables:
+                conn.delete_table(table_name, disable=True)
+
+        newsfeeds = HBaseNewsFeed.filter(prefix=(12, None))
+        self.assertEqual(
+            [(newsfeed.created_at, newsfeed.tweet_id) for newsfeed in newsfeeds],
+            [(1600000000000000, 3)],
+        )
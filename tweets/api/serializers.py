@@ -1,5 +1,6 @@
 from accounts.api.serializers import UserSerializer
 from accounts.api.serializers import UserSerializerForTweet
+from django.contrib.auth.models import User
 from comments.api.serializers import CommentSerializer
 from likes.api.serializers import LikeSerializer
 from likes.services import LikeService
@@ -8,7 +9,9 @@ from rest_framework.exceptions import ValidationError
 from tweets.constants import TWEET_PHOTOS_UPLOAD_LIMIT
 from tweets.models import Tweet
 from tweets.service import TweetService
+from utils.memcached_helper import MemcachedHelper
 from utils.redis_helper import RedisHelper
+from utils.serializers import PrefetchListSerializer
 
 class TweetSerializer(serializers.ModelSerializer):
     user = UserSerializerForTweet(source='cached_user')
@@ -29,6 +32,12 @@ class TweetSerializer(serializers.ModelSerializer):
             'has_liked',
             'photo_urls',
         )
+        list_serializer_class = PrefetchListSerializer
+
+    def prefetch(self, tweets):
+        MemcachedHelper.hydrate_objects(tweets, User, 'user_id', 'hydrated_user')
+        users = [tweet.hydrated_user for tweet in tweets if tweet.hydrated_user is not None]
+        self.fields['user'].prefetch(users)
 
     def get_likes_count(self, obj):
         return RedisHelper.get_count(obj, 'likes_count')
@@ -1,4 +1,5 @@
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import override_settings
 from rest_framework.test import APIClient
 from testing.testcases import TestCase
 from tweets.models import Tweet, TweetPhoto
@@ -216,3 +217,6 @@ class TweetApiTests(TestCase):
         self.assertEqual(len(response.data['results']), 1)
         self.assertEqual(response.data['results'][0]['id'], new_tweet.id)
 
+    @override_settings(REDIS_SORTED_SET_TIMELINES=True)
+    def test_pagination_with_sorted_set_timelines(self):
+        self.test_pagination()
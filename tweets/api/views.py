@@ -1,3 +1,5 @@
+from django.conf import settings
+from functools import partial
 from newsfeeds.services import NewsFeedService
 from rest_framework import viewsets
 from rest_framework.permissions import IsAuthenticated, AllowAny
@@ -45,11 +47,19 @@ class TweetViewSet(viewsets.GenericViewSet):
             we use user_id as a filtering condition
         """
         user_id = request.query_params['user_id']
-        cached_tweets = TweetService.get_cached_tweets(user_id=user_id)
-        page = self.paginator.paginate_cached_list(cached_tweets, request)
+        if settings.REDIS_SORTED_SET_TIMELINES:
+            page = self.paginator.paginate_cached_sorted_set(
+                partial(TweetService.load_cached_tweets, user_id),
+                request,
+            )
+        else:
+            cached_tweets = TweetService.get_cached_tweets(user_id=user_id)
+            page = self.paginator.paginate_cached_list(cached_tweets, request)
         if page is None:
             queryset = Tweet.objects.filter(user_id=user_id).order_by('-created_at')
             page = self.paginate_queryset(queryset)
+        else:
+            page = TweetService.hydrate_tweets(page)
         serializer = TweetSerializer(
             page,
             context={'request': request},
@@ -1,7 +1,7 @@
 from django.contrib.auth.models import User
 from django.contrib.contenttypes.models import ContentType
 from django.db import models
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, pre_delete
 from likes.models import Like
 from tweets.listeners import push_tweet_to_cache
 from utils.listeners import invalidate_object_cache
@@ -42,12 +42,13 @@ class Tweet(models.Model):
 
     @property
     def cached_user(self):
-        return MemcachedHelper.get_object_through_cache(User, self.user_id)
+        return MemcachedHelper.get_hydrated_object(self, 'hydrated_user', User, self.user_id)
 
     @property
     def timestamp(self):
         return int(self.created_at.timestamp() * 1000000)
 
 
+pre_delete.connect(invalidate_object_cache, sender=Tweet)
 post_save.connect(invalidate_object_cache, sender=Tweet)
 post_save.connect(push_tweet_to_cache, sender=Tweet)
\ No newline at end of file
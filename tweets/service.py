@@ -1,6 +1,15 @@
+from django.conf import settings
+from functools import partial
 from tweets.models import TweetPhoto, Tweet
-from twitter.cache import USER_TWEETS_PATTERN
+from tweets.tasks import refresh_cached_tweets_task
+from twitter.cache import USER_TWEETS_PATTERN, USER_TWEETS_TIMELINE_PATTERN
 from utils.redis_helper import RedisHelper
+from utils.redis_serializers import (
+    TimelineEntrySerializer,
+    decode_datetime,
+    encode_datetime,
+    get_serializer,
+)
 
 
 def lazy_load_tweets(user_id):
@@ -9,6 +18,10 @@ def lazy_load_tweets(user_id):
     return _lazy_load
 
 
+def get_tweet_timestamp(tweet):
+    return encode_datetime(tweet.created_at)
+
+
 class TweetService(object):
 
     @classmethod
@@ -24,12 +37,87 @@ class TweetService(object):
             photos.append(photo)
         TweetPhoto.objects.bulk_create(photos)
 
+    @classmethod
+    def get_cache_serializer(cls, user_id):
+        if not settings.REDIS_NORMALIZED_TIMELINES:
+            return get_serializer(Tweet)
+        # only the tweet id is cached, the tweet is built back with just
+        # enough fields to paginate on and hydrated by hydrate_tweets
+        return TimelineEntrySerializer(
+            get_entry=lambda tweet: (tweet.id, get_tweet_timestamp(tweet)),
+            build_object=lambda tweet_id, created_at: Tweet(
+                id=tweet_id,
+                user_id=user_id,
+                created_at=decode_datetime(created_at),
+            ),
+        )
+
     @classmethod
     def get_cached_tweets(cls, user_id):
         key = USER_TWEETS_PATTERN.format(user_id=user_id)
-        return RedisHelper.load_objects(key, lazy_load_tweets(user_id))
+        return RedisHelper.load_objects(
+            key,
+            lazy_load_tweets(user_id),
+            serializer=cls.get_cache_serializer(user_id),
+            refresh=partial(refresh_cached_tweets_task.delay, user_id),
+        )
+
+    @classmethod
+    def load_cached_tweets(cls, user_id, before=None, after=None, count=None):
+        key = USER_TWEETS_TIMELINE_PATTERN.format(user_id=user_id)
+        return RedisHelper.load_sorted_objects(
+            key,
+            lazy_load_tweets(user_id),
+            get_tweet_timestamp,
+            serializer=cls.get_cache_serializer(user_id),
+            before=before,
+            after=after,
+            count=count,
+            refresh=partial(refresh_cached_tweets_task.delay, user_id),
+        )
+
+    @classmethod
+    def refresh_cached_tweets(cls, user_id):
+        if settings.REDIS_SORTED_SET_TIMELINES:
+            RedisHelper.refresh_sorted_objects(
+                USER_TWEETS_TIMELINE_PATTERN.format(user_id=user_id),
+                lazy_load_tweets(user_id),
+                get_tweet_timestamp,
+                serializer=cls.get_cache_serializer(user_id),
+            )
+        else:
+            RedisHelper.refresh_objects(
+                USER_TWEETS_PATTERN.format(user_id=user_id),
+                lazy_load_tweets(user_id),
+                serializer=cls.get_cache_serializer(user_id),
+            )
 
     @classmethod
     def push_tweet_to_cache(cls, tweet):
+        if settings.REDIS_SORTED_SET_TIMELINES:
+            RedisHelper.push_sorted_object(
+                USER_TWEETS_TIMELINE_PATTERN.format(user_id=tweet.user_id),
+                tweet,
+                lazy_load_tweets(tweet.user_id),
+                get_tweet_timestamp,
+                serializer=cls.get_cache_serializer(tweet.user_id),
+            )
+            return
         key = USER_TWEETS_PATTERN.format(user_id=tweet.user_id)
-        RedisHelper.push_object(key, tweet, lazy_load_tweets(tweet.user_id))
+        RedisHelper.push_object(
+            key,
+            tweet,
+            lazy_load_tweets(tweet.user_id),
+            serializer=cls.get_cache_serializer(tweet.user_id),
+        )
+
+    @classmethod
+    def hydrate_tweets(cls, tweets):
+        """
+        replace the tweets of a page of get_cached_tweets with the ones of
+        the shared object cache, tweets deleted since are left out
+        """
+        if not settings.REDIS_NORMALIZED_TIMELINES:
+            return tweets
+        cached_tweets = RedisHelper.get_objects(Tweet, [tweet.id for tweet in tweets])
+        return [cached_tweets[tweet.id] for tweet in tweets if tweet.id in cached_tweets]
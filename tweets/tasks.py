@@ -0,0 +1,11 @@
+from celery import shared_task
+from utils.time_constants import ONE_MINUTE
+
+
+@shared_task(routing_key='default', time_limit=ONE_MINUTE)
+def refresh_cached_tweets_task(user_id):
+    # rebuilds the cached tweets of a user ahead of their expiry
+    # import 写在里面避免循环依赖
+    from tweets.service import TweetService
+
+    TweetService.refresh_cached_tweets(user_id)
@@ -1,9 +1,11 @@
 from datetime import timedelta
+from django.test import override_settings
 from testing.testcases import TestCase
 from tweets.constants import TweetPhotoStatus
-from tweets.models import TweetPhoto
+from tweets.models import Tweet, TweetPhoto
 from utils.redis_client import RedisClient
-from utils.redis_serializers import DjangoModelSerializer
+from utils.redis_helper import RedisHelper
+from utils.redis_serializers import DjangoModelSerializer, encode_datetime
 from utils.time_helpers import utc_now
 from tweets.service import TweetService
 from twitter.cache import USER_TWEETS_PATTERN
@@ -98,3 +100,38 @@ class TweetServiceTests(TestCase):
 
         tweets = TweetService.get_cached_tweets(self.bob.id)
         self.assertEqual([t.id for t in tweets], [tweet2.id, tweet1.id])
+
+    @override_settings(REDIS_NORMALIZED_TIMELINES=True)
+    def test_normalized_cached_tweets(self):
+        tweet1 = self.create_tweet(self.bob, 'tweet1')
+        tweet2 = self.create_tweet(self.bob, 'tweet2')
+
+        # only the ids and created_at are in the list
+        tweets = TweetService.get_cached_tweets(self.bob.id)
+        key = USER_TWEETS_PATTERN.format(user_id=self.bob.id)
+        self.assertEqual(RedisClient.get_cache_connection(key).lrange(key, 0, -1), [
+            '{}:{}'.format(tweet.id, encode_datetime(tweet.created_at)).encode('utf-8')
+            for tweet in [tweet2, tweet1]
+        ])
+        tweets = TweetService.get_cached_tweets(self.bob.id)
+        self.assertEqual([t.id for t in tweets], [tweet2.id, tweet1.id])
+        self.assertEqual([t.created_at for t in tweets], [tweet2.created_at, tweet1.created_at])
+        self.assertEqual(tweets[0].content, '')
+
+        # the page is hydrated from the shared object cache
+        tweets = TweetService.hydrate_tweets(tweets)
+        self.assertEqual([t.content for t in tweets], ['tweet2', 'tweet1'])
+        object_key = RedisHelper.get_object_key(Tweet, tweet1.id)
+        self.assertEqual(RedisClient.get_cache_connection(object_key).exists(object_key), True)
+
+        # saving a tweet invalidates its cached object
+        tweet1.content = 'tweet1 edited'
+        tweet1.save()
+        self.assertEqual(RedisClient.get_cache_connection(object_key).exists(object_key), False)
+        tweets = TweetService.hydrate_tweets(TweetService.get_cached_tweets(self.bob.id))
+        self.assertEqual([t.content for t in tweets], ['tweet2', 'tweet1 edited'])
+
+        # deleted tweets are left out
+        tweet2.delete()
+        tweets = TweetService.hydrate_tweets(TweetService.get_cached_tweets(self.bob.id))
+        self.assertEqual([t.id for t in tweets], [tweet1.id])
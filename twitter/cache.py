@@ -5,3 +5,7 @@ USER_PROFILE_PATTERN = 'userprofile:{user_id}'
 # used in redis
 USER_TWEETS_PATTERN = 'user_tweets:{user_id}'
 USER_NEWSFEEDS_PATTERN = 'user_newsfeeds:{user_id}'
+# the sorted set timelines, used instead of the lists above when
+# REDIS_SORTED_SET_TIMELINES is on
+USER_TWEETS_TIMELINE_PATTERN = 'user_tweets_timeline:{user_id}'
+USER_NEWSFEEDS_TIMELINE_PATTERN = 'user_newsfeeds_timeline:{user_id}'
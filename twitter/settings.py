@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/3.1/ref/settings/
 from pathlib import Path
 from kombu import Queue
 
+import os
 import sys
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -47,6 +48,7 @@ INSTALLED_APPS = [
     'notifications',
 
     # project apps
+    'django_hbase',
     'accounts',
     'tweets',
     'friendships',
@@ -112,6 +114,30 @@ DATABASES = {
 
 # HBase Database
 HBASE_HOST = '127.0.0.1'
+# every gunicorn / celery worker process holds at most HBASE_POOL_SIZE thrift connections
+HBASE_POOL_SIZE = 10
+# seconds to wait for a free connection before raising NoConnectionsAvailable
+HBASE_POOL_TIMEOUT = 5
+# seconds a pooled connection may stay idle before it is pinged at checkout,
+# a firewall or the thrift gateway may have half closed its socket meanwhile
+HBASE_POOL_IDLE_CHECK = 30
+# django_hbase.emulator.Connection runs HBase in-process and in memory,
+# it is used by the unit tests unless HBASE_CONNECTION_CLASS is exported
+HBASE_CONNECTION_CLASS = 'happybase.Connection'
+# milliseconds a single thrift call may take before the socket times out
+HBASE_TIMEOUT = 2000
+# reads are retried that many times, after a jittered exponential backoff in seconds
+HBASE_READ_RETRIES = 2
+HBASE_RETRY_BACKOFF = 0.05
+HBASE_RETRY_MAX_BACKOFF = 1
+# consecutive failures that open the circuit, then seconds before a probe call
+HBASE_CIRCUIT_BREAKER_THRESHOLD = 5
+HBASE_CIRCUIT_BREAKER_RESET_TIMEOUT = 30
+# the newsfeeds, followings and followers stored newest first (descending created_at)
+# in the *_v2 tables. it stays off while manage.py migrate_timelines_newest_first
+# (which runs with HBASE_NEWEST_FIRST_TIMELINES=1) copies the old tables, the reads
+# and writes then switch to the new tables once the backfill is done
+HBASE_NEWEST_FIRST_TIMELINES = os.environ.get('HBASE_NEWEST_FIRST_TIMELINES') == '1'
 
 # Password validation
 # https://docs.djangoproject.com/en/3.1/ref/settings/#auth-password-validators
@@ -154,6 +180,9 @@ DEFAULT_FILE_STORAGE = 'storages.backends.s3boto3.S3Boto3Storage'
 TESTING = ((" ".join(sys.argv)).find('manage.py test') != -1)
 if TESTING:
     DEFAULT_FILE_STORAGE = 'django.core.files.storage.FileSystemStorage'
+    HBASE_CONNECTION_CLASS = os.environ.get('HBASE_CONNECTION_CLASS', 'django_hbase.emulator.Connection')
+    # on by default in the tests, HBASE_NEWEST_FIRST_TIMELINES=0 runs them on the old layout
+    HBASE_NEWEST_FIRST_TIMELINES = os.environ.get('HBASE_NEWEST_FIRST_TIMELINES', '1') == '1'
 
 # when using s3boto3 as the storage for user uploads, we need to set bucket name and region
 AWS_STORAGE_BUCKET_NAME = 'django-twitter-mini'
@@ -197,7 +226,46 @@ REDIS_HOST = '127.0.0.1'
 REDIS_PORT = 6379
 REDIS_DB = 0 if TESTING else 1
 REDIS_KEY_EXPIRE_TIME = 7 * 86400  # in seconds
+# every process keeps at most REDIS_POOL_SIZE connections per redis instance and
+# waits REDIS_POOL_TIMEOUT seconds for a free one
+REDIS_POOL_SIZE = 50
+REDIS_POOL_TIMEOUT = 1
+REDIS_SOCKET_TIMEOUT = 0.5  # in seconds
+REDIS_SOCKET_CONNECT_TIMEOUT = 0.5  # in seconds
+# connections idle for longer than this are checked with a PING before being used
+REDIS_HEALTH_CHECK_INTERVAL = 30  # in seconds
+# the cache lists (user_newsfeeds:*, user_tweets:*) and the counters are spread
+# over these instances with consistent hashing, e.g.
+#   [{'host': '10.0.0.1', 'port': 6379, 'db': 1}, {'host': '10.0.0.2', 'port': 6379, 'db': 1}]
+# an empty list keeps them on REDIS_HOST with the gatekeepers
+REDIS_CACHE_SHARDS = []
 REDIS_LIST_LENGTH_LIMIT = 1000 if not TESTING else 20
+# a missing cache list is rebuilt by a single request, it holds the lock of the
+# key for at most REDIS_REBUILD_LOCK_TIMEOUT seconds. the concurrent requests wait
+# REDIS_REBUILD_WAIT seconds for it, then read the db themselves
+REDIS_REBUILD_LOCK_TIMEOUT = 10
+REDIS_REBUILD_WAIT = 0.5
+
+# probabilistic early expiration (XFetch) of the redis timelines and memcached objects:
+# a cache hit queues a refresh of the key in a celery task before the key expires, with
+# a probability that grows as the expiry gets closer and with the time it took to
+# compute the key. a larger beta refreshes earlier, the default delta (in seconds) is
+# used until the recompute time of a key pattern has been measured
+CACHE_XFETCH_BETA = 1.0
+CACHE_XFETCH_DEFAULT_DELTA = 0.1
+# the refreshes run in celery, a refresh is queued early enough for a worker to pick it
+# up before the key expires: this expected queue and dispatch latency (in seconds) is
+# added to the recompute time of the key
+CACHE_REFRESH_QUEUE_LATENCY = 5
+# True: the user_newsfeeds:* and user_tweets:* lists only hold b'<tweet id>:<created_at>'
+# entries and every tweet is cached once under object:Tweet:<id>, the page that
+# is returned is hydrated with an MGET. False: the lists hold the whole tweets
+# and newsfeeds, with copies of a tweet in the list of every follower
+REDIS_NORMALIZED_TIMELINES = False
+# True: the timelines are sorted sets scored by created_at (user_tweets_timeline:*,
+# user_newsfeeds_timeline:*) and a page is read with ZREVRANGEBYSCORE instead of
+# reading and deserializing the whole list
+REDIS_SORTED_SET_TIMELINES = False
 
 # Celery Configuration Options
 # 使用如下命令把 worker 进程（只执行异步任务的进程，可以在不同的机器上）单独跑起来
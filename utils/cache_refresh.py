@@ -0,0 +1,69 @@
+from collections import namedtuple
+import math
+import random
+import threading
+
+
+# a memcached value with what XFetch needs to refresh it early: its expiry
+# (unix time, in seconds) and how long it took to compute (delta, in seconds)
+CacheEntry = namedtuple('CacheEntry', ['value', 'expires_at', 'delta'])
+
+
+def get_key_pattern(key):
+    # user_newsfeeds:1 -> user_newsfeeds, Tweet:1 -> Tweet
+    if isinstance(key, bytes):
+        key = key.decode('utf-8')
+    return key.split(':', 1)[0]
+
+
+def should_refresh_early(expires_in, delta, beta):
+    """
+    XFetch, probabilistic early expiration: a read refreshes the key before
+    it expires with a probability that grows as expires_in (seconds) gets
+    close to 0, and with the recompute time delta of the key. beta > 1
+    favors earlier refreshes. the more a key is read, the more likely one
+    of its reads refreshes it in time, so hot keys do not expire at all.
+    """
+    if expires_in is None:
+        return False
+    # 1 - random() is in (0, 1], log(0) is not defined
+    return delta * beta * -math.log(1 - random.random()) >= expires_in
+
+
+class RecomputeCosts:
+    """
+    process local statistics of how long rebuilding a cache key takes, per
+    key pattern. average() is an exponentially weighted moving average and
+    is the delta of should_refresh_early for the keys cached without it.
+    """
+
+    def __init__(self, alpha=0.2):
+        self.alpha = alpha
+        self.lock = threading.Lock()
+        self.costs = {}
+
+    def record(self, key, seconds):
+        pattern = get_key_pattern(key)
+        with self.lock:
+            cost = self.costs.get(pattern)
+            if cost is None:
+                cost = self.costs[pattern] = {'count': 0, 'total': 0.0, 'average': seconds}
+            cost['count'] += 1
+            cost['total'] += seconds
+            cost['average'] += self.alpha * (seconds - cost['average'])
+
+    def average(self, key, default):
+        with self.lock:
+            cost = self.costs.get(get_key_pattern(key))
+            return cost['average'] if cost is not None else default
+
+    def stats(self):
+        with self.lock:
+            return {pattern: dict(cost) for pattern, cost in self.costs.items()}
+
+    def reset(self):
+        with self.lock:
+            self.costs = {}
+
+
+recompute_costs = RecomputeCosts()
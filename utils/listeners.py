@@ -1,3 +1,6 @@
 def invalidate_object_cache(sender, instance, **kwargs):
     from utils.memcached_helper import MemcachedHelper
+    from utils.redis_helper import RedisHelper
     MemcachedHelper.invalidate_cached_object(sender, instance.id)
+    # the shared object cache of the normalized timelines
+    RedisHelper.invalidate_object(sender, instance.id)
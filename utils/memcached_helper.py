@@ -1,5 +1,8 @@
 from django.conf import settings
 from django.core.cache import caches
+from utils.cache_refresh import CacheEntry, recompute_costs, should_refresh_early
+from utils.tasks import refresh_cached_object_task
+import time
 
 cache = caches['testing'] if settings.TESTING else caches['default']
 
@@ -14,17 +17,99 @@ class MemcachedHelper:
     def get_object_through_cache(cls, model_class, object_id):
         key = cls.get_key(model_class, object_id)
         # cache hit
-        obj = cache.get(key)
-        if obj:
-            return obj
+        entry = cache.get(key)
+        if isinstance(entry, CacheEntry):
+            cls.refresh_ahead(key, entry, model_class, object_id)
+            return entry.value
+        # a bare object, cached before the entries had an expiry
+        if entry:
+            return entry
 
         # cache miss
+        return cls.refresh_cached_object(model_class, object_id)
+
+    @classmethod
+    def get_objects_through_cache(cls, model_class, object_ids):
+        """
+        {object_id: object} with one get_many, the misses are read with a
+        single filter(id__in=...) query and written back with one set_many.
+        the ids that are not in the db are left out.
+        """
+        object_ids = list(dict.fromkeys(object_ids))
+        keys = {cls.get_key(model_class, object_id): object_id for object_id in object_ids}
+        entries = cache.get_many(list(keys))
+
+        objects = {}
+        for key, entry in entries.items():
+            if isinstance(entry, CacheEntry):
+                cls.refresh_ahead(key, entry, model_class, keys[key])
+                entry = entry.value
+            if entry:
+                objects[keys[key]] = entry
+
+        missing_ids = [object_id for object_id in object_ids if object_id not in objects]
+        if missing_ids:
+            started_at = time.monotonic()
+            loaded_objects = list(model_class.objects.filter(id__in=missing_ids))
+            delta = time.monotonic() - started_at
+            expires_at = None if cache.default_timeout is None else time.time() + cache.default_timeout
+            cache.set_many({
+                cls.get_key(model_class, obj.id): CacheEntry(obj, expires_at, delta)
+                for obj in loaded_objects
+            })
+            # a single query for the whole batch, its cost is recorded once
+            recompute_costs.record(model_class.__name__, delta)
+            for obj in loaded_objects:
+                objects[obj.id] = obj
+        return objects
+
+    @classmethod
+    def hydrate_objects(cls, instances, model_class, id_attr, to_attr):
+        """
+        sets instance.<to_attr> to the model_class object of id
+        instance.<id_attr> for all the instances, fetched together with
+        get_objects_through_cache. see get_hydrated_object
+        """
+        objects = cls.get_objects_through_cache(
+            model_class,
+            [getattr(instance, id_attr) for instance in instances],
+        )
+        for instance in instances:
+            setattr(instance, to_attr, objects.get(getattr(instance, id_attr)))
+
+    @classmethod
+    def get_hydrated_object(cls, instance, to_attr, model_class, object_id):
+        # the object set by hydrate_objects, or the one in the cache
+        obj = getattr(instance, to_attr, None)
+        if obj is not None:
+            return obj
+        return cls.get_object_through_cache(model_class, object_id)
+
+    @classmethod
+    def refresh_cached_object(cls, model_class, object_id):
+        key = cls.get_key(model_class, object_id)
+        started_at = time.monotonic()
         obj = model_class.objects.get(id=object_id)
+        delta = time.monotonic() - started_at
+        recompute_costs.record(key, delta)
         # using default expire time
-        cache.set(key, obj)
+        expires_at = None if cache.default_timeout is None else time.time() + cache.default_timeout
+        cache.set(key, CacheEntry(obj, expires_at, delta))
         return obj
 
+    @classmethod
+    def refresh_ahead(cls, key, entry, model_class, object_id):
+        # XFetch, see RedisHelper.refresh_ahead
+        if entry.expires_at is None:
+            return
+        delta = entry.delta + settings.CACHE_REFRESH_QUEUE_LATENCY
+        if not should_refresh_early(entry.expires_at - time.time(), delta, settings.CACHE_XFETCH_BETA):
+            return
+        # add is atomic in memcached, a single refresh of a key is queued at a time
+        if cache.add('refresh:{}'.format(key), 1, settings.REDIS_REBUILD_LOCK_TIMEOUT):
+            refresh_cached_object_task.delay(model_class._meta.label, object_id)
+
     @classmethod
     def invalidate_cached_object(cls, model_class, object_id):
         key = cls.get_key(model_class, object_id)
-        cache.delete(key)
\ No newline at end of file
+        cache.delete(key)
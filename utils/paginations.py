@@ -2,7 +2,16 @@ from dateutil import parser
 from rest_framework.pagination import BasePagination
 from rest_framework.response import Response
 from django.conf import settings
-from utils.time_constants import MAX_TIMESTAMP
+from utils.redis_serializers import encode_datetime
+
+
+def parse_timestamp(value):
+    # the score of a sorted set timeline, in microseconds since the epoch,
+    # from the iso format of django models or the int timestamp of hbase
+    try:
+        return encode_datetime(parser.isoparse(value))
+    except ValueError:
+        return int(value)
 
 
 class EndlessPagination(BasePagination):
@@ -74,50 +83,31 @@ class EndlessPagination(BasePagination):
         return queryset[:self.page_size]
 
     def paginate_hbase(self, hb_model, row_key_prefix, request):
+        # HBaseQuery 会根据 created_at 的存储顺序选择正向或者反向 scan，
+        # 并且 after / before 都是开区间，不需要再多取一个 object 然后手动去掉
+        query = hb_model.scan().prefix(*row_key_prefix).newest_first()
+
         if 'created_at__gt' in request.query_params:
             # created_at__gt is used to load the latest content when scrolling down
             # to simplify it, we don't do pagination. rather, we load all the latest content
             # because if the data has not been updated for a while
             # we won't do scroll down. We will just load all the new data all over again
-            created_at__gt = request.query_params['created_at__gt']
-            start = (*row_key_prefix, created_at__gt)
-            stop = (*row_key_prefix, MAX_TIMESTAMP)
-            objects = hb_model.filter(start=start, stop=stop)
-            if len(objects) and objects[0].created_at == int(created_at__gt):
-                objects = objects[:0:-1]
-            else:
-                objecs = objects[::-1]
+            created_at__gt = int(request.query_params['created_at__gt'])
             self.has_next_page = False
-            return objects
+            return list(query.after(created_at__gt))
 
         if 'created_at__lt' in request.query_params:
             # created_at__lt 用于向上滚屏（往下翻页）的时候加载下一页的数据
             # 寻找 timestamp < created_at__lt 的 objects 里按照 timestamp 倒序的前 page_size + 1 个 objects
             # 比如目前的 timestamp 列表是 [1, 2, 3, 4, 5, 6, 7, 8, 9, 10] 如果 created_at__lt=5, page_size = 2
             # 则应该返回 [4, 3, 2]，多返回一个 object 的原因是为了判断是否还有下一页从而减少一次空加载。
-            # 由于 hbase 只支持 <= 的查询而不支持 <, 因此我们还需要再多取一个 item 保证 < 的 item 有 page_size + 1 个
-            created_at__lt = request.query_params['created_at__lt']
-            start = (*row_key_prefix, created_at__lt)
-            stop = (*row_key_prefix, None)
-            objects = hb_model.filter(start=start, stop=stop, limit=self.page_size + 2, reverse=True)
-            if len(objects) and objects[0].created_at == int(created_at__lt):
-                objects = objects[1:]
-            if len(objects) > self.page_size:
-                self.has_next_page = True
-                objects = objects[:-1]
-            else:
-                self.has_next_page = False
-            return objects
+            created_at__lt = int(request.query_params['created_at__lt'])
+            query = query.before(created_at__lt)
 
         # no any other params, load the latest page by default
-        prefix = (*row_key_prefix, None)
-        objects = hb_model.filter(prefix=prefix, limit=self.page_size + 1, reverse=True)
-        if len(objects) > self.page_size:
-            self.has_next_page = True
-            objects = objects[:-1]
-        else:
-            self.has_next_page = False
-        return objects
+        objects = list(query.limit(self.page_size + 1))
+        self.has_next_page = len(objects) > self.page_size
+        return objects[:self.page_size]
 
     def paginate_cached_list(self, cached_list, request):
         paginated_list = self.paginate_ordered_list(cached_list, request)
@@ -134,6 +124,28 @@ class EndlessPagination(BasePagination):
         # we need to query them in db
         return None
 
+    def paginate_cached_sorted_set(self, load_sorted_objects, request):
+        """
+        load_sorted_objects(before, after, count) reads a range of a sorted set
+        timeline, see RedisHelper.load_sorted_objects. only the page (and
+        one more object to know if there is a next page) is read from redis.
+        returns None when the page has to be read from the db.
+        """
+        if 'created_at__gt' in request.query_params:
+            created_at__gt = parse_timestamp(request.query_params['created_at__gt'])
+            objects, _ = load_sorted_objects(after=created_at__gt)
+            self.has_next_page = False
+            return objects
+
+        created_at__lt = None
+        if 'created_at__lt' in request.query_params:
+            created_at__lt = parse_timestamp(request.query_params['created_at__lt'])
+        objects, is_complete = load_sorted_objects(before=created_at__lt, count=self.page_size + 1)
+        if not is_complete:
+            return None
+        self.has_next_page = len(objects) > self.page_size
+        return objects[:self.page_size]
+
     def get_paginated_response(self, data):
         return Response({
             'has_next_page': self.has_next_page,
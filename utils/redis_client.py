@@ -1,26 +1,151 @@
+from bisect import bisect
 from django.conf import settings
+import hashlib
 import redis
 
 
+def create_connection(host, port, db):
+    pool = redis.BlockingConnectionPool(
+        host=host,
+        port=port,
+        db=db,
+        max_connections=settings.REDIS_POOL_SIZE,
+        timeout=settings.REDIS_POOL_TIMEOUT,
+        socket_timeout=settings.REDIS_SOCKET_TIMEOUT,
+        socket_connect_timeout=settings.REDIS_SOCKET_CONNECT_TIMEOUT,
+        health_check_interval=settings.REDIS_HEALTH_CHECK_INTERVAL,
+    )
+    return redis.Redis(connection_pool=pool)
+
+
+def get_hash(value):
+    return int.from_bytes(hashlib.md5(value.encode('utf-8')).digest()[:8], 'big')
+
+
+class ShardedRedis:
+    """
+    spread keys over several redis instances with consistent hashing, every
+    shard owns `replicas` points of the ring so adding or removing a shard
+    only moves the keys of about 1 / len(shards) of the ring.
+
+    single key commands go to get_shard(key), multi key commands are split
+    into one command per shard:
+        conn = sharded.get_shard('user_newsfeeds:1')
+        sharded.mget(['user_tweets:1', 'user_tweets:2'])
+    """
+
+    def __init__(self, shards, replicas=160):
+        """
+        shards: {name: redis.Redis}, the ring is built from the names so the
+        same shard list always gives the same key placement
+        """
+        if not shards:
+            raise ValueError('ShardedRedis needs at least one shard')
+        self.shards = shards
+        ring = sorted(
+            (get_hash('{}#{}'.format(name, replica)), name)
+            for name in shards
+            for replica in range(replicas)
+        )
+        self.ring_hashes = [ring_hash for ring_hash, _ in ring]
+        self.ring_names = [name for _, name in ring]
+
+    def get_shard_name(self, key):
+        if isinstance(key, bytes):
+            key = key.decode('utf-8')
+        index = bisect(self.ring_hashes, get_hash(key)) % len(self.ring_hashes)
+        return self.ring_names[index]
+
+    def get_shard(self, key):
+        return self.shards[self.get_shard_name(key)]
+
+    def group_by_shard(self, keys):
+        """
+        {name: [(position, key), ...]}, position is the index in keys
+        """
+        groups = {}
+        for position, key in enumerate(keys):
+            groups.setdefault(self.get_shard_name(key), []).append((position, key))
+        return groups
+
+    def mget(self, keys):
+        values = [None] * len(keys)
+        for name, group in self.group_by_shard(keys).items():
+            shard_values = self.shards[name].mget([key for _, key in group])
+            for (position, _), value in zip(group, shard_values):
+                values[position] = value
+        return values
+
+    def set_many(self, mapping, ex=None):
+        # one pipeline of SETs per shard
+        keys = list(mapping)
+        for name, group in self.group_by_shard(keys).items():
+            pipeline = self.shards[name].pipeline(transaction=False)
+            for _, key in group:
+                pipeline.set(key, mapping[key], ex=ex)
+            pipeline.execute()
+
+    def delete(self, *keys):
+        return sum(
+            self.shards[name].delete(*[key for _, key in group])
+            for name, group in self.group_by_shard(keys).items()
+        )
+
+    def exists(self, *keys):
+        return sum(
+            self.shards[name].exists(*[key for _, key in group])
+            for name, group in self.group_by_shard(keys).items()
+        )
+
+    def flushdb(self):
+        for conn in self.shards.values():
+            conn.flushdb()
+
+
 class RedisClient:
     conn = None
+    cache_conn = None
 
     @classmethod
     def get_connection(cls):
-        # use singleton mode, only create one single connection
+        # use singleton mode, one connection pool per process
         if cls.conn:
             return cls.conn
-        cls.conn = redis.Redis(
-            host=settings.REDIS_HOST,
-            port=settings.REDIS_PORT,
-            db=settings.REDIS_DB,
-        )
+        cls.conn = create_connection(settings.REDIS_HOST, settings.REDIS_PORT, settings.REDIS_DB)
         return cls.conn
 
+    @classmethod
+    def get_sharded_connection(cls):
+        """
+        the ShardedRedis of the cache lists and counters, with a single
+        shard (the main connection) when REDIS_CACHE_SHARDS is empty
+        """
+        if cls.cache_conn:
+            return cls.cache_conn
+        if not settings.REDIS_CACHE_SHARDS:
+            shards = {'default': cls.get_connection()}
+        else:
+            shards = {
+                '{}:{}/{}'.format(shard['host'], shard['port'], shard['db']): create_connection(
+                    shard['host'],
+                    shard['port'],
+                    shard['db'],
+                )
+                for shard in settings.REDIS_CACHE_SHARDS
+            }
+        cls.cache_conn = ShardedRedis(shards)
+        return cls.cache_conn
+
+    @classmethod
+    def get_cache_connection(cls, key):
+        # the redis instance that holds this cache key
+        return cls.get_sharded_connection().get_shard(key)
+
     @classmethod
     def clear(cls):
         # clear all keys in redis, for testing purpose
         if not settings.TESTING:
             raise Exception("You can not flush redis in production environment")
         conn = cls.get_connection()
-        conn.flushdb()
\ No newline at end of file
+        conn.flushdb()
+        cls.get_sharded_connection().flushdb()
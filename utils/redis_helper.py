@@ -1,14 +1,231 @@
 from django.conf import settings
-from django_hbase.models import HBaseModel
+from utils.cache_refresh import recompute_costs, should_refresh_early
 from utils.redis_client import RedisClient
-from utils.redis_serializers import DjangoModelSerializer, HBaseModelSerializer
+from utils.redis_serializers import CompactModelSerializer, get_serializer
+from functools import partial
+import time
+import uuid
+
+
+# the only entry of a cached empty timeline, it can not be mistaken for a
+# serialized object
+EMPTY_CACHE_SENTINEL = b'__empty__'
+# how often the requests waiting for a rebuild check its lock, in seconds
+REBUILD_POLL_INTERVAL = 0.02
+
+
+# every cache operation below is a single round trip to redis, the ones that
+# need to check a key before writing it run as a lua script, atomically
+
+# marks the rebuild lock of a key (KEYS[2]) dirty: its holder reloads the db
+# once more before releasing it, returns false when no rebuild is running.
+# the push scripts call it on every push, a refresh of a cached key
+# overwrites it with what it read from the db and would lose the push too
+MARK_LOCK_DIRTY = """
+local function mark_lock_dirty(lock_key)
+    local value = redis.call('GET', lock_key)
+    if not value then
+        return false
+    end
+    if string.sub(value, -6) ~= ':dirty' then
+        local ttl = redis.call('PTTL', lock_key)
+        redis.call('SET', lock_key, value .. ':dirty', 'PX', math.max(ttl, 1))
+    end
+    return true
+end
+"""
+
+# KEYS[1]: list key, KEYS[2]: rebuild lock of the list
+# ARGV[1]: serialized object, ARGV[2]: list length limit,
+# ARGV[3]: the empty sentinel, dropped once the list has an object
+# 0 when the list is missing and nobody is rebuilding it
+PUSH_IF_EXISTS_SCRIPT = MARK_LOCK_DIRTY + """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    if mark_lock_dirty(KEYS[2]) then
+        return 1
+    end
+    return 0
+end
+redis.call('LPUSH', KEYS[1], ARGV[1])
+if redis.call('LINDEX', KEYS[1], -1) == ARGV[3] then
+    redis.call('RPOP', KEYS[1])
+end
+redis.call('LTRIM', KEYS[1], 0, tonumber(ARGV[2]) - 1)
+mark_lock_dirty(KEYS[2])
+return 1
+"""
+
+# KEYS[1]: counter key, ARGV[1]: delta, nil when the counter is not cached
+INCR_IF_EXISTS_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return false
+end
+return redis.call('INCRBY', KEYS[1], ARGV[1])
+"""
+
+# KEYS[1]: sorted set key, KEYS[2]: rebuild lock of the sorted set
+# ARGV[1]: score, ARGV[2]: serialized object,
+# ARGV[3]: sorted set size limit, the lowest scores (oldest) are trimmed,
+# ARGV[4]: the empty sentinel
+ZADD_IF_EXISTS_SCRIPT = MARK_LOCK_DIRTY + """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    if mark_lock_dirty(KEYS[2]) then
+        return 1
+    end
+    return 0
+end
+redis.call('ZREM', KEYS[1], ARGV[4])
+redis.call('ZADD', KEYS[1], ARGV[1], ARGV[2])
+redis.call('ZREMRANGEBYRANK', KEYS[1], 0, -tonumber(ARGV[3]) - 1)
+mark_lock_dirty(KEYS[2])
+return 1
+"""
+
+# KEYS[1]: the cached key, KEYS[2]: its lock, ARGV[1]: token of the holder, so that a lock that
+# expired and was taken by another request is not released,
+# ARGV[2]: '1' to keep a dirty lock (clean again) instead of releasing it
+# 1 when released, 2 when kept because it was dirty
+RELEASE_LOCK_SCRIPT = """
+local value = redis.call('GET', KEYS[2])
+if value == ARGV[1] .. ':dirty' and ARGV[2] == '1' then
+    local ttl = redis.call('PTTL', KEYS[2])
+    redis.call('SET', KEYS[2], ARGV[1], 'PX', math.max(ttl, 1))
+    return 2
+end
+if value == ARGV[1] or value == ARGV[1] .. ':dirty' then
+    redis.call('DEL', KEYS[2])
+    return 1
+end
+return 0
+"""
 
 
 class RedisHelper:
+    scripts = {}
+
+    @classmethod
+    def run_script(cls, script, keys, args):
+        # all the keys of a script have to live on the shard of the first one
+        conn = RedisClient.get_cache_connection(keys[0])
+        # EVALSHA, the script is only sent again if redis does not know it
+        if script not in cls.scripts:
+            cls.scripts[script] = conn.register_script(script)
+        return cls.scripts[script](keys=keys, args=args, client=conn)
+
+    @classmethod
+    def get_lock_key(cls, key):
+        return 'lock:{}'.format(key)
+
+    @classmethod
+    def acquire_lock(cls, key):
+        # SET NX PX, the lock expires by itself if its holder dies. it lives
+        # on the shard of the key so the push scripts can check it
+        token = uuid.uuid4().hex
+        conn = RedisClient.get_cache_connection(key)
+        if conn.set(cls.get_lock_key(key), token, nx=True, px=int(settings.REDIS_REBUILD_LOCK_TIMEOUT * 1000)):
+            return token
+        return None
+
+    @classmethod
+    def release_lock(cls, key, token, keep_if_dirty=False):
+        """
+        False when the lock was kept because a push marked it dirty
+        (keep_if_dirty only), the holder has to reload the db then
+        """
+        released = cls.run_script(
+            RELEASE_LOCK_SCRIPT,
+            # the first key picks the shard
+            keys=[key, cls.get_lock_key(key)],
+            args=[token, '1' if keep_if_dirty else '0'],
+        )
+        return released != 2
+
+    @classmethod
+    def wait_for_lock(cls, key):
+        # True if the lock was released within REDIS_REBUILD_WAIT seconds
+        lock_key = cls.get_lock_key(key)
+        conn = RedisClient.get_cache_connection(key)
+        deadline = time.monotonic() + settings.REDIS_REBUILD_WAIT
+        while time.monotonic() < deadline:
+            time.sleep(REBUILD_POLL_INTERVAL)
+            if not conn.exists(lock_key):
+                return True
+        return False
+
+    @classmethod
+    def rebuild(cls, key, lazy_load_objects, fill, wait=True):
+        """
+        single flight rebuild of a missing cache key: only the request that
+        gets the lock of the key reads the db and fills the cache, with
+        fill(objects), and gets the objects back.
+
+        the other ones get None, after waiting for the lock to be released
+        when wait is True so that they can read the rebuilt cache. if the
+        rebuild takes more than REDIS_REBUILD_WAIT seconds they read the db
+        themselves, without writing to the cache.
+
+        a push to the key while it is rebuilt marks the lock dirty (the db
+        read may have started before the pushed object was written), the
+        holder then reads the db and fills the cache again before releasing
+        the lock.
+        """
+        token = cls.acquire_lock(key)
+        if token is None:
+            if not wait or cls.wait_for_lock(key):
+                return None
+            return list(lazy_load_objects(settings.REDIS_LIST_LENGTH_LIMIT))
+        released = False
+        try:
+            while not released:
+                started_at = time.monotonic()
+                # 最多只 cache REDIS_LIST_LENGTH_LIMIT 那么多个 objects
+                # 超过这个限制的 objects，就去数据库里读取。一般这个限制会比较大，比如 1000
+                # 因此翻页翻到 1000 的用户访问量会比较少，从数据库读取也不是大问题
+                objects = list(lazy_load_objects(settings.REDIS_LIST_LENGTH_LIMIT))
+                fill(objects)
+                recompute_costs.record(key, time.monotonic() - started_at)
+                released = cls.release_lock(key, token, keep_if_dirty=True)
+            return objects
+        finally:
+            if not released:
+                cls.release_lock(key, token)
+
+    @classmethod
+    def _push_or_rebuild(cls, key, push, lazy_load_objects, fill):
+        """
+        push() returns 0 when the key is missing and nobody rebuilds it, the
+        key is rebuilt from the db then. if another request took the lock in
+        the meantime, push again so that it marks that rebuild dirty.
+        """
+        while not push():
+            if cls.rebuild(key, lazy_load_objects, fill, wait=False) is not None:
+                return
+
+    @classmethod
+    def refresh_ahead(cls, key, expires_in_ms, refresh):
+        """
+        XFetch on a cache hit: calls refresh() once in a while before the key
+        expires (see should_refresh_early), refresh() is expected to queue
+        the rebuild of the key in a celery task, off the request path. the
+        delta of XFetch is the recompute time of the key plus the time the
+        task waits in the celery queue.
+        """
+        # PTTL is -1 for a key without expiry
+        if refresh is None or expires_in_ms < 0:
+            return
+        delta = recompute_costs.average(key, settings.CACHE_XFETCH_DEFAULT_DELTA)
+        delta += settings.CACHE_REFRESH_QUEUE_LATENCY
+        if not should_refresh_early(expires_in_ms / 1000, delta, settings.CACHE_XFETCH_BETA):
+            return
+        # a single refresh of a key is queued at a time
+        refresh_key = 'refresh:{}'.format(key)
+        conn = RedisClient.get_cache_connection(refresh_key)
+        if conn.set(refresh_key, 1, nx=True, ex=settings.REDIS_REBUILD_LOCK_TIMEOUT):
+            refresh()
 
     @classmethod
     def _load_objects_to_cache(cls, key, objects, serializer):
-        conn = RedisClient.get_connection()
+        conn = RedisClient.get_cache_connection(key)
 
         serialized_list = []
         # we cache at most REDIS_LIST_LENGTH_LIMIT objects
@@ -19,92 +236,288 @@ class RedisHelper:
             serialized_data = serializer.serialize(obj)
             serialized_list.append(serialized_data)
 
-        if serialized_list:
-            # *serialized_list here * means pushing the elements one by one
-            conn.rpush(key, *serialized_list)
-            conn.expire(key, settings.REDIS_KEY_EXPIRE_TIME)
+        # redis does not keep empty lists, the sentinel caches an empty
+        # result so that it is not read from the db on every request
+        if not serialized_list:
+            serialized_list = [EMPTY_CACHE_SENTINEL]
+
+        # one MULTI / EXEC round trip, the list is replaced rather than
+        # appended to in case another process filled it in the meantime
+        pipeline = conn.pipeline()
+        pipeline.delete(key)
+        # *serialized_list here * means pushing the elements one by one
+        pipeline.rpush(key, *serialized_list)
+        pipeline.expire(key, settings.REDIS_KEY_EXPIRE_TIME)
+        pipeline.execute()
 
     @classmethod
-    def load_objects(cls, key, lazy_load_objects, serializer=DjangoModelSerializer):
+    def _read_objects(cls, key, serializer, refresh=None):
+        # the cached objects, None on a cache miss
+        pipeline = RedisClient.get_cache_connection(key).pipeline(transaction=False)
 
-        conn = RedisClient.get_connection()
+        # an empty list is never stored (redis deletes empty lists), so an
+        # empty result is a cache miss and no EXISTS round trip is needed
+        pipeline.lrange(key, 0, -1)
+        pipeline.pttl(key)
+        serialized_list, expires_in_ms = pipeline.execute()
+        if not serialized_list:
+            return None
+        objects = []
+        for serialized_data in serialized_list:
+            if serialized_data == EMPTY_CACHE_SENTINEL:
+                continue
+            deserialized_obj = serializer.deserialize(serialized_data)
+            # None is an entry written with another schema version (before
+            # a deploy), the whole list is reloaded and replaced
+            if deserialized_obj is None:
+                return None
+            objects.append(deserialized_obj)
+        cls.refresh_ahead(key, expires_in_ms, refresh)
+        return objects
 
+    @classmethod
+    def load_objects(cls, key, lazy_load_objects, serializer=CompactModelSerializer, refresh=None):
+        """
+        refresh() queues a rebuild of the list off the request path, it is
+        called on a cache hit when the list is about to expire
+        """
         # if exists in cache, we retrieve it and return
-        if conn.exists(key):
-            serialized_list = conn.lrange(key, 0, -1)
-            objects = []
-            for serialized_data in serialized_list:
-                deserialized_obj = serializer.deserialize(serialized_data)
-                objects.append(deserialized_obj)
+        objects = cls._read_objects(key, serializer, refresh)
+        if objects is not None:
             return objects
 
-        # 最多只 cache REDIS_LIST_LENGTH_LIMIT 那么多个 objects
-        # 超过这个限制的 objects，就去数据库里读取。一般这个限制会比较大，比如 1000
-        # 因此翻页翻到 1000 的用户访问量会比较少，从数据库读取也不是大问题
-        objects = lazy_load_objects(settings.REDIS_LIST_LENGTH_LIMIT)
-        cls._load_objects_to_cache(key, objects, serializer)
-
-        # convert to list, in order to keep the return type consistent, because the data inside redis is list
-        return list(objects)
+        objects = cls.rebuild(
+            key,
+            lazy_load_objects,
+            lambda objects: cls._load_objects_to_cache(key, objects, serializer),
+        )
+        if objects is None:
+            # rebuilt by a concurrent request
+            objects = cls._read_objects(key, serializer)
+        if objects is None:
+            objects = list(lazy_load_objects(settings.REDIS_LIST_LENGTH_LIMIT))
+        return objects
 
     @classmethod
-    def push_object(cls, key, obj, lazy_load_objects):
-        if isinstance(obj, HBaseModel):
-            serializer = HBaseModelSerializer
-        else:
-            serializer = DjangoModelSerializer
+    def refresh_objects(cls, key, lazy_load_objects, serializer=CompactModelSerializer):
+        # rebuild the list ahead of its expiry, nothing to do if a rebuild
+        # is already running
+        cls.rebuild(
+            key,
+            lazy_load_objects,
+            lambda objects: cls._load_objects_to_cache(key, objects, serializer),
+            wait=False,
+        )
 
-        conn = RedisClient.get_connection()
+    @classmethod
+    def push_object(cls, key, obj, lazy_load_objects, serializer=CompactModelSerializer):
         # 如果在 cache 里存在，直接把 obj 放在 list 的最前面，然后 trim 一下长度
-        if conn.exists(key):
-            # print(f'push cache hit {key}')
-            serialized_data = serializer.serialize(obj)
-            conn.lpush(key, serialized_data)
-            conn.ltrim(key, 0, settings.REDIS_LIST_LENGTH_LIMIT - 1)
-            return
-
+        # exists, lpush 和 ltrim 在同一个 lua script 里原子地执行
+        serialized_data = serializer.serialize(obj)
+        # key 不存在但正在 rebuild 的话，script 把 rebuild 的 lock 标记为 dirty，
+        # rebuild 会在释放 lock 之前重新从数据库里 load 一次
+        push = partial(
+            cls.run_script,
+            PUSH_IF_EXISTS_SCRIPT,
+            keys=[key, cls.get_lock_key(key)],
+            args=[serialized_data, settings.REDIS_LIST_LENGTH_LIMIT, EMPTY_CACHE_SENTINEL],
+        )
         # 如果 key 不存在，直接从数据库里 load
         # 就不走单个 push 的方式加到 cache 里了
-        objects = lazy_load_objects(settings.REDIS_LIST_LENGTH_LIMIT)
-        cls._load_objects_to_cache(key, objects, serializer)
-        # print(f'push cache miss {key}, len={len(objects)}')
+        cls._push_or_rebuild(
+            key,
+            push,
+            lazy_load_objects,
+            lambda objects: cls._load_objects_to_cache(key, objects, serializer),
+        )
+
+    @classmethod
+    def _load_sorted_objects_to_cache(cls, key, objects, get_score, serializer):
+        mapping = {serializer.serialize(obj): get_score(obj) for obj in objects}
+        # see _load_objects_to_cache
+        if not mapping:
+            mapping = {EMPTY_CACHE_SENTINEL: 0}
+        pipeline = RedisClient.get_cache_connection(key).pipeline()
+        pipeline.delete(key)
+        pipeline.zadd(key, mapping)
+        pipeline.expire(key, settings.REDIS_KEY_EXPIRE_TIME)
+        pipeline.execute()
+
+    @classmethod
+    def _read_sorted_objects(cls, key, serializer, before, after, count, refresh=None):
+        # (objects, is_complete) from the cache, None on a cache miss
+        pipeline = RedisClient.get_cache_connection(key).pipeline(transaction=False)
+        pipeline.zrevrangebyscore(
+            key,
+            '({}'.format(before) if before is not None else '+inf',
+            '({}'.format(after) if after is not None else '-inf',
+            start=0 if count is not None else None,
+            num=count,
+        )
+        pipeline.zcard(key)
+        pipeline.pttl(key)
+        serialized_list, size, expires_in_ms = pipeline.execute()
+        if not size:
+            return None
+        objects = []
+        for serialized_data in serialized_list:
+            if serialized_data == EMPTY_CACHE_SENTINEL:
+                continue
+            deserialized_obj = serializer.deserialize(serialized_data)
+            # written with another schema version, reloaded
+            if deserialized_obj is None:
+                return None
+            objects.append(deserialized_obj)
+        cls.refresh_ahead(key, expires_in_ms, refresh)
+        is_complete = count is None or len(objects) == count or size < settings.REDIS_LIST_LENGTH_LIMIT
+        return objects, is_complete
+
+    @classmethod
+    def load_sorted_objects(
+        cls,
+        key,
+        lazy_load_objects,
+        get_score,
+        serializer=CompactModelSerializer,
+        before=None,
+        after=None,
+        count=None,
+        refresh=None,
+    ):
+        """
+        a range of a sorted set timeline, scored by get_score(obj) (a
+        timestamp in microseconds): the objects with after < score < before,
+        newest first, at most count of them. only that range is read and
+        deserialized, ZREVRANGEBYSCORE, ZCARD and PTTL go in one round trip.
+        refresh() is used as in load_objects.
+
+        returns (objects, is_complete), is_complete is False when the range
+        may go on in the db only: fewer than count objects were found and
+        the sorted set holds REDIS_LIST_LENGTH_LIMIT objects.
+        """
+        result = cls._read_sorted_objects(key, serializer, before, after, count, refresh)
+        if result is not None:
+            return result
+
+        objects = cls.rebuild(
+            key,
+            lazy_load_objects,
+            lambda objects: cls._load_sorted_objects_to_cache(key, objects, get_score, serializer),
+        )
+        if objects is None:
+            # rebuilt by a concurrent request
+            result = cls._read_sorted_objects(key, serializer, before, after, count)
+            if result is not None:
+                return result
+            objects = list(lazy_load_objects(settings.REDIS_LIST_LENGTH_LIMIT))
+        in_range = [
+            obj
+            for obj in objects
+            if (before is None or get_score(obj) < before) and (after is None or get_score(obj) > after)
+        ]
+        if count is not None:
+            in_range = in_range[:count]
+        is_complete = count is None or len(in_range) == count or len(objects) < settings.REDIS_LIST_LENGTH_LIMIT
+        return in_range, is_complete
+
+    @classmethod
+    def refresh_sorted_objects(cls, key, lazy_load_objects, get_score, serializer=CompactModelSerializer):
+        cls.rebuild(
+            key,
+            lazy_load_objects,
+            lambda objects: cls._load_sorted_objects_to_cache(key, objects, get_score, serializer),
+            wait=False,
+        )
+
+    @classmethod
+    def push_sorted_object(cls, key, obj, lazy_load_objects, get_score, serializer=CompactModelSerializer):
+        # ZADD then ZREMRANGEBYRANK down to REDIS_LIST_LENGTH_LIMIT, only if
+        # the sorted set is cached, atomically in one lua script
+        push = partial(
+            cls.run_script,
+            ZADD_IF_EXISTS_SCRIPT,
+            keys=[key, cls.get_lock_key(key)],
+            args=[get_score(obj), serializer.serialize(obj), settings.REDIS_LIST_LENGTH_LIMIT, EMPTY_CACHE_SENTINEL],
+        )
+        cls._push_or_rebuild(
+            key,
+            push,
+            lazy_load_objects,
+            lambda objects: cls._load_sorted_objects_to_cache(key, objects, get_score, serializer),
+        )
+
+    @classmethod
+    def get_object_key(cls, model_class, object_id):
+        return 'object:{}:{}'.format(model_class.__name__, object_id)
+
+    @classmethod
+    def get_objects(cls, model_class, object_ids, serializer=None):
+        """
+        {object_id: object} from the shared object cache, with one MGET per
+        shard. the missing objects are read from the db with a single query
+        and written back, the ids that are not in the db are left out.
+        """
+        serializer = serializer or get_serializer(model_class)
+        object_ids = list(dict.fromkeys(object_ids))
+        if not object_ids:
+            return {}
+        keys = [cls.get_object_key(model_class, object_id) for object_id in object_ids]
+        sharded_conn = RedisClient.get_sharded_connection()
+
+        objects = {}
+        for object_id, serialized_data in zip(object_ids, sharded_conn.mget(keys)):
+            if serialized_data is None:
+                continue
+            obj = serializer.deserialize(serialized_data)
+            if obj is not None:
+                objects[object_id] = obj
+
+        missing_ids = [object_id for object_id in object_ids if object_id not in objects]
+        if missing_ids:
+            loaded_objects = list(model_class.objects.filter(id__in=missing_ids))
+            sharded_conn.set_many({
+                cls.get_object_key(model_class, obj.id): serializer.serialize(obj)
+                for obj in loaded_objects
+            }, ex=settings.REDIS_KEY_EXPIRE_TIME)
+            for obj in loaded_objects:
+                objects[obj.id] = obj
+        return objects
+
+    @classmethod
+    def invalidate_object(cls, model_class, object_id):
+        key = cls.get_object_key(model_class, object_id)
+        RedisClient.get_cache_connection(key).delete(key)
 
     @classmethod
     def get_count_key(cls, obj, attr):
         return '{}.{}:{}'.format(obj.__class__.__name__, attr, obj.id)
 
     @classmethod
-    def incr_count(cls, obj, attr):
-        conn = RedisClient.get_connection()
+    def _add_to_count(cls, obj, attr, delta):
         key = cls.get_count_key(obj, attr)
-        if not conn.exists(key):
-            # back fill from db to cache
-            # we don't do +1 operation here, we need to ensure that before we call decr_count
-            # obj.attr is already updated in db
-            obj.refresh_from_db()
-            conn.set(key, getattr(obj, attr))
-            conn.expire(key, settings.REDIS_KEY_EXPIRE_TIME)
-            return getattr(obj, attr)
-        return conn.incr(key)
+        count = cls.run_script(INCR_IF_EXISTS_SCRIPT, keys=[key], args=[delta])
+        if count is not None:
+            return count
+        # back fill from db to cache
+        # we don't do +1 operation here, we need to ensure that before we call incr_count / decr_count
+        # obj.attr is already updated in db
+        obj.refresh_from_db()
+        count = getattr(obj, attr)
+        RedisClient.get_cache_connection(key).set(key, count, ex=settings.REDIS_KEY_EXPIRE_TIME)
+        return count
+
+    @classmethod
+    def incr_count(cls, obj, attr):
+        return cls._add_to_count(obj, attr, 1)
 
     @classmethod
     def decr_count(cls, obj, attr):
-        conn = RedisClient.get_connection()
-        key = cls.get_count_key(obj, attr)
-        if not conn.exists(key):
-            obj.refresh_from_db()
-            # back fill from db to cache
-            # we don't do +1 operation here, we need to ensure that before we call decr_count
-            # obj.attr is already updated in db
-            conn.set(key, getattr(obj, attr))
-            conn.expire(key, settings.REDIS_KEY_EXPIRE_TIME)
-            return getattr(obj, attr)
-        return conn.decr(key)
+        return cls._add_to_count(obj, attr, -1)
 
     @classmethod
     def get_count(cls, obj, attr):
-        conn = RedisClient.get_connection()
         key = cls.get_count_key(obj, attr)
+        conn = RedisClient.get_cache_connection(key)
         count = conn.get(key)
         if count is not None:
             return int(count)
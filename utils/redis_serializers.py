@@ -1,8 +1,17 @@
+from datetime import datetime, timedelta, timezone
+from django.apps import apps
+from django.conf import settings
 from django.core import serializers
+from django.db.models import DateTimeField
+from django.utils.timezone import is_aware
 from django_hbase.models import HBaseModel
 from utils.json_encoder import JSONEncoder
 
 import json
+import zlib
+
+
+EPOCH = datetime(1970, 1, 1)
 
 
 class DjangoModelSerializer:
@@ -24,10 +33,17 @@ class HBaseModelSerializer:
 
     @classmethod
     def get_model_class(cls, model_class_name):
+        model_class = cls.find_model_class(model_class_name)
+        if model_class is None:
+            raise Exception('HBaseModel {} not found'.format(model_class_name))
+        return model_class
+
+    @classmethod
+    def find_model_class(cls, model_class_name):
         for subclass in HBaseModel.__subclasses__():
             if subclass.__name__ == model_class_name:
                 return subclass
-        raise Exception('HBaseModel {} not found'.format(model_class_name))
+        return None
 
     @classmethod
     def serialize(cls, instance):
@@ -42,4 +58,202 @@ class HBaseModelSerializer:
         json_data = json.loads(serialized_data)
         model_class = cls.get_model_class(json_data['model_class_name'])
         del json_data['model_class_name']
-        return model_class(**json_data)
\ No newline at end of file
+        return model_class(**json_data)
+
+
+class ModelSpec:
+    """
+    the fields of a model that the compact serializer stores, in order,
+    with a schema version header derived from them
+    """
+
+    def __init__(self, label, model_class, field_names, datetime_fields):
+        self.label = label
+        self.model_class = model_class
+        self.field_names = tuple(field_names)
+        self.datetime_fields = frozenset(datetime_fields)
+        self.datetime_positions = tuple(
+            position
+            for position, key in enumerate(self.field_names)
+            if key in self.datetime_fields
+        )
+        self.is_hbase = issubclass(model_class, HBaseModel)
+        # the format byte is 0x80 - 0xff, so it can not be mistaken for the
+        # first byte of an entry written by the json serializers ('[' or '{').
+        # the 4 bytes crc32 of the field list make two schemas of a model
+        # collide with a probability of 1 / 2 ** 32
+        fingerprint = '{}|{}|{}'.format(
+            label,
+            ','.join(self.field_names),
+            ','.join(sorted(self.datetime_fields)),
+        )
+        self.version = (
+            bytes([0x80 | CompactModelSerializer.format_version])
+            + zlib.crc32(fingerprint.encode('utf-8')).to_bytes(4, 'big')
+        )
+
+
+class CompactModelSerializer:
+    """
+    a cache entry is a 5 bytes schema version (the format byte and the
+    crc32 of the field list) followed by the json list
+    [model label, value1, value2, ...] of the fields in declaration order:
+
+        0x82 0x1c3a9f07 ["tweets.Tweet",1,2,"hello",1600000000000000,0,0]
+
+    field names are not repeated in every entry and instances are rebuilt
+    with Model.from_db, without the django deserializer machinery. the
+    version changes with the field list, so entries written before a
+    deploy that changed a model are dropped (deserialize returns None).
+
+    works for django models and HBaseModels, register() can restrict the
+    cached fields of a model, the other ones are deferred.
+    """
+
+    # bump to drop every cached entry after changing the encoding, < 0x80
+    format_version = 2
+    version_length = 5
+    specs = {}
+
+    @classmethod
+    def register(cls, model_class, fields=None):
+        if issubclass(model_class, HBaseModel):
+            label = 'hbase.{}'.format(model_class.__name__)
+            field_names = list(fields or model_class.get_field_hash())
+            datetime_fields = ()
+        else:
+            label = model_class._meta.label
+            model_fields = [
+                field
+                for field in model_class._meta.concrete_fields
+                if fields is None or field.name in fields or field.attname in fields
+            ]
+            field_names = [field.attname for field in model_fields]
+            datetime_fields = [
+                field.attname
+                for field in model_fields
+                if isinstance(field, DateTimeField)
+            ]
+        spec = ModelSpec(label, model_class, field_names, datetime_fields)
+        cls.specs[label] = spec
+        cls.specs[model_class] = spec
+        return spec
+
+    @classmethod
+    def get_spec(cls, model_class):
+        # HBaseModel instances are created from a record class of the model
+        model_class = getattr(model_class, '_model_class', model_class)
+        spec = cls.specs.get(model_class)
+        if spec is None:
+            spec = cls.register(model_class)
+        return spec
+
+    @classmethod
+    def get_spec_by_label(cls, label):
+        spec = cls.specs.get(label)
+        if spec is not None:
+            return spec
+        if label.startswith('hbase.'):
+            model_class = HBaseModelSerializer.find_model_class(label[len('hbase.'):])
+        else:
+            try:
+                model_class = apps.get_model(label)
+            except (LookupError, ValueError):
+                model_class = None
+        if model_class is None:
+            # a model that was removed or renamed since the entry was written
+            return None
+        return cls.register(model_class)
+
+    @classmethod
+    def serialize(cls, instance):
+        spec = cls.get_spec(type(instance))
+        values = [getattr(instance, key) for key in spec.field_names]
+        for position in spec.datetime_positions:
+            values[position] = encode_datetime(values[position])
+        data = json.dumps([spec.label] + values, separators=(',', ':'), ensure_ascii=False)
+        return spec.version + data.encode('utf-8')
+
+    @classmethod
+    def deserialize(cls, serialized_data):
+        try:
+            values = json.loads(serialized_data[cls.version_length:])
+        except ValueError:
+            return None
+        if not isinstance(values, list) or not values:
+            return None
+        spec = cls.get_spec_by_label(values[0])
+        if (
+            spec is None
+            or serialized_data[:cls.version_length] != spec.version
+            or len(values) != len(spec.field_names) + 1
+        ):
+            return None
+        values = values[1:]
+        for position in spec.datetime_positions:
+            values[position] = decode_datetime(values[position])
+        if spec.is_hbase:
+            return spec.model_class(**dict(zip(spec.field_names, values)))
+        return spec.model_class.from_db(None, spec.field_names, values)
+
+
+class TimelineEntrySerializer:
+    """
+    the entries of a normalized timeline list only hold the object id and
+    its created_at in microseconds, the object itself lives once in the
+    shared object cache (RedisHelper.get_objects):
+
+        b'42:1600000000000000'
+
+    get_entry(obj) gives the (object_id, created_at) pair to store,
+    build_object(object_id, created_at) the lightweight object a list entry
+    is turned back into, hydrated later for the page that is returned.
+    """
+
+    def __init__(self, get_entry, build_object):
+        self.get_entry = get_entry
+        self.build_object = build_object
+
+    def serialize(self, instance):
+        object_id, created_at = self.get_entry(instance)
+        return '{}:{}'.format(object_id, created_at).encode('utf-8')
+
+    def deserialize(self, serialized_data):
+        # an entry of the other layout, after switching the setting
+        try:
+            object_id, created_at = map(int, serialized_data.split(b':'))
+        except ValueError:
+            return None
+        return self.build_object(object_id, created_at)
+
+
+# model class -> serializer of its cached instances, the models that are
+# not registered are cached with CompactModelSerializer. the entries already
+# cached for a model have to be dropped when its serializer is changed
+SERIALIZERS = {}
+
+
+def register_serializer(model_class, serializer):
+    SERIALIZERS[model_class] = serializer
+
+
+def get_serializer(model_class):
+    # HBaseModel instances are created from a record class of the model
+    model_class = getattr(model_class, '_model_class', model_class)
+    return SERIALIZERS.get(model_class, CompactModelSerializer)
+
+
+def encode_datetime(value):
+    # microseconds since the epoch, in UTC
+    if value is None:
+        return None
+    if is_aware(value):
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return (value - EPOCH) // timedelta(microseconds=1)
+
+
+def decode_datetime(value):
+    if value is None:
+        return None
+    value = EPOCH + timedelta(microseconds=value)
+    return value.replace(tzinfo=timezone.utc) if settings.USE_TZ else value
@@ -0,0 +1,12 @@
+from celery import shared_task
+from django.apps import apps
+from utils.time_constants import ONE_MINUTE
+
+
+@shared_task(routing_key='default', time_limit=ONE_MINUTE)
+def refresh_cached_object_task(model_label, object_id):
+    # rebuilds a memcached object ahead of its expiry, the model is passed
+    # by label ('tweets.Tweet') because celery can not serialize a class
+    from utils.memcached_helper import MemcachedHelper
+
+    MemcachedHelper.refresh_cached_object(apps.get_model(model_label), object_id)
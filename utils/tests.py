@@ -1,5 +1,54 @@
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser, User
+from django.db import connection
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from django_hbase.models import HBaseModel, IntegerField, TimestampField
+from newsfeeds.models import HBaseNewsFeed
+from rest_framework.request import Request
 from testing.testcases import TestCase
-from utils.redis_client import RedisClient
+from tweets.api.serializers import TweetSerializer
+from tweets.models import Tweet
+from unittest import mock
+from utils.cache_refresh import CacheEntry, recompute_costs, should_refresh_early
+from utils.memcached_helper import MemcachedHelper, cache
+from utils.paginations import EndlessPagination
+from utils.redis_client import RedisClient, ShardedRedis, create_connection
+from utils.redis_helper import EMPTY_CACHE_SENTINEL, RedisHelper
+from utils.redis_serializers import (
+    SERIALIZERS,
+    CompactModelSerializer,
+    DjangoModelSerializer,
+    get_serializer,
+    register_serializer,
+)
+import threading
+import time
+
+
+class HBaseAscendingTimeline(HBaseModel):
+    # the layout of the timelines before HBASE_NEWEST_FIRST_TIMELINES
+    __slots__ = ()
+
+    user_id = IntegerField(reverse=True)
+    created_at = TimestampField()
+    tweet_id = IntegerField(column_family='cf')
+
+    class Meta:
+        table_name = 'ascending_timelines'
+        row_key = ('user_id', 'created_at')
+
+
+class HBaseDescendingTimeline(HBaseModel):
+    __slots__ = ()
+
+    user_id = IntegerField(reverse=True)
+    created_at = TimestampField(descending=True)
+    tweet_id = IntegerField(column_family='cf')
+
+    class Meta:
+        table_name = 'descending_timelines'
+        row_key = ('user_id', 'created_at')
 
 
 class UtilsTests(TestCase):
@@ -18,4 +67,369 @@ class UtilsTests(TestCase):
 
         RedisClient.clear()
         cached_list = conn.lrange('redis_key', 0, -1)
-        self.assertEqual(cached_list, [])
\ No newline at end of file
+        self.assertEqual(cached_list, [])
+    def test_redis_helper(self):
+        conn = RedisClient.get_connection()
+        user = self.create_user('linghu')
+        tweets = [self.create_tweet(user, content=str(i)) for i in range(3)]
+
+        def lazy_load(limit):
+            return tweets[:limit]
+
+        # a missing list is not pushed to, it is rebuilt from the db
+        RedisHelper.push_object('missing', tweets[0], lambda limit: [])
+        self.assertEqual(conn.lrange('missing', 0, -1), [EMPTY_CACHE_SENTINEL])
+        loaded = RedisHelper.load_objects('tweets', lazy_load)
+        self.assertEqual([tweet.id for tweet in loaded], [tweet.id for tweet in tweets])
+        self.assertTrue(conn.ttl('tweets') > 0)
+
+        # pushed to the front and trimmed to REDIS_LIST_LENGTH_LIMIT
+        with self.settings(REDIS_LIST_LENGTH_LIMIT=3):
+            RedisHelper.push_object('tweets', tweets[2], lazy_load)
+        loaded = RedisHelper.load_objects('tweets', lambda limit: [])
+        self.assertEqual([tweet.id for tweet in loaded], [tweets[2].id, tweets[0].id, tweets[1].id])
+
+        # counters are back filled from the db, then increased in redis
+        tweet = tweets[0]
+        self.assertEqual(RedisHelper.incr_count(tweet, 'likes_count'), tweet.likes_count)
+        self.assertEqual(RedisHelper.incr_count(tweet, 'likes_count'), tweet.likes_count + 1)
+        self.assertEqual(RedisHelper.decr_count(tweet, 'likes_count'), tweet.likes_count)
+        self.assertEqual(RedisHelper.get_count(tweet, 'likes_count'), tweet.likes_count)
+
+    def test_empty_cache_sentinel(self):
+        conn = RedisClient.get_connection()
+        user = self.create_user('linghu')
+        calls = []
+
+        def lazy_load(limit):
+            calls.append(limit)
+            return []
+
+        # an empty result is cached, the db is read once
+        self.assertEqual(RedisHelper.load_objects('tweets', lazy_load), [])
+        self.assertEqual(RedisHelper.load_objects('tweets', lazy_load), [])
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(RedisHelper.load_sorted_objects('timeline', lazy_load, lambda obj: 0), ([], True))
+        self.assertEqual(RedisHelper.load_sorted_objects('timeline', lazy_load, lambda obj: 0), ([], True))
+        self.assertEqual(len(calls), 2)
+
+        # the sentinel is dropped by the first push
+        tweet = self.create_tweet(user)
+        RedisHelper.push_object('tweets', tweet, lazy_load)
+        self.assertEqual(conn.llen('tweets'), 1)
+        self.assertEqual([t.id for t in RedisHelper.load_objects('tweets', lazy_load)], [tweet.id])
+        RedisHelper.push_sorted_object('timeline', tweet, lazy_load, lambda obj: 1)
+        self.assertEqual(conn.zcard('timeline'), 1)
+        objects, _ = RedisHelper.load_sorted_objects('timeline', lazy_load, lambda obj: 1)
+        self.assertEqual([t.id for t in objects], [tweet.id])
+        self.assertEqual(len(calls), 2)
+
+    def test_single_flight_rebuild(self):
+        user = self.create_user('linghu')
+        tweets = [self.create_tweet(user, content=str(i)) for i in range(3)]
+        calls = []
+        results = []
+
+        def lazy_load(limit):
+            calls.append(limit)
+            # slow enough for every thread to miss the cache
+            time.sleep(0.2)
+            return tweets[:limit]
+
+        def load():
+            results.append(RedisHelper.load_objects('tweets', lazy_load))
+
+        threads = [threading.Thread(target=load) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # one rebuild, the other threads read what it cached
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(len(results), 8)
+        for objects in results:
+            self.assertEqual([tweet.id for tweet in objects], [tweet.id for tweet in tweets])
+        self.assertEqual(RedisClient.get_connection().llen('tweets'), 3)
+        self.assertFalse(RedisClient.get_connection().exists('lock:tweets'))
+
+        # a rebuild that takes too long, the waiting requests read the db
+        token = RedisHelper.acquire_lock('tweets2')
+        with self.settings(REDIS_REBUILD_WAIT=0.05):
+            objects = RedisHelper.load_objects('tweets2', lambda limit: tweets[:limit])
+        self.assertEqual([tweet.id for tweet in objects], [tweet.id for tweet in tweets])
+        self.assertFalse(RedisClient.get_connection().exists('tweets2'))
+        RedisHelper.release_lock('tweets2', token)
+
+    def test_push_during_rebuild(self):
+        conn = RedisClient.get_connection()
+        user = self.create_user('linghu')
+        tweets = [self.create_tweet(user, content=str(i)) for i in range(3)][::-1]
+        new_tweet = self.create_tweet(user, content='new')
+        get_score = lambda tweet: tweet.id
+
+        def make_lazy_load(push):
+            calls = []
+
+            # the db read of the rebuild misses new_tweet, which is created
+            # and pushed before the rebuild fills the cache
+            def lazy_load(limit):
+                calls.append(limit)
+                if len(calls) == 1:
+                    push()
+                    return tweets[:limit]
+                return ([new_tweet] + tweets)[:limit]
+            return lazy_load, calls
+
+        lazy_load, calls = make_lazy_load(
+            lambda: RedisHelper.push_object('tweets', new_tweet, lambda limit: self.fail('rebuilt twice')),
+        )
+        objects = RedisHelper.load_objects('tweets', lazy_load)
+        # the push marked the rebuild dirty, it read the db once more
+        self.assertEqual(len(calls), 2)
+        self.assertEqual([tweet.id for tweet in objects], [new_tweet.id] + [tweet.id for tweet in tweets])
+        self.assertEqual(conn.llen('tweets'), 4)
+        self.assertFalse(conn.exists('lock:tweets'))
+
+        lazy_load, calls = make_lazy_load(
+            lambda: RedisHelper.push_sorted_object(
+                'timeline', new_tweet, lambda limit: self.fail('rebuilt twice'), get_score,
+            ),
+        )
+        objects, _ = RedisHelper.load_sorted_objects('timeline', lazy_load, get_score)
+        self.assertEqual(len(calls), 2)
+        self.assertEqual([tweet.id for tweet in objects], [new_tweet.id] + [tweet.id for tweet in tweets])
+        self.assertEqual(conn.zcard('timeline'), 4)
+        self.assertFalse(conn.exists('lock:timeline'))
+
+        # a refresh of a cached list reads the db again after a push
+        newer_tweet = self.create_tweet(user, content='newer')
+        lazy_load, calls = make_lazy_load(
+            lambda: RedisHelper.push_object('tweets', newer_tweet, lambda limit: self.fail('rebuilt')),
+        )
+        tweets.insert(0, new_tweet)
+        new_tweet = newer_tweet
+        RedisHelper.refresh_objects('tweets', lazy_load)
+        self.assertEqual(len(calls), 2)
+        objects = RedisHelper.load_objects('tweets', lambda limit: self.fail('read the db'))
+        self.assertEqual([tweet.id for tweet in objects], [new_tweet.id] + [tweet.id for tweet in tweets])
+
+    def test_refresh_ahead(self):
+        self.clear_cache()
+        recompute_costs.reset()
+        conn = RedisClient.get_connection()
+        user = self.create_user('linghu')
+        tweets = [self.create_tweet(user, content=str(i)) for i in range(3)]
+        refreshes = []
+
+        # a key about to expire is refreshed, one far from it is not
+        self.assertTrue(should_refresh_early(0, 0.1, 1))
+        self.assertFalse(should_refresh_early(86400, 0.1, 1))
+        with mock.patch('utils.cache_refresh.random.random', return_value=0.99):
+            self.assertTrue(should_refresh_early(0.4, 0.1, 1))
+            self.assertFalse(should_refresh_early(0.4, 0.1, 0.5))
+
+        # the rebuild time is tracked per key pattern
+        RedisHelper.load_objects('tweets:1', lambda limit: tweets[:limit])
+        self.assertEqual(recompute_costs.stats()['tweets']['count'], 1)
+
+        # the cached list is served and a single refresh is queued
+        RedisHelper.load_objects('tweets:1', lambda limit: [], refresh=lambda: refreshes.append(1))
+        self.assertEqual(refreshes, [])
+        conn.expire('tweets:1', 60)
+        # the odds for a key that expires in a minute, with a large beta
+        with self.settings(CACHE_XFETCH_BETA=10 ** 9):
+            for _ in range(3):
+                loaded = RedisHelper.load_objects('tweets:1', lambda limit: [], refresh=lambda: refreshes.append(1))
+                self.assertEqual([tweet.id for tweet in loaded], [tweet.id for tweet in tweets])
+        self.assertEqual(refreshes, [1])
+
+        # the celery queue latency counts in the delta, with the db read of
+        # a few ms a key that expires in a second is refreshed in time
+        conn.delete('refresh:tweets:2')
+        with mock.patch('utils.cache_refresh.random.random', return_value=0.5):
+            RedisHelper.refresh_ahead('tweets:2', 1000, lambda: refreshes.append(2))
+            with self.settings(CACHE_REFRESH_QUEUE_LATENCY=0):
+                RedisHelper.refresh_ahead('tweets:3', 1000, lambda: refreshes.append(3))
+        self.assertEqual(refreshes, [1, 2])
+
+        # memcached objects are refreshed in a celery task
+        MemcachedHelper.get_object_through_cache(Tweet, tweets[0].id)
+        key = MemcachedHelper.get_key(Tweet, tweets[0].id)
+        entry = cache.get(key)
+        self.assertEqual(entry.value, tweets[0])
+        Tweet.objects.filter(id=tweets[0].id).update(content='refreshed')
+        self.assertEqual(MemcachedHelper.get_object_through_cache(Tweet, tweets[0].id).content, '0')
+        cache.set(key, CacheEntry(entry.value, time.time(), entry.delta))
+        self.assertEqual(MemcachedHelper.get_object_through_cache(Tweet, tweets[0].id).content, '0')
+        self.assertEqual(MemcachedHelper.get_object_through_cache(Tweet, tweets[0].id).content, 'refreshed')
+
+    def test_get_objects_through_cache(self):
+        self.clear_cache()
+        users = [self.create_user('user{}'.format(i)) for i in range(3)]
+        user_ids = [user.id for user in users]
+
+        # the misses are read with one query, then from the cache
+        recompute_costs.reset()
+        with self.assertNumQueries(1):
+            objects = MemcachedHelper.get_objects_through_cache(User, user_ids + [user_ids[0], -1])
+        self.assertEqual(objects, {user.id: user for user in users})
+        self.assertEqual(recompute_costs.stats()['User']['count'], 1)
+        with self.assertNumQueries(0):
+            objects = MemcachedHelper.get_objects_through_cache(User, user_ids)
+            self.assertEqual(MemcachedHelper.get_object_through_cache(User, user_ids[1]), users[1])
+        self.assertEqual([objects[user_id].username for user_id in user_ids], ['user0', 'user1', 'user2'])
+
+        # a page of tweets fetches its users, then their profiles, together
+        tweets = [self.create_tweet(user) for user in users]
+        for user in users:
+            user.profile
+        self.clear_cache()
+        request = RequestFactory().get('/')
+        request.user = AnonymousUser()
+        with CaptureQueriesContext(connection) as context:
+            data = TweetSerializer(tweets, many=True, context={'request': request}).data
+        user_queries = [query for query in context.captured_queries if 'FROM "auth_user"' in query['sql']]
+        self.assertEqual(len(user_queries), 1)
+        profile_queries = [query for query in context.captured_queries if 'FROM "accounts_userprofile"' in query['sql']]
+        self.assertEqual(len(profile_queries), 1)
+        self.assertEqual([tweet['user']['username'] for tweet in data], ['user0', 'user1', 'user2'])
+
+    def test_sorted_set_timeline(self):
+        conn = RedisClient.get_connection()
+        user = self.create_user('linghu')
+        tweets = [self.create_tweet(user, content=str(i)) for i in range(5)][::-1]
+        scores = [int(tweet.created_at.timestamp() * 1000000) for tweet in tweets]
+
+        def get_score(tweet):
+            return scores[tweets.index(tweet)]
+
+        def load(lazy_load=lambda limit: tweets[:limit], **kwargs):
+            objects, is_complete = RedisHelper.load_sorted_objects('timeline', lazy_load, get_score, **kwargs)
+            return [tweet.id for tweet in objects], is_complete
+
+        # the cache miss is answered from the loaded objects
+        self.assertEqual(load(count=2), ([tweets[0].id, tweets[1].id], True))
+        self.assertEqual(conn.zcard('timeline'), 5)
+        self.assertTrue(conn.ttl('timeline') > 0)
+
+        # then the ranges are read from redis only
+        no_db = lambda limit: self.fail('read the db')
+        self.assertEqual(load(no_db, before=scores[1], count=2), ([tweets[2].id, tweets[3].id], True))
+        self.assertEqual(load(no_db, before=scores[3], count=3), ([tweets[4].id], True))
+        self.assertEqual(load(no_db, after=scores[2]), ([tweets[0].id, tweets[1].id], True))
+        # a full sorted set may miss the older objects
+        with self.settings(REDIS_LIST_LENGTH_LIMIT=5):
+            self.assertEqual(load(no_db, before=scores[3], count=3), ([tweets[4].id], False))
+
+        # pushed and trimmed to REDIS_LIST_LENGTH_LIMIT, oldest first
+        tweet = self.create_tweet(user, content='new')
+        scores.insert(0, scores[0] + 1)
+        tweets.insert(0, tweet)
+        with self.settings(REDIS_LIST_LENGTH_LIMIT=3):
+            RedisHelper.push_sorted_object('timeline', tweet, no_db, get_score)
+        self.assertEqual(load(no_db), ([tweet.id for tweet in tweets[:3]], True))
+
+        # a missing sorted set is not pushed to, it is rebuilt from the db
+        RedisHelper.push_sorted_object('missing', tweet, lambda limit: [], get_score)
+        self.assertEqual(conn.zrange('missing', 0, -1), [EMPTY_CACHE_SENTINEL])
+
+    def test_sharded_redis(self):
+        shards = {
+            'shard{}'.format(db): create_connection(settings.REDIS_HOST, settings.REDIS_PORT, db)
+            for db in (3, 4, 5)
+        }
+        sharded = ShardedRedis(shards)
+        sharded.flushdb()
+        keys = ['user_newsfeeds:{}'.format(user_id) for user_id in range(100)]
+        for key in keys:
+            sharded.get_shard(key).set(key, key)
+        # every shard gets a share of the keys, each key on a single shard
+        counts = [conn.dbsize() for conn in shards.values()]
+        self.assertEqual(sum(counts), 100)
+        self.assertTrue(all(count > 10 for count in counts))
+        self.assertEqual(sharded.get_shard_name(keys[0]), sharded.get_shard_name(keys[0].encode('utf-8')))
+
+        # multi key commands are grouped per shard, values keep the keys order
+        self.assertEqual(sharded.mget(keys[:10] + ['missing']), [key.encode('utf-8') for key in keys[:10]] + [None])
+        self.assertEqual(sharded.exists(*keys[:10]), 10)
+        self.assertEqual(sharded.delete(*keys[:10]), 10)
+        self.assertEqual(sharded.mget(keys[:2]), [None, None])
+
+        # removing a shard only moves the keys that were on it
+        smaller = ShardedRedis({name: conn for name, conn in shards.items() if name != 'shard5'})
+        moved = [key for key in keys if sharded.get_shard_name(key) != smaller.get_shard_name(key)]
+        self.assertTrue(all(sharded.get_shard_name(key) == 'shard5' for key in moved))
+        sharded.flushdb()
+
+    def test_compact_model_serializer(self):
+        user = self.create_user('linghu')
+        tweet = self.create_tweet(user, content='你好 "quoted"')
+        tweet.refresh_from_db()
+        data = CompactModelSerializer.serialize(tweet)
+        spec = CompactModelSerializer.get_spec(Tweet)
+        self.assertEqual(data[:5], spec.version)
+        self.assertTrue(data[0] >= 0x80)
+        cached_tweet = CompactModelSerializer.deserialize(data)
+        self.assertEqual(cached_tweet, tweet)
+        self.assertEqual(cached_tweet.content, tweet.content)
+        self.assertEqual(cached_tweet.created_at, tweet.created_at)
+        self.assertEqual(cached_tweet.user_id, user.id)
+        self.assertFalse(cached_tweet._state.adding)
+        # smaller than the django json serializer
+        self.assertTrue(len(data) < len(DjangoModelSerializer.serialize(tweet)))
+
+        newsfeed = HBaseNewsFeed(user_id=1, created_at=1600000000000000, tweet_id=tweet.id)
+        cached_newsfeed = CompactModelSerializer.deserialize(CompactModelSerializer.serialize(newsfeed))
+        self.assertIsInstance(cached_newsfeed, HBaseNewsFeed)
+        self.assertEqual(cached_newsfeed.to_dict(), newsfeed.to_dict())
+
+        # entries of another schema version or format are dropped
+        self.assertEqual(CompactModelSerializer.deserialize(data[:4] + bytes([data[4] ^ 1]) + data[5:]), None)
+        self.assertEqual(CompactModelSerializer.deserialize(bytes([data[0] ^ 1]) + data[1:]), None)
+        self.assertEqual(CompactModelSerializer.deserialize(DjangoModelSerializer.serialize(tweet).encode('utf-8')), None)
+        self.assertEqual(CompactModelSerializer.deserialize(b'\x82\x00\x00\x00\x00["missing.Model",1]'), None)
+        conn = RedisClient.get_connection()
+        conn.rpush('tweets', DjangoModelSerializer.serialize(tweet))
+        loaded = RedisHelper.load_objects('tweets', lambda limit: [tweet])
+        self.assertEqual(loaded, [tweet])
+        self.assertEqual(conn.lrange('tweets', 0, -1), [data])
+
+    def test_serializer_registry(self):
+        user = self.create_user('linghu')
+        tweet = self.create_tweet(user)
+        self.assertEqual(get_serializer(Tweet), CompactModelSerializer)
+        self.assertEqual(get_serializer(HBaseNewsFeed._record_class), CompactModelSerializer)
+
+        register_serializer(Tweet, DjangoModelSerializer)
+        try:
+            self.assertEqual(get_serializer(Tweet), DjangoModelSerializer)
+            self.assertEqual(get_serializer(HBaseNewsFeed), CompactModelSerializer)
+            self.assertEqual(RedisHelper.get_objects(Tweet, [tweet.id]), {tweet.id: tweet})
+            key = RedisHelper.get_object_key(Tweet, tweet.id)
+            cached = RedisClient.get_cache_connection(key).get(key)
+            self.assertEqual(DjangoModelSerializer.deserialize(cached), tweet)
+        finally:
+            del SERIALIZERS[Tweet]
+
+
+class PaginationTests(TestCase):
+
+    def test_paginate_hbase(self):
+        def paginate(model_class, **params):
+            paginator = EndlessPagination()
+            paginator.page_size = 3
+            request = Request(RequestFactory().get('/', params))
+            objects = paginator.paginate_hbase(model_class, (1,), request)
+            return [obj.created_at for obj in objects], paginator.has_next_page
+
+        # newest first on both layouts, a reversed scan on the ascending one
+        for model_class in (HBaseAscendingTimeline, HBaseDescendingTimeline):
+            for created_at in range(100, 110):
+                model_class.create(user_id=1, created_at=created_at, tweet_id=created_at)
+            model_class.create(user_id=2, created_at=105, tweet_id=0)
+
+            self.assertEqual(paginate(model_class), ([109, 108, 107], True))
+            self.assertEqual(paginate(model_class, created_at__lt=107), ([106, 105, 104], True))
+            self.assertEqual(paginate(model_class, created_at__lt=102), ([101, 100], False))
+            self.assertEqual(paginate(model_class, created_at__gt=106), ([109, 108, 107], False))
@@ -1,5 +1,7 @@
 # in seconds
-ONE_HOUR = 60 * 60
+ONE_MINUTE = 60
+ONE_HOUR = 60 * ONE_MINUTE
+ONE_DAY = 24 * ONE_HOUR
 
 
 # in micro seconds